@@ -0,0 +1,23 @@
+"""Performance benchmarks. Each module can be run on its own, e.g. `python -m benchmarks.translation`.
+
+benchmarks.suite runs the regression suite, saving its results as JSON and comparing them against a baseline."""
+import os
+import time
+from typing import Callable
+
+
+def setup_django() -> None:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def measure_rate(func: Callable[[], int], repeat: int=5) -> float:
+    """Best of `repeat` runs of func, which returns the number of operations it performed, in operations / second"""
+    best = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operations = func()
+        elapsed = time.perf_counter() - started
+        best = max(best, operations / elapsed)
+    return best
@@ -0,0 +1,76 @@
+"""Menu item prices as of the end of every day: vectorized over the whole price history vs replaying menu items.
+
+Events are generated into the configured database inside a transaction that is rolled back at the end. Both sides
+include their database queries: one for the price history, and one get_multiple_as_of query per day for the replay."""
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.db import transaction  # noqa: E402
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.models import User  # noqa: E402
+from restaurant.projections.entities import MenuItem  # noqa: E402
+from restaurant.services.analytics import PriceAnalyticsService, day_ends  # noqa: E402
+from restaurant.services.entities import MenuItemService  # noqa: E402
+from restaurant.services.events import EventPersistenceService  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def generate(user_id: int, menu_items: int, changes: int, start: datetime) -> list:
+    entities = []
+    for index in range(menu_items):
+        menu_item = MenuItem()
+        menu_item.apply(MenuItemCreated('Item {}'.format(index), MenuItem.CATEGORY_ENTREE, user_id, 1, start))
+        for revision in range(2, changes + 2):
+            menu_item.apply(PriceChanged(revision % 7 - 2, user_id, revision,
+                                         start + timedelta(hours=revision * 7 + index % 24)))
+        entities.append(menu_item)
+    EventPersistenceService().save_many(entities)
+    return [entity.id for entity in entities]
+
+
+def vectorized(ids: list, dates: list) -> float:
+    started = time.perf_counter()
+    PriceAnalyticsService().load(ids).price_matrix(ids, dates)
+    return time.perf_counter() - started
+
+
+def replayed(ids: list, dates: list) -> float:
+    service = MenuItemService(use_cache=False)
+    started = time.perf_counter()
+    for day_end in dates:
+        service.get_multiple_as_of([(id, day_end.replace(tzinfo=None)) for id in ids])
+    return time.perf_counter() - started
+
+
+def run(menu_items: int=200, changes: int=100, days: int=30) -> dict:
+    results = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create(first_name='Benchmark', last_name='User',
+                                       email='benchmark-{}@example.com'.format(uuid.uuid4()))
+            ids = generate(user.id, menu_items, changes, datetime(2019, 1, 1))
+            dates = day_ends(date(2019, 1, 1), date(2019, 1, days))
+            results['cells'] = len(ids) * len(dates)
+            results['vectorized'] = min(vectorized(ids, dates) for _ in range(3))
+            results['replayed'] = min(replayed(ids, dates) for _ in range(3))
+            raise Rollback()
+    except Rollback:
+        pass
+    return results
+
+
+if __name__ == '__main__':
+    results = run()
+    print('Prices of {:,} (menu item, day) cells'.format(results['cells']))
+    print('replayed     {:.3f}s'.format(results['replayed']))
+    print('vectorized   {:.3f}s   ({:.0f}x faster)'.format(results['vectorized'],
+                                                         results['replayed'] / results['vectorized']))
@@ -0,0 +1,126 @@
+"""Deterministic synthetic restaurants and menu items: the same seed and parameters always generate the same streams,
+ids and timestamps included, so that benchmark runs against different versions of the code load the same data."""
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from benchmarks import setup_django
+
+setup_django()
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded  # noqa: E402
+from restaurant.projections.entities import EventableEntity, Restaurant, MenuItem  # noqa: E402
+from restaurant.services.events import EventPersistenceService  # noqa: E402
+
+START = datetime(2019, 1, 1)
+CATEGORIES = (MenuItem.CATEGORY_APPETIZER, MenuItem.CATEGORY_DRINK, MenuItem.CATEGORY_ENTREE,
+              MenuItem.CATEGORY_DESSERT)
+
+
+class StreamLengths(object):
+    """Distribution of the number of events per stream, with the given mean, capped at maximum:
+
+    fixed: every stream has the mean length
+    uniform: lengths spread evenly between 1 and twice the mean
+    pareto: a long tail, most streams short and a few very long ones, as with real aggregates
+    """
+
+    KINDS = ('fixed', 'uniform', 'pareto')
+    # shape of the pareto distribution: the lower, the longer the tail
+    PARETO_ALPHA = 1.5
+
+    def __init__(self, kind: str='pareto', mean: int=20, maximum: int=500):
+        if kind not in self.KINDS:
+            raise ValueError('Unknown stream length distribution {}, expected one of {}'.format(kind, self.KINDS))
+        if mean < 1 or maximum < mean:
+            raise ValueError('Stream lengths need a mean of at least 1, and a maximum of at least the mean')
+        self.kind = kind
+        self.mean = mean
+        self.maximum = maximum
+
+    @staticmethod
+    def parse(spec: str) -> 'StreamLengths':
+        """From kind[:mean[:maximum]], e.g. pareto:20:500"""
+        kind, *numbers = spec.split(':')
+        return StreamLengths(kind, *[int(number) for number in numbers])
+
+    def sample(self, generator: random.Random) -> int:
+        if self.kind == 'fixed':
+            length = self.mean
+        elif self.kind == 'uniform':
+            length = generator.randint(1, 2 * self.mean - 1)
+        else:
+            # paretovariate has a minimum of 1 and a mean of alpha / (alpha - 1)
+            length = round(generator.paretovariate(self.PARETO_ALPHA) * self.mean * (self.PARETO_ALPHA - 1) /
+                           self.PARETO_ALPHA)
+        return max(1, min(length, self.maximum))
+
+    def __str__(self) -> str:
+        return '{}:{}:{}'.format(self.kind, self.mean, self.maximum)
+
+
+class DatasetGenerator(object):
+    """Builds restaurants and menu items with uncommitted events. Every restaurant adds some of the menu items to its
+    menu, and hires and fires employees for the rest of its events; every menu item changes price after its creation.
+    Stream lengths are drawn from the given distribution, restaurants being at least long enough for their menu"""
+
+    def __init__(self, user_id: int, lengths: StreamLengths=None, seed: int=0):
+        self.user_id = user_id
+        self.lengths = lengths if lengths is not None else StreamLengths()
+        self.random = random.Random(seed)
+
+    def new_id(self) -> uuid.UUID:
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def menu_item(self, length: int=None) -> MenuItem:
+        length = length if length is not None else self.lengths.sample(self.random)
+        menu_item = MenuItem(self.new_id())
+        time = START + timedelta(minutes=self.random.randrange(60 * 24 * 365))
+        menu_item.apply(MenuItemCreated('Item {}'.format(self.random.randrange(1000)),
+                                        self.random.choice(CATEGORIES), self.user_id, 1, time))
+        for revision in range(2, length + 1):
+            time += timedelta(minutes=self.random.randrange(1, 60 * 24))
+            menu_item.apply(PriceChanged(self.random.randint(-100, 300), self.user_id, revision, time))
+        return menu_item
+
+    def restaurant(self, menu_item_ids: List[uuid.UUID]=(), length: int=None) -> Restaurant:
+        length = length if length is not None else self.lengths.sample(self.random)
+        restaurant = Restaurant(self.new_id())
+        time = START + timedelta(minutes=self.random.randrange(60 * 24 * 365))
+        restaurant.apply(RestaurantOpened('Restaurant {}'.format(self.random.randrange(1000)),
+                                          self.random.randint(1950, 2019), '{} Test Street'.format(
+                                              self.random.randrange(1, 1000)), self.user_id, 1, time))
+        revision = 1
+        for menu_item_id in menu_item_ids:
+            revision += 1
+            time += timedelta(minutes=self.random.randrange(1, 60 * 24))
+            restaurant.apply(MenuItemAdded(menu_item_id, self.user_id, revision, time))
+        while revision < length:
+            revision += 1
+            time += timedelta(minutes=self.random.randrange(1, 60 * 24))
+            employee = 'Employee {}'.format(self.random.randrange(20))
+            if employee in restaurant.employees:
+                restaurant.apply(EmployeeFired(employee, self.user_id, revision, time))
+            else:
+                restaurant.apply(EmployeeHired(employee, self.user_id, revision, time))
+        return restaurant
+
+    def dataset(self, restaurants: int, menu_items: int) -> List[EventableEntity]:
+        """The menu items, then the restaurants, with each menu item on the menu of a random restaurant"""
+        items = [self.menu_item() for _ in range(menu_items)]
+        menus = [[] for _ in range(restaurants)]
+        for item in items:
+            if restaurants > 0:
+                menus[self.random.randrange(restaurants)].append(item.id)
+        return items + [self.restaurant(menu) for menu in menus]
+
+
+def save(entities: List[EventableEntity], chunk_size: int=500) -> int:
+    """Save the entities in chunks, so that no single statement grows too large. Returns the number of events saved"""
+    events = sum(len(entity.uncommitted_events) for entity in entities)
+    service = EventPersistenceService()
+    for start in range(0, len(entities), chunk_size):
+        service.save_many(entities[start:start + chunk_size])
+    return events
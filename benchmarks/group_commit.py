@@ -0,0 +1,74 @@
+"""Appends / second against the number of concurrent writers, each saving new menu items one at a time, with every
+save committed on its own and with group commit, without a flush window and with a window of a few milliseconds.
+
+The events are committed to the configured database, since the writers need their own connections, and deleted
+again at the end."""
+import threading
+import time
+import uuid
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+
+from restaurant.events.menu_item import MenuItemCreated  # noqa: E402
+from restaurant.models import User, Event, Stream  # noqa: E402
+from restaurant.projections.entities import MenuItem  # noqa: E402
+from restaurant.services.backends.base import EventStoreBackend  # noqa: E402
+from restaurant.services.backends.database import DatabaseEventStore  # noqa: E402
+from restaurant.services.backends.group_commit import GroupCommitEventStore  # noqa: E402
+from restaurant.services.events import EventPersistenceService  # noqa: E402
+
+
+def write(backend: EventStoreBackend, user_id: int, saves: int, stream_ids: list) -> None:
+    service = EventPersistenceService(backend=backend)
+    try:
+        for _ in range(saves):
+            menu_item = MenuItem()
+            menu_item.apply(MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, user_id, 1))
+            service.save(menu_item)
+            stream_ids.append(menu_item.id)
+    finally:
+        connection.close()
+
+
+def appends_per_second(backend: EventStoreBackend, user_id: int, writers: int, saves: int, stream_ids: list) -> float:
+    threads = [threading.Thread(target=write, args=(backend, user_id, saves, stream_ids)) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return writers * saves / (time.perf_counter() - started)
+
+
+def run(concurrency: tuple=(1, 4, 16, 64), saves: int=2000, flush_windows: tuple=(0.0, 0.002)) -> dict:
+    user = User.objects.create(first_name='Benchmark', last_name='User',
+                               email='benchmark-{}@example.com'.format(uuid.uuid4()))
+    stream_ids = []
+    results = {}
+    try:
+        for writers in concurrency:
+            per_writer = max(saves // writers, 1)
+            individual = appends_per_second(DatabaseEventStore(), user.id, writers, per_writer, stream_ids)
+            results[writers] = {'individual': individual}
+            for flush_window in flush_windows:
+                store = GroupCommitEventStore(flush_window=flush_window)
+                grouped = appends_per_second(store, user.id, writers, per_writer, stream_ids)
+                store.close()
+                results[writers][flush_window] = (grouped, store.commits)
+    finally:
+        Event.objects.filter(user_id=user.id).delete()
+        Stream.objects.filter(id__in=stream_ids).delete()
+        user.delete()
+    return results
+
+
+if __name__ == '__main__':
+    print('writers   individual   group commit (commits) by flush window')
+    for writers, result in run().items():
+        grouped = ['{:>5.0f}ms {:>7,.0f}/s ({:,})'.format(flush_window * 1000, *result[flush_window])
+                   for flush_window in result if flush_window != 'individual']
+        print('{:>7}   {:>8,.0f}/s   {}'.format(writers, result['individual'], '   '.join(grouped)))
@@ -0,0 +1,120 @@
+"""Bytes per event held by a bulk load, measured with tracemalloc: events with a per-instance __dict__ and their own
+copy of every string (the previous layout), slotted events with interned strings and shared stream ids, and columnar
+EventBatches.
+
+Rows are decoded the way the database driver hands them over: a new UUID, datetime and data dict per row."""
+import json
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import setup_django
+
+setup_django()
+
+from restaurant.events.batch import EventBatch  # noqa: E402
+from restaurant.events.codecs import get_codec  # noqa: E402
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.events.restaurant import EmployeeHired, MenuItemAdded  # noqa: E402
+
+EMPLOYEES = ['Sam', 'Sally', 'Mark', 'Carl', 'Jane']
+
+
+class LegacyEvent(object):
+    """Stand in for the events before they were slotted: the same attributes, in an instance __dict__"""
+
+    def __init__(self, data: dict, event_stream_id: uuid.UUID, user_id: int, revision: int, timestamp: datetime,
+                 position: int):
+        self.event_stream_id = event_stream_id
+        self.user_id = user_id
+        self.revision = revision
+        self.timestamp = timestamp
+        self.first_observation = False
+        self.position = position
+        for name, value in data.items():
+            setattr(self, name, uuid.UUID(value) if name == 'menu_item_id' else value)
+
+
+def build_rows(streams: int, events_per_stream: int) -> list:
+    """(event_stream_id, type, revision, user_id, time, id, data) as text, like a cursor reads them"""
+    factories = [
+        lambda revision: (EmployeeHired.get_event_type(), {'employee_name': EMPLOYEES[revision % len(EMPLOYEES)]}),
+        lambda revision: (MenuItemAdded.get_event_type(), {'menu_item_id': str(uuid.uuid4())}),
+        lambda revision: (MenuItemCreated.get_event_type(), {'name': 'Coffee', 'category': 'drink'}),
+        lambda revision: (PriceChanged.get_event_type(), {'delta': 25}),
+    ]
+    start = datetime(2019, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for _ in range(streams):
+        event_stream_id = str(uuid.uuid4())
+        for revision in range(1, events_per_stream + 1):
+            event_type, data = factories[revision % len(factories)](revision)
+            rows.append((event_stream_id, event_type, revision, 100, (start + timedelta(seconds=len(rows))).isoformat(),
+                         len(rows) + 1, json.dumps(data)))
+    return rows
+
+
+def decode_row(row: tuple) -> tuple:
+    event_stream_id, event_type, revision, user_id, time, position, data = row
+    return uuid.UUID(event_stream_id), event_type, revision, user_id, datetime.fromisoformat(time), position, \
+        json.loads(data)
+
+
+def load_legacy(rows: list) -> list:
+    events = []
+    for row in rows:
+        event_stream_id, _, revision, user_id, time, position, data = decode_row(row)
+        events.append(LegacyEvent(data, event_stream_id, user_id, revision, time, position))
+    return events
+
+
+def load_slotted(rows: list) -> list:
+    # as EventQueryService.find_events_for_id_in: one UUID object per stream
+    events = []
+    shared_ids = {}
+    for row in rows:
+        event_stream_id, event_type, revision, user_id, time, position, data = decode_row(row)
+        event_stream_id = shared_ids.setdefault(event_stream_id, event_stream_id)
+        events.append(get_codec(event_type).decode(data, event_stream_id, user_id, revision, time, position))
+    return events
+
+
+def load_batches(rows: list) -> list:
+    batches = []
+    batch = None
+    for row in rows:
+        event_stream_id, event_type, revision, user_id, time, position, data = decode_row(row)
+        if batch is None or batch.event_stream_id != event_stream_id:
+            batch = EventBatch(event_stream_id)
+            batches.append(batch)
+        batch.append(event_type, revision, user_id, time, position, data)
+    return batches
+
+
+def measure_bytes(load, rows: list) -> float:
+    tracemalloc.start()
+    try:
+        loaded = load(rows)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del loaded
+    return size / len(rows)
+
+
+def run(streams: int=500, events_per_stream: int=100) -> dict:
+    rows = build_rows(streams, events_per_stream)
+    # compile the codecs ahead, so they are not counted
+    load_slotted(rows[:10])
+    return {
+        'legacy': measure_bytes(load_legacy, rows),
+        'slotted': measure_bytes(load_slotted, rows),
+        'batch': measure_bytes(load_batches, rows),
+    }
+
+
+if __name__ == '__main__':
+    results = run()
+    for layout in ('legacy', 'slotted', 'batch'):
+        print('{:<8} {:>8,.0f} bytes/event   ({:.1f}x smaller)'.format(
+            layout, results[layout], results['legacy'] / results[layout]))
@@ -0,0 +1,77 @@
+"""CPU time of projection rebuilds, with eagerly and lazily decoded events.
+
+Events are generated into the configured database inside a transaction that is rolled back at the end, so the
+database is left as it was found. Only the CPU time of this process is compared: the database does the same work
+either way, apart from casting the data blobs to text."""
+import time
+import uuid
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.db import transaction  # noqa: E402
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded  # noqa: E402
+from restaurant.models import User  # noqa: E402
+from restaurant.projections.entities import Restaurant, MenuItem  # noqa: E402
+from restaurant.projections.projectors import RestaurantProjector, MenuItemProjector  # noqa: E402
+from restaurant.services.events import EventPersistenceService  # noqa: E402
+from restaurant.services.projections import ProjectionService  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def generate(user_id: int, restaurants: int, events_per_stream: int) -> int:
+    entities = []
+    for _ in range(restaurants):
+        restaurant = Restaurant()
+        restaurant.apply(RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', user_id, 1))
+        menu_item = MenuItem()
+        menu_item.apply(MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, user_id, 1))
+        for revision in range(2, events_per_stream + 1):
+            if revision % 3 == 0:
+                restaurant.apply(MenuItemAdded(uuid.uuid4(), user_id, revision))
+            elif revision % 3 == 1:
+                restaurant.apply(EmployeeFired('Employee {}'.format(revision - 1), user_id, revision))
+            else:
+                restaurant.apply(EmployeeHired('Employee {}'.format(revision), user_id, revision))
+            menu_item.apply(PriceChanged(revision, user_id, revision))
+        entities.extend((restaurant, menu_item))
+    EventPersistenceService().save_many(entities)
+    return len(entities) * events_per_stream
+
+
+def rebuild(lazy: bool) -> float:
+    service = ProjectionService(lazy=lazy)
+    started = time.process_time()
+    for projector in (RestaurantProjector(), MenuItemProjector()):
+        service.rebuild(projector)
+    return time.process_time() - started
+
+
+def run(restaurants: int=500, events_per_stream: int=40) -> dict:
+    results = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create(first_name='Benchmark', last_name='User',
+                                       email='benchmark-{}@example.com'.format(uuid.uuid4()))
+            results['events'] = generate(user.id, restaurants, events_per_stream)
+            # warm up, then keep the best of a few runs of each
+            rebuild(False)
+            results['eager'] = min(rebuild(False) for _ in range(3))
+            results['lazy'] = min(rebuild(True) for _ in range(3))
+            raise Rollback()
+    except Rollback:
+        pass
+    return results
+
+
+if __name__ == '__main__':
+    results = run()
+    print('Rebuilt both projections from {:,} events'.format(results['events']))
+    print('eager   {:.2f}s CPU'.format(results['eager']))
+    print('lazy    {:.2f}s CPU   ({:.0%} less)'.format(results['lazy'], 1 - results['lazy'] / results['eager']))
@@ -0,0 +1,79 @@
+"""Events / second replayed into Restaurant and MenuItem entities: the previous apply (a dict of bound methods built
+per event), apply with the class-level dispatch table, and the replay fast path for events read from the store"""
+import uuid
+
+from benchmarks import setup_django, measure_rate
+
+setup_django()
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded, \
+    MenuItemRemoved  # noqa: E402
+from restaurant.projections.entities import EventableEntity, Restaurant, MenuItem  # noqa: E402
+
+
+def legacy_apply(entity: EventableEntity, event) -> None:
+    if event.revision != entity.revision + 1:
+        raise ValueError('Missing events')
+    entity.revision = event.revision
+    {event_class: handler.__get__(entity) for event_class, handler in entity._handlers.items()}[event.__class__](event)
+
+
+def build_restaurant_stream(count: int) -> list:
+    menu_item_ids = [uuid.uuid4() for _ in range(10)]
+    factories = [
+        lambda revision: EmployeeHired('Employee {}'.format(revision % 7), 100, revision),
+        lambda revision: EmployeeFired('Employee {}'.format(revision % 5), 100, revision),
+        lambda revision: MenuItemAdded(menu_item_ids[revision % 10], 100, revision),
+        lambda revision: MenuItemRemoved(menu_item_ids[revision % 3], 100, revision),
+    ]
+    events = [RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', 100, 1)]
+    events.extend(factories[revision % len(factories)](revision) for revision in range(2, count + 1))
+    return events
+
+
+def build_menu_item_stream(count: int) -> list:
+    events = [MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, 100, 1)]
+    events.extend(PriceChanged(1 if revision % 2 else -1, 100, revision) for revision in range(2, count + 1))
+    return events
+
+
+def run(count: int=50000) -> dict:
+    results = {}
+    for entity_class, events in ((Restaurant, build_restaurant_stream(count)),
+                                 (MenuItem, build_menu_item_stream(count))):
+        stream_id = uuid.uuid4()
+        for event in events:
+            # as read from the store, so apply does not collect them as uncommitted
+            event.set_event_stream_id(stream_id)
+
+        def legacy():
+            entity = entity_class(stream_id)
+            for event in events:
+                legacy_apply(entity, event)
+            return len(events)
+
+        def apply():
+            entity = entity_class(stream_id)
+            for event in events:
+                entity.apply(event)
+            return len(events)
+
+        def replay():
+            return entity_class(stream_id).replay(events)
+
+        name = entity_class.aggregate_type
+        results[name + '_legacy'] = measure_rate(legacy)
+        results[name + '_apply'] = measure_rate(apply)
+        results[name + '_replay'] = measure_rate(replay)
+    return results
+
+
+if __name__ == '__main__':
+    results = run()
+    for name in (Restaurant.aggregate_type, MenuItem.aggregate_type):
+        before = results[name + '_legacy']
+        print('{:<11} before: {:>12,.0f} events/s   apply: {:>12,.0f} events/s ({:.1f}x)   '
+              'replay: {:>12,.0f} events/s ({:.1f}x)'.format(
+                  name, before, results[name + '_apply'], results[name + '_apply'] / before,
+                  results[name + '_replay'], results[name + '_replay'] / before))
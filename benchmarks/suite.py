@@ -0,0 +1,293 @@
+"""The benchmark suite: throughput of the event store and entity services on deterministic synthetic data, saved as
+JSON to compare runs and catch performance regressions.
+
+    python -m benchmarks.suite run --output baseline.json
+    ... change the code ...
+    python -m benchmarks.suite run --output current.json
+    python -m benchmarks.suite compare baseline.json current.json --threshold 0.1
+
+Every case measures a rate (higher is better) as the best of --repeat runs. The dataset is generated into the
+configured database inside a transaction that is rolled back at the end, so the database is left as it was found.
+Saves therefore never commit: see benchmarks.group_commit for the cost of commits. compare exits with status 1 when
+any case is slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List
+
+from benchmarks import setup_django, measure_rate
+
+setup_django()
+
+from django.db import transaction  # noqa: E402
+
+from benchmarks.data import DatasetGenerator, StreamLengths, save  # noqa: E402
+from benchmarks.replay import build_restaurant_stream, build_menu_item_stream  # noqa: E402
+from benchmarks.translation import build_events  # noqa: E402
+from restaurant.models import User  # noqa: E402
+from restaurant.projections.entities import Restaurant, MenuItem  # noqa: E402
+from restaurant.services.entities import MenuItemService  # noqa: E402
+from restaurant.services.events import EventPersistenceService  # noqa: E402
+from restaurant.services.snapshots import SnapshotPolicy  # noqa: E402
+from restaurant.services.translation import DjangoEventTranslatorService  # noqa: E402
+
+FORMAT_VERSION = 1
+MULTIPLE_SIZES = (10, 100, 1000)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Context(object):
+    """What the cases run against: the generated dataset, and a generator for the entities they save themselves"""
+
+    def __init__(self, generator: DatasetGenerator, menu_item_ids: List[uuid.UUID], short_id: uuid.UUID,
+                 long_id: uuid.UUID, operations: int, repeat: int):
+        self.generator = generator
+        self.menu_item_ids = menu_item_ids
+        self.short_id = short_id
+        self.long_id = long_id
+        # operations per run of the cases timing single operations
+        self.operations = operations
+        # runs of each case
+        self.repeat = repeat
+        # loads replay every event: no cache, no snapshots
+        self.menu_item_service = MenuItemService(SnapshotPolicy(), use_cache=False)
+
+
+class Case(object):
+
+    def __init__(self, name: str, unit: str, func: Callable[[Context], Callable[[], int]]):
+        self.name = name
+        self.unit = unit
+        # prepares a run of the case, which returns the number of operations it performed
+        self.func = func
+
+
+CASES: Dict[str, Case] = {}
+
+
+def case(name: str, unit: str) -> Callable:
+    def register(func: Callable[[Context], Callable[[], int]]) -> Callable[[Context], Callable[[], int]]:
+        CASES[name] = Case(name, unit, func)
+        return func
+    return register
+
+
+def _new_menu_items(context: Context, length: int) -> Iterator[List[MenuItem]]:
+    """New menu items to save for each run, generated ahead so that generating them is not timed"""
+    return iter([[context.generator.menu_item(length) for _ in range(context.operations)]
+                 for _ in range(context.repeat)])
+
+
+@case('save_single', 'saves/s')
+def save_single(context: Context) -> Callable[[], int]:
+    service = EventPersistenceService()
+    runs = _new_menu_items(context, 5)
+
+    def run() -> int:
+        menu_items = next(runs)
+        for menu_item in menu_items:
+            service.save(menu_item)
+        return len(menu_items)
+    return run
+
+
+@case('save_bulk', 'events/s')
+def save_bulk(context: Context) -> Callable[[], int]:
+    service = EventPersistenceService()
+    runs = _new_menu_items(context, 10)
+
+    def run() -> int:
+        menu_items = next(runs)
+        service.save_many(menu_items)
+        return 10 * len(menu_items)
+    return run
+
+
+def _get_current(stream_id_of: Callable[[Context], uuid.UUID]) -> Callable[[Context], Callable[[], int]]:
+    def prepare(context: Context) -> Callable[[], int]:
+        event_stream_id = stream_id_of(context)
+
+        def run() -> int:
+            for _ in range(context.operations):
+                context.menu_item_service.get_current(event_stream_id)
+            return context.operations
+        return run
+    return prepare
+
+
+case('get_current_short', 'loads/s')(_get_current(lambda context: context.short_id))
+case('get_current_long', 'loads/s')(_get_current(lambda context: context.long_id))
+
+
+def _get_multiple_current(size: int) -> Callable[[Context], Callable[[], int]]:
+    def prepare(context: Context) -> Callable[[], int]:
+        if len(context.menu_item_ids) < size:
+            raise ValueError('get_multiple_current_{} needs a dataset of at least {} menu items'.format(size, size))
+        ids = context.menu_item_ids[:size]
+
+        def run() -> int:
+            return len(context.menu_item_service.get_multiple_current(ids))
+        return run
+    return prepare
+
+
+for _size in MULTIPLE_SIZES:
+    case('get_multiple_current_{}'.format(_size), 'entities/s')(_get_multiple_current(_size))
+
+
+@case('translate_encode', 'events/s')
+def translate_encode(context: Context) -> Callable[[], int]:
+    service = DjangoEventTranslatorService()
+    events = build_events(10000)
+    for event in events:
+        event.set_event_stream_id(context.short_id)
+    return lambda: len(service.translate_to_django_models(events))
+
+
+@case('translate_decode', 'events/s')
+def translate_decode(context: Context) -> Callable[[], int]:
+    service = DjangoEventTranslatorService()
+    events = build_events(10000)
+    for event in events:
+        event.set_event_stream_id(context.short_id)
+    rows = service.translate_to_django_models(events)
+    for position, row in enumerate(rows, 1):
+        row.id = position
+    return lambda: len(list(map(service.translate_event_to_domain_event, rows)))
+
+
+def _replay(entity_class: type, build_stream: Callable[[int], list]) -> Callable[[Context], Callable[[], int]]:
+    def prepare(context: Context) -> Callable[[], int]:
+        stream_id = uuid.uuid4()
+        events = build_stream(20000)
+        for event in events:
+            event.set_event_stream_id(stream_id)
+        return lambda: entity_class(stream_id).replay(events)
+    return prepare
+
+
+case('replay_restaurant', 'events/s')(_replay(Restaurant, build_restaurant_stream))
+case('replay_menu_item', 'events/s')(_replay(MenuItem, build_menu_item_stream))
+
+
+def run(cases: List[str]=None, restaurants: int=200, menu_items: int=2000, lengths: StreamLengths=None,
+        long_stream: int=1000, operations: int=100, repeat: int=5, seed: int=0,
+        progress: Callable[[str, float], None]=None) -> dict:
+    """Run the cases, all of them by default, and return the results in the format saved by the run command"""
+    lengths = lengths if lengths is not None else StreamLengths()
+    unknown = set(cases or ()) - set(CASES)
+    if len(unknown) > 0:
+        raise ValueError('Unknown benchmark cases {}'.format(', '.join(sorted(unknown))))
+    results = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create(first_name='Benchmark', last_name='User',
+                                       email='benchmark-{}@example.com'.format(uuid.uuid4()))
+            generator = DatasetGenerator(user.id, lengths, seed)
+            dataset = generator.dataset(restaurants, menu_items)
+            short, long = generator.menu_item(5), generator.menu_item(long_stream)
+            events = save(dataset + [short, long])
+            context = Context(generator, [entity.id for entity in dataset if isinstance(entity, MenuItem)],
+                              short.id, long.id, operations, repeat)
+            for name in CASES:
+                if cases and name not in cases:
+                    continue
+                rate = measure_rate(CASES[name].func(context), repeat)
+                results[name] = {'value': rate, 'unit': CASES[name].unit}
+                if progress is not None:
+                    progress(name, rate)
+            raise Rollback()
+    except Rollback:
+        pass
+    return {
+        'version': FORMAT_VERSION,
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'parameters': {'restaurants': restaurants, 'menu_items': menu_items, 'lengths': str(lengths),
+                       'long_stream': long_stream, 'operations': operations, 'repeat': repeat, 'seed': seed,
+                       'events': events},
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float=0.1) -> List[dict]:
+    """The relative change of each case from the baseline to the current run. Cases slower by more than the threshold
+    are regressions, cases faster by more than the threshold improvements"""
+    changes = []
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        before = baseline['results'].get(name, {}).get('value')
+        after = current['results'].get(name, {}).get('value')
+        if before is None or after is None:
+            status, change = 'missing' if after is None else 'new', None
+        else:
+            change = after / before - 1
+            status = 'regression' if change < -threshold else 'improvement' if change > threshold else 'unchanged'
+        changes.append({'name': name, 'baseline': before, 'current': after, 'change': change, 'status': status})
+    return changes
+
+
+def _print_comparison(changes: List[dict], units: Dict[str, str]) -> None:
+    print('{:<26} {:>16} {:>16} {:<10} {:>8}  {}'.format('case', 'baseline', 'current', 'unit', 'change', 'status'))
+    for change in changes:
+        print('{:<26} {:>16} {:>16} {:<10} {:>8}  {}'.format(
+            change['name'],
+            '{:,.0f}'.format(change['baseline']) if change['baseline'] is not None else '-',
+            '{:,.0f}'.format(change['current']) if change['current'] is not None else '-',
+            units.get(change['name'], ''),
+            '{:+.1%}'.format(change['change']) if change['change'] is not None else '',
+            change['status']))
+
+
+def main(argv: List[str]=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    run_parser = commands.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--output', '-o', help='Write the results to this JSON file')
+    run_parser.add_argument('--cases', nargs='+', choices=sorted(CASES), help='Cases to run (default: all)')
+    run_parser.add_argument('--restaurants', type=int, default=200)
+    run_parser.add_argument('--menu-items', type=int, default=2000)
+    run_parser.add_argument('--lengths', type=StreamLengths.parse, default=StreamLengths(),
+                            help='Distribution of the stream lengths, kind[:mean[:maximum]] with kind one of '
+                                 '{} (default: %(default)s)'.format(', '.join(StreamLengths.KINDS)))
+    run_parser.add_argument('--long-stream', type=int, default=1000, help='Events in the stream of get_current_long')
+    run_parser.add_argument('--operations', type=int, default=100,
+                            help='Saves and loads per run of the cases timing single operations')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--seed', type=int, default=0)
+    compare_parser = commands.add_parser('compare', help='Compare two runs, exit with 1 on a regression')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative slowdown beyond which a case is a regression (default: %(default)s)')
+    options = parser.parse_args(argv)
+
+    if options.command == 'run':
+        results = run(options.cases, options.restaurants, options.menu_items, options.lengths, options.long_stream,
+                      options.operations, options.repeat, options.seed,
+                      lambda name, rate: print('{:<26} {:>16,.0f} {}'.format(name, rate, CASES[name].unit)))
+        if options.output:
+            with open(options.output, 'w') as output:
+                json.dump(results, output, indent=2)
+        return 0
+
+    with open(options.baseline) as baseline, open(options.current) as current:
+        baseline, current = json.load(baseline), json.load(current)
+    if baseline['parameters'] != current['parameters']:
+        print('Warning: the runs were made with different parameters, {} and {}'.format(
+            baseline['parameters'], current['parameters']), file=sys.stderr)
+    changes = compare(baseline, current, options.threshold)
+    units = {name: result['unit'] for runs in (baseline, current) for name, result in runs['results'].items()}
+    _print_comparison(changes, units)
+    return 1 if any(change['status'] == 'regression' for change in changes) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Events / second encoded to and decoded from the Event model's data blob, with the compiled per-type codecs
+compared to the previous translation (dir() based encoding, constructor + post-save cleaning on decode)"""
+import uuid
+from datetime import datetime
+
+from benchmarks import setup_django, measure_rate
+
+setup_django()
+
+from restaurant.events.base import BaseEvent, DjangoModelTranslatableBaseEvent  # noqa: E402
+from restaurant.events.codecs import get_codec  # noqa: E402
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, MenuItemAdded  # noqa: E402
+
+ROOT_EVENT_ATTRS = dir(DjangoModelTranslatableBaseEvent(1, 0))
+
+
+def legacy_encode(event: BaseEvent) -> dict:
+    data = {}
+    for attr in dir(event):
+        if attr not in ROOT_EVENT_ATTRS and not attr.startswith('_'):
+            value = event.__getattribute__(attr)
+            data[attr] = str(value) if isinstance(value, uuid.UUID) else value
+    return data
+
+
+def legacy_decode(event_class: type, data: dict, user_id: int, revision: int, time: datetime) -> BaseEvent:
+    event = event_class(*[data[name] for name, _ in event_class.schema], user_id, revision, time)
+    if isinstance(event, MenuItemAdded):
+        event.menu_item_id = uuid.UUID(event.menu_item_id)
+    return event
+
+
+def build_events(count: int) -> list:
+    factories = [
+        lambda revision: RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', 100, revision),
+        lambda revision: EmployeeHired('Sam', 100, revision),
+        lambda revision: MenuItemAdded(uuid.uuid4(), 100, revision),
+        lambda revision: MenuItemCreated('Coffee', 'drink', 100, revision),
+        lambda revision: PriceChanged(25, 100, revision),
+    ]
+    return [factories[i % len(factories)](i + 1) for i in range(count)]
+
+
+def run(count: int=20000) -> dict:
+    events = build_events(count)
+    codecs = [get_codec(event.get_event_type()) for event in events]
+    blobs = [codec.encode(event) for codec, event in zip(codecs, events)]
+    stream_id = uuid.uuid4()
+    time = datetime.utcnow()
+
+    def encode_legacy():
+        for event in events:
+            legacy_encode(event)
+        return count
+
+    def encode_compiled():
+        for codec, event in zip(codecs, events):
+            codec.encode(event)
+        return count
+
+    def decode_legacy():
+        for event, data in zip(events, blobs):
+            legacy_decode(event.__class__, data, 100, event.revision, time)
+        return count
+
+    def decode_compiled():
+        for codec, event, data in zip(codecs, events, blobs):
+            codec.decode(data, stream_id, 100, event.revision, time, None)
+        return count
+
+    return {
+        'encode_legacy': measure_rate(encode_legacy),
+        'encode_compiled': measure_rate(encode_compiled),
+        'decode_legacy': measure_rate(decode_legacy),
+        'decode_compiled': measure_rate(decode_compiled),
+    }
+
+
+if __name__ == '__main__':
+    results = run()
+    for operation in ('encode', 'decode'):
+        before, after = results[operation + '_legacy'], results[operation + '_compiled']
+        print('{:<8} before: {:>12,.0f} events/s   after: {:>12,.0f} events/s   ({:.1f}x)'.format(
+            operation, before, after, after / before))
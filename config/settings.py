@@ -87,6 +87,24 @@ DATABASES = {
 }
 
 
+# Event sourcing
+# Snapshot an entity every time it crosses a multiple of this many revisions (None to disable)
+SNAPSHOT_EVERY_N_REVISIONS = 100
+# ... or when loading it meant replaying at least this many events on top of the latest snapshot (None to disable)
+SNAPSHOT_REPLAY_THRESHOLD = 250
+# Number of entities of each type kept by the process wide entity cache (0 to disable)
+ENTITY_CACHE_SIZE = 1000
+# Commands conflicting with a concurrent write are retried against the latest state this many times, backing off
+# randomly for up to COMMAND_RETRY_BACKOFF * 2 ^ attempt seconds in between
+COMMAND_MAX_RETRIES = 3
+COMMAND_RETRY_BACKOFF = 0.01
+# Modules registering side effects (see restaurant.services.outbox.side_effect), imported on startup so that saves
+# write their outbox entries and workers can run them
+SIDE_EFFECT_MODULES = []
+# Collect timings and counts of the event store hot paths, exposed in the Prometheus text format at /metrics
+METRICS_ENABLED = False
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
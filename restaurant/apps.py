@@ -1,5 +1,15 @@
+from importlib import import_module
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RestaurantConfig(AppConfig):
     name = 'restaurant'
+
+    def ready(self):
+        for module in getattr(settings, 'SIDE_EFFECT_MODULES', ()):
+            import_module(module)
+        if getattr(settings, 'METRICS_ENABLED', False):
+            from restaurant.instrumentation import get_prometheus_collector
+            get_prometheus_collector()
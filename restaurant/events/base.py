@@ -1,9 +1,8 @@
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
+from typing import Dict, Tuple
 from uuid import UUID
 
-from restaurant.models import Event
-
 
 class BaseEvent(object):
     """Essentially a wrapper around the Event Model, due to limitations within Django's ORM
@@ -19,16 +18,22 @@ class BaseEvent(object):
     This can generally be accomplished by *not* applying the event_stream_id when first creation. 'applying' an event
     should set the id if not already set, this recognizing that this event is first-observed. Reading from the database
     again should already maintain that id
+
+    Events are slotted to keep bulk loads compact: subclasses declare the attributes of their schema in __slots__.
     """
 
-    def __init__(self, user_id: int, revision: int, timestamp=datetime.utcnow()):
+    __slots__ = ('event_stream_id', 'user_id', 'revision', 'timestamp', 'first_observation', 'position')
+
+    def __init__(self, user_id: int, revision: int, timestamp: datetime=None):
         # no timestamp_recorded, that should happen farther down
         # event data is saved at the child class
         self.event_stream_id: UUID = None
         self.user_id: int = user_id
         self.revision: int = revision
-        self.timestamp:datetime = timestamp
+        self.timestamp:datetime = timestamp if timestamp is not None else datetime.utcnow()
         self.first_observation = False
+        # global position of the event in the store, only known once it has been read back from it
+        self.position: int = None
 
         if self.user_id is None:
             raise ValueError('User Id may not be None')
@@ -46,21 +51,38 @@ class BaseEvent(object):
     def get_event_type():
         pass
 
-    def encode_data_before_save(self):
-        pass
-
-    def clean_data_post_save(self):
-        pass
-
     # Considered putting a 'to_django_orm_event' method here - as well as a method to conver from models.Event to
     # a child of BaseEvent, but that would couple the django orm to this model.
-    # Created the Adapter below to help with translation
+    # Events declare their data instead, see DjangoModelTranslatableBaseEvent and restaurant.events.codecs
+
+
+_event_classes: Dict[str, type] = {}
+
 
 class DjangoModelTranslatableBaseEvent(BaseEvent):
+    """An event whose data can be stored in the data blob of the Event model.
+
+    Subclasses declare that data as a schema of (attribute name, type) pairs, which must match the names of their
+    constructor arguments. Types needing coercion to and from JSON (UUID, datetime) are converted by the event's codec.
+    Every subclass, however deeply nested, is registered under its event type, unless declared with register=False.
+    """
 
     __metaclass__ = ABCMeta
+    __slots__ = ()
 
-    @staticmethod
-    @abstractmethod
-    def create_from_event(event: Event):
-        pass
+    schema: Tuple[Tuple[str, type], ...] = ()
+
+    def __init_subclass__(cls, register: bool=True, **kwargs):
+        super().__init_subclass__(**kwargs)
+        event_type = cls.get_event_type()
+        if event_type is None or not register:
+            # an intermediate base class without an event type of its own, or a variant of a registered class
+            return
+        if event_type in _event_classes and _event_classes[event_type] is not cls:
+            raise ValueError('Event type {} is registered by both {} and {}'.format(
+                event_type, _event_classes[event_type].__name__, cls.__name__))
+        _event_classes[event_type] = cls
+
+
+def get_event_class(event_type: str) -> type:
+    return _event_classes[event_type]
@@ -0,0 +1,48 @@
+from array import array
+from datetime import datetime
+from typing import Iterator, List, Tuple, Any
+from uuid import UUID
+
+from restaurant.events.base import BaseEvent
+from restaurant.events.codecs import get_codec, EventCodec
+from restaurant.events.timestamps import to_micros, from_micros
+
+
+class EventBatch(object):
+    """The events of one stream, in revision order, held column by column rather than as event objects.
+
+    Revisions, users, positions and timestamps (as microseconds since the epoch) are kept in typed arrays, the schema
+    values of each event in a tuple, and the stream id once for the whole batch. Iterating builds the events one at a
+    time, so replaying a batch into an entity never holds more than one event object: see EventableEntity.replay.
+    """
+
+    __slots__ = ('event_stream_id', '_codecs', '_revisions', '_user_ids', '_times', '_positions', '_values')
+
+    def __init__(self, event_stream_id: UUID):
+        self.event_stream_id = event_stream_id
+        self._codecs: List[EventCodec] = []
+        self._revisions = array('q')
+        self._user_ids = array('q')
+        self._times = array('q')
+        self._positions = array('q')
+        self._values: List[Tuple[Any, ...]] = []
+
+    def append(self, event_type: str, revision: int, user_id: int, time: datetime, position: int, data: dict) -> None:
+        """Add a stored event, decoding its data blob. time must be timezone aware"""
+        codec = get_codec(event_type)
+        self._codecs.append(codec)
+        self._revisions.append(revision)
+        self._user_ids.append(user_id)
+        self._times.append(to_micros(time))
+        self._positions.append(position)
+        self._values.append(codec.decode_values(data))
+
+    def __len__(self) -> int:
+        return len(self._revisions)
+
+    def __iter__(self) -> Iterator[BaseEvent]:
+        event_stream_id = self.event_stream_id
+        for codec, revision, user_id, time, position, values in zip(self._codecs, self._revisions, self._user_ids,
+                                                                     self._times, self._positions, self._values):
+            yield codec.from_values(values, event_stream_id, user_id, revision, from_micros(time),
+                                    position)
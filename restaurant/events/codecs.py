@@ -0,0 +1,177 @@
+import json
+import sys
+import types
+from datetime import datetime
+from typing import Callable, Dict, Any, Tuple
+from uuid import UUID
+
+from django.utils.dateparse import parse_datetime
+
+from restaurant import instrumentation
+
+# importing the event modules registers their event types
+import restaurant.events.menu_item
+import restaurant.events.restaurant
+from restaurant.events.base import BaseEvent, get_event_class
+
+# expressions converting an attribute of a given type to and from its JSON representation. Types not listed here are
+# stored as is
+_ENCODE_EXPRESSIONS = {
+    UUID: 'str({})',
+    datetime: '{}.isoformat()',
+}
+_DECODE_EXPRESSIONS = {
+    UUID: '_UUID({})',
+    datetime: '_parse_datetime({})',
+    # the same names, categories etc. recur across many events: share one copy of each
+    str: '_intern_str({})',
+}
+
+
+def _intern_str(value: str) -> str:
+    return sys.intern(value) if value.__class__ is str else value
+
+
+# the same conversions, as functions, for the fields of lazily decoded events
+_DECODERS = {
+    UUID: UUID,
+    datetime: parse_datetime,
+    str: _intern_str,
+}
+
+
+class _DictSlot(object):
+    """Stands in for the slot of a field, for event classes keeping their fields in an instance __dict__"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, event, owner=None):
+        try:
+            return event.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, event, value) -> None:
+        event.__dict__[self.name] = value
+
+
+def _lazy_field(name: str, slot, decode: Callable) -> property:
+    """A field decoded from the event's raw data on first access, then kept in the field's slot"""
+    def get(event):
+        try:
+            return slot.__get__(event)
+        except AttributeError:
+            data = event._data
+            if data is None:
+                data = event._data = json.loads(event._raw)
+                if instrumentation.active:
+                    instrumentation.increment('bytes_decoded_total', len(event._raw))
+            value = decode(data[name])
+            slot.__set__(event, value)
+            return value
+    return property(get, slot.__set__)
+
+
+def _lazy_class(event_class: type) -> type:
+    """A subclass of event_class whose schema fields are decoded from the raw JSON data on first access"""
+    namespace = {'__slots__': ('_raw', '_data'), '__module__': event_class.__module__}
+    for name, field_type in event_class.schema:
+        slot = next((vars(klass)[name] for klass in event_class.__mro__
+                     if isinstance(vars(klass).get(name), types.MemberDescriptorType)), None)
+        namespace[name] = _lazy_field(name, slot if slot is not None else _DictSlot(name),
+                                      _DECODERS.get(field_type, lambda value: value))
+    return types.new_class('Lazy' + event_class.__name__, (event_class,), {'register': False},
+                           lambda body: body.update(namespace))
+
+
+class EventCodec(object):
+    """Encoder and decoder of the data blob for one event class, compiled from the class's schema.
+
+    encode(event) returns the data blob of an event. decode(data, event_stream_id, user_id, revision, timestamp,
+    position) builds the event back without going through its constructor, as stored events were validated when
+    they were first created. decode_values(data) returns the decoded schema values as a tuple, from which
+    from_values(values, event_stream_id, user_id, revision, timestamp, position) builds the event, for callers
+    holding many events in a compact form (see restaurant.events.batch). decode_lazy(raw, event_stream_id, user_id,
+    revision, timestamp, position) takes the data blob as JSON text, and builds an event of a subclass of the event
+    class which only parses it, and decodes each field, when the field is first read.
+    """
+
+    def __init__(self, event_class: type):
+        self.event_class = event_class
+        self.event_type: str = event_class.get_event_type()
+        self.lazy_class: type = _lazy_class(event_class)
+        self.encode: Callable[[BaseEvent], Dict[str, Any]] = self._compile_encoder()
+        self.decode: Callable[..., BaseEvent] = self._compile_decoder()
+        self.decode_values: Callable[[Dict[str, Any]], Tuple] = self._compile_values_decoder()
+        self.from_values: Callable[..., BaseEvent] = self._compile_from_values()
+        self.decode_lazy: Callable[..., BaseEvent] = self._compile_lazy_decoder()
+
+    def _compile_encoder(self) -> Callable:
+        items = []
+        for name, field_type in self.event_class.schema:
+            expression = _ENCODE_EXPRESSIONS.get(field_type, '{}').format('event.' + name)
+            items.append('{!r}: {}'.format(name, expression))
+        source = 'def encode(event):\n    return {{{}}}\n'.format(', '.join(items))
+        return self._compile(source, 'encode')
+
+    def _compile_decoder(self) -> Callable:
+        lines = self._build_event_lines('decode(data, event_stream_id, user_id, revision, timestamp, position)')
+        for name, field_type in self.event_class.schema:
+            lines.append('    event.{} = {}'.format(name, self._decode_expression(name, field_type)))
+        lines.append('    return event')
+        return self._compile('\n'.join(lines) + '\n', 'decode')
+
+    def _compile_values_decoder(self) -> Callable:
+        values = [self._decode_expression(name, field_type) for name, field_type in self.event_class.schema]
+        source = 'def decode_values(data):\n    return ({})\n'.format(''.join(value + ', ' for value in values))
+        return self._compile(source, 'decode_values')
+
+    def _compile_from_values(self) -> Callable:
+        lines = self._build_event_lines('from_values(values, event_stream_id, user_id, revision, timestamp, position)')
+        for index, (name, _) in enumerate(self.event_class.schema):
+            lines.append('    event.{} = values[{}]'.format(name, index))
+        lines.append('    return event')
+        return self._compile('\n'.join(lines) + '\n', 'from_values')
+
+    def _compile_lazy_decoder(self) -> Callable:
+        lines = self._build_event_lines('decode_lazy(raw, event_stream_id, user_id, revision, timestamp, position)',
+                                        '_lazy_class')
+        lines.extend(['    event._raw = raw', '    event._data = None', '    return event'])
+        return self._compile('\n'.join(lines) + '\n', 'decode_lazy')
+
+    def _build_event_lines(self, signature: str, event_class: str='_event_class') -> list:
+        return ['def {}:'.format(signature),
+                '    event = _new({})'.format(event_class),
+                '    event.event_stream_id = event_stream_id',
+                '    event.user_id = user_id',
+                '    event.revision = revision',
+                '    event.timestamp = timestamp',
+                '    event.first_observation = False',
+                '    event.position = position']
+
+    def _decode_expression(self, name: str, field_type: type) -> str:
+        return _DECODE_EXPRESSIONS.get(field_type, '{}').format('data[{!r}]'.format(name))
+
+    def _compile(self, source: str, name: str) -> Callable:
+        namespace = {
+            '_new': object.__new__,
+            '_event_class': self.event_class,
+            '_lazy_class': self.lazy_class,
+            '_UUID': UUID,
+            '_parse_datetime': parse_datetime,
+            '_intern_str': _intern_str,
+        }
+        exec(compile(source, '<{} codec for {}>'.format(name, self.event_type), 'exec'), namespace)
+        return namespace[name]
+
+
+_codecs: Dict[str, EventCodec] = {}
+
+
+def get_codec(event_type: str) -> EventCodec:
+    """The codec for an event type, compiled on first use and kept for the lifetime of the process"""
+    codec = _codecs.get(event_type)
+    if codec is None:
+        codec = _codecs[event_type] = EventCodec(get_event_class(event_type))
+    return codec
@@ -0,0 +1,17 @@
+"""The timestamps of domain events are naive datetimes in UTC. These convert them for the database, which stores
+timezone aware times, and for stores which keep them as microseconds since the epoch"""
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def aware(time: datetime) -> datetime:
+    return time.replace(tzinfo=timezone.utc) if time.tzinfo is None else time
+
+
+def to_micros(time: datetime) -> int:
+    return (aware(time) - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
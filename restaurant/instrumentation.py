@@ -0,0 +1,119 @@
+"""Timings and counts of the hot paths (saving, querying, translating and applying events, loading entities), handed
+to the registered collectors.
+
+Instrumented code checks `instrumentation.active` before taking any measurement, so that it costs a single attribute
+lookup while no collector is registered:
+
+    if instrumentation.active:
+        started = time.perf_counter()
+    ...
+    if instrumentation.active:
+        instrumentation.observe('query_seconds', time.perf_counter() - started)
+
+Metrics are named in Prometheus style: observations are samples of a distribution (durations in seconds, events per
+load), increments add to a running total (names ending in _total).
+"""
+import threading
+from abc import ABCMeta, abstractmethod
+from typing import Dict, List, Tuple
+
+active = False
+
+_collectors: List['MetricsCollector'] = []
+_collectors_lock = threading.Lock()
+
+
+class MetricsCollector(object):
+    """Receives the measurements of the instrumented code, in the thread that took them"""
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def observe(self, name: str, value: float) -> None:
+        pass
+
+    @abstractmethod
+    def increment(self, name: str, value: int=1) -> None:
+        pass
+
+
+def register_collector(collector: MetricsCollector) -> None:
+    global active, _collectors
+    with _collectors_lock:
+        # copied on write, so that measurements iterate over the collectors without locking
+        if collector not in _collectors:
+            _collectors = _collectors + [collector]
+        active = True
+
+
+def unregister_collector(collector: MetricsCollector) -> None:
+    global active, _collectors
+    with _collectors_lock:
+        _collectors = [registered for registered in _collectors if registered is not collector]
+        active = len(_collectors) > 0
+
+
+def observe(name: str, value: float) -> None:
+    for collector in _collectors:
+        collector.observe(name, value)
+
+
+def increment(name: str, value: int=1) -> None:
+    for collector in _collectors:
+        collector.increment(name, value)
+
+
+class PrometheusCollector(MetricsCollector):
+    """Keeps the count and sum of every observed metric (as a Prometheus summary) and every total, and renders them in
+    the Prometheus text exposition format"""
+
+    def __init__(self, prefix: str='eventsource_'):
+        self.prefix = prefix
+        self._summaries: Dict[str, Tuple[int, float]] = {}
+        self._totals: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            count, total = self._summaries.get(name, (0, 0.0))
+            self._summaries[name] = (count + 1, total + value)
+
+    def increment(self, name: str, value: int=1) -> None:
+        with self._lock:
+            self._totals[name] = self._totals.get(name, 0) + value
+
+    def summary(self, name: str) -> Tuple[int, float]:
+        """The number and the sum of the observations of a metric"""
+        with self._lock:
+            return self._summaries.get(name, (0, 0.0))
+
+    def total(self, name: str) -> int:
+        with self._lock:
+            return self._totals.get(name, 0)
+
+    def render(self) -> str:
+        with self._lock:
+            summaries = sorted(self._summaries.items())
+            totals = sorted(self._totals.items())
+        lines = []
+        for name, (count, total) in summaries:
+            lines.append('# TYPE {}{} summary'.format(self.prefix, name))
+            lines.append('{}{}_count {}'.format(self.prefix, name, count))
+            lines.append('{}{}_sum {!r}'.format(self.prefix, name, total))
+        for name, total in totals:
+            lines.append('# TYPE {}{} counter'.format(self.prefix, name))
+            lines.append('{}{} {}'.format(self.prefix, name, total))
+        return '\n'.join(lines) + '\n'
+
+
+_default_collector: PrometheusCollector = None
+
+
+def get_prometheus_collector() -> PrometheusCollector:
+    """The process wide collector behind the metrics endpoint, registered on first use"""
+    global _default_collector
+    with _collectors_lock:
+        if _default_collector is None:
+            _default_collector = PrometheusCollector()
+    register_collector(_default_collector)
+    return _default_collector
@@ -0,0 +1,31 @@
+import bz2
+import gzip
+import lzma
+import sys
+from typing import IO
+
+_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def open_binary(path: str, mode: str) -> IO[bytes]:
+    """Open a file for binary reading ('r') or writing ('w'), compressed according to its extension. '-' is stdin /
+    stdout"""
+    if path == '-':
+        return sys.stdin.buffer if mode == 'r' else sys.stdout.buffer
+    for extension, opener in _OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, mode + 'b')
+    return open(path, mode + 'b')
+
+
+def detect_format(path: str, requested: str) -> str:
+    if requested is not None:
+        return requested
+    for extension in _OPENERS.keys():
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+    return 'csv' if path.endswith('.csv') else 'ndjson'
@@ -0,0 +1,59 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from restaurant.services.stream_analysis import StreamAnalysisService, profile_replay_costs
+
+
+class Command(BaseCommand):
+    help = 'Report the length, event type mix, append rate and estimated replay cost of the event streams'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Number of hot and costly streams listed')
+        parser.add_argument('--days', type=float, default=7.0, help='Window the append rate of hot streams is over')
+        parser.add_argument('--samples', type=int, default=2000,
+                            help='Events decoded and applied per event type when profiling replay costs')
+        parser.add_argument('--json', action='store_true', help='Write the report as JSON rather than as tables')
+
+    def handle(self, *args, **options):
+        service = StreamAnalysisService(profile_replay_costs(samples=options['samples']))
+        report = service.analyze(options['top'], timedelta(days=options['days']))
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self._table('Replay cost per event (microseconds)', ('event type', 'aggregate', 'decode', 'apply', 'replay'), [
+            (cost['event_type'], cost['aggregate_type'], _float(cost['decode_us'], 3), _float(cost['apply_us'], 3),
+             _float(cost['replay_us'], 3)) for cost in report['replay_costs']])
+        self._table('Events per stream', ('aggregate', 'streams', 'events', 'mean', 'p50', 'p90', 'p99', 'max'), [
+            (lengths['aggregate_type'], lengths['streams'], lengths['events'], _float(lengths['mean'], 1),
+             lengths['p50'], lengths['p90'], lengths['p99'], lengths['max']) for lengths in report['stream_lengths']])
+        self._table('Event types', ('aggregate', 'event type', 'events', 'share'), [
+            (mix['aggregate_type'], mix['event_type'], mix['events'], '{:.1%}'.format(mix['share']))
+            for mix in report['event_types']])
+        self._table('Hot streams since {}'.format(report['hot_streams']['since']),
+                    ('stream', 'aggregate', 'events', 'events/day', 'lifetime events/day'), [
+            (hot['event_stream_id'], hot['aggregate_type'], hot['events'], _float(hot['events_per_day'], 1),
+             _float(hot['lifetime_events_per_day'], 1)) for hot in report['hot_streams']['streams']])
+        self._table('Costliest streams to replay',
+                    ('stream', 'aggregate', 'events', 'snapshot', 'events/load', 'replay ms', 'load ms'), [
+            (costly['event_stream_id'], costly['aggregate_type'], costly['events'], costly['snapshot_revision'],
+             costly['events_per_load'], _float(costly['replay_ms'], 3), _float(costly['load_ms'], 3))
+            for costly in report['costliest_streams']])
+
+    def _table(self, title: str, header: tuple, rows: list) -> None:
+        cells = [tuple(str(value) for value in row) for row in [header] + rows]
+        widths = [max(len(row[column]) for row in cells) for column in range(len(header))]
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for row in cells:
+            # the first two columns are names, left aligned, the others figures, right aligned
+            self.stdout.write('  '.join(value.ljust(width) if column < 2 else value.rjust(width)
+                                        for column, (value, width) in enumerate(zip(row, widths))))
+        if len(rows) == 0:
+            self.stdout.write('(none)')
+        self.stdout.write('')
+
+
+def _float(value: float, digits: int) -> str:
+    return '-' if value is None else '{:,.{}f}'.format(value, digits)
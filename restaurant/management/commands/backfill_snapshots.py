@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.projections.entities import Restaurant, MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.snapshots import SnapshotService
+
+
+class Command(BaseCommand):
+    help = 'Bring the snapshot of every restaurant and menu item up to its current revision'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purge-stale', action='store_true',
+                            help='Delete snapshots written by a previous version of the entity event handlers')
+
+    def handle(self, *args, **options):
+        snapshot_service = SnapshotService()
+        for entity_class, service in ((Restaurant, RestaurantService()), (MenuItem, MenuItemService())):
+            if options['purge_stale']:
+                deleted = snapshot_service.delete_stale(entity_class)
+                self.stdout.write('Deleted {} stale {} snapshots'.format(deleted, entity_class.aggregate_type))
+
+            count = 0
+            for event_stream_id in service.list_ids():
+                service.take_snapshot(event_stream_id)
+                count += 1
+            self.stdout.write('Snapshotted {} {} streams'.format(count, entity_class.aggregate_type))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from restaurant.management.commands._files import open_binary, detect_format
+from restaurant.models import Event
+
+# control characters never appear verbatim in JSON text, so using them as CSV quote and delimiter makes COPY write
+# every JSON document as is, one per line
+NDJSON_COPY_OPTIONS = "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'"
+
+COLUMNS = ('id', 'event_stream_id', 'revision', 'type', 'time', 'created_at', 'user_id_id', 'data')
+
+
+class Command(BaseCommand):
+    help = 'Stream the event store out to a (possibly compressed) NDJSON or CSV file with COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Destination; .gz, .bz2 and .xz are compressed, - is stdout')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), default=None,
+                            help='Defaults to csv for .csv files, ndjson otherwise')
+        parser.add_argument('--after', type=int, default=0, help='Only export events after this global position')
+
+    def handle(self, *args, **options):
+        table = connection.ops.quote_name(Event._meta.db_table)
+        if detect_format(options['path'], options['format']) == 'csv':
+            query = 'COPY (SELECT {} FROM {} WHERE id > {:d} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER true)'\
+                .format(', '.join(COLUMNS), table, options['after'])
+        else:
+            document = ', '.join("'{0}', {0}".format(column) for column in COLUMNS)
+            query = 'COPY (SELECT json_build_object({}) FROM {} WHERE id > {:d} ORDER BY id) TO STDOUT WITH ({})'\
+                .format(document, table, options['after'], NDJSON_COPY_OPTIONS)
+
+        started = time.monotonic()
+        destination = open_binary(options['path'], 'w')
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(query, destination)
+                exported = cursor.rowcount
+        finally:
+            if options['path'] != '-':
+                destination.close()
+        elapsed = time.monotonic() - started
+        self.stderr.write('Exported {} events in {:.1f}s ({:,.0f} events/s)'.format(
+            exported, elapsed, exported / elapsed if elapsed > 0 else 0))
@@ -0,0 +1,119 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from restaurant.management.commands._files import open_binary, detect_format
+from restaurant.management.commands.export_events import NDJSON_COPY_OPTIONS
+from restaurant.models import Event, Stream
+from restaurant.services.subscriptions import notify_appended
+
+STAGING_TABLE = 'restaurant_event_import'
+
+COLUMNS = ('event_stream_id', 'revision', 'type', 'time', 'created_at', 'user_id_id', 'data')
+
+# casts of the NDJSON document fields into the staging columns
+NDJSON_FIELDS = (
+    "(document->>'event_stream_id')::uuid",
+    "(document->>'revision')::integer",
+    "document->>'type'",
+    "(document->>'time')::timestamptz",
+    "coalesce((document->>'created_at')::timestamptz, now())",
+    "coalesce(document->>'user_id_id', document->>'user_id')::integer",
+    "document->'data'",
+)
+
+
+class Command(BaseCommand):
+    help = 'Bulk load events from a (possibly compressed) NDJSON or CSV file with COPY, in a single transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Source; .gz, .bz2 and .xz are decompressed, - is stdin')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), default=None,
+                            help='Defaults to csv for .csv files, ndjson otherwise. CSV files have the columns written '
+                                 'by export_events, in that order, with a header row. Their id column is ignored')
+        parser.add_argument('--skip-validation', action='store_true',
+                            help='Do not check that the streams are free of revision gaps after loading')
+
+    def handle(self, *args, **options):
+        event_format = detect_format(options['path'], options['format'])
+        source = open_binary(options['path'], 'r')
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                self._timed('Loaded', cursor, lambda: self._copy_into_staging(cursor, source, event_format))
+                if not options['skip_validation']:
+                    self._validate(cursor)
+                imported = self._timed('Inserted', cursor, lambda: self._insert(cursor))
+                self._update_streams(cursor)
+                cursor.execute('SELECT max(id) FROM {}'.format(connection.ops.quote_name(Event._meta.db_table)))
+                if imported > 0:
+                    notify_appended(cursor.fetchone()[0])
+        finally:
+            if options['path'] != '-':
+                source.close()
+
+    def _timed(self, action: str, cursor, func) -> int:
+        started = time.monotonic()
+        func()
+        count = cursor.rowcount
+        elapsed = time.monotonic() - started
+        self.stderr.write('{} {} events in {:.1f}s ({:,.0f} events/s)'.format(
+            action, count, elapsed, count / elapsed if elapsed > 0 else 0))
+        return count
+
+    def _copy_into_staging(self, cursor, source, event_format: str) -> None:
+        cursor.execute('CREATE TEMPORARY TABLE {} (id bigint, event_stream_id uuid NOT NULL, revision integer NOT NULL, '
+                       'type varchar(125) NOT NULL, time timestamptz NOT NULL, created_at timestamptz NOT NULL, '
+                       'user_id_id integer NOT NULL, data jsonb NOT NULL) ON COMMIT DROP'.format(STAGING_TABLE))
+        if event_format == 'csv':
+            cursor.copy_expert('COPY {} FROM STDIN WITH (FORMAT csv, HEADER true)'.format(STAGING_TABLE), source)
+            return
+
+        # every line goes verbatim into a single column, and is picked apart by Postgres rather than in Python
+        cursor.execute('CREATE TEMPORARY TABLE {}_lines (document jsonb NOT NULL) ON COMMIT DROP'.format(STAGING_TABLE))
+        cursor.copy_expert('COPY {}_lines FROM STDIN WITH ({})'.format(STAGING_TABLE, NDJSON_COPY_OPTIONS), source)
+        cursor.execute('INSERT INTO {0} ({1}) SELECT {2} FROM {0}_lines'.format(
+            STAGING_TABLE, ', '.join(COLUMNS), ', '.join(NDJSON_FIELDS)))
+
+    def _validate(self, cursor) -> None:
+        """Check, set-wise, that once loaded every stream touched by the import has revisions 1..n without gaps"""
+        cursor.execute('''
+            WITH combined AS (
+                SELECT event_stream_id, revision FROM {staging}
+                UNION ALL
+                SELECT event_stream_id, revision FROM {events}
+                WHERE event_stream_id IN (SELECT DISTINCT event_stream_id FROM {staging})
+            )
+            SELECT event_stream_id FROM (
+                SELECT event_stream_id, revision,
+                       row_number() OVER (PARTITION BY event_stream_id ORDER BY revision) AS expected
+                FROM combined
+            ) AS numbered
+            WHERE revision <> expected
+            GROUP BY event_stream_id
+            LIMIT 10
+        '''.format(staging=STAGING_TABLE, events=connection.ops.quote_name(Event._meta.db_table)))
+        invalid = [str(row[0]) for row in cursor.fetchall()]
+        if len(invalid) > 0:
+            raise CommandError('Streams with missing or duplicate revisions, nothing was imported: {}'.format(
+                ', '.join(invalid)))
+
+    def _insert(self, cursor) -> None:
+        cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ORDER BY event_stream_id, revision'.format(
+            connection.ops.quote_name(Event._meta.db_table), ', '.join(COLUMNS), STAGING_TABLE))
+
+    def _update_streams(self, cursor) -> None:
+        """Bring the stream catalog up to date with the imported events. Event types are prefixed by the aggregate type
+        of their stream, which new streams take from their first event"""
+        cursor.execute('''
+            INSERT INTO {streams} AS stream (id, type, head_revision, first_event_time, last_event_time, event_count)
+            SELECT event_stream_id, (array_agg(split_part(type, '.', 1) ORDER BY revision))[1], max(revision),
+                   min(time), max(time), count(*)
+            FROM {staging}
+            GROUP BY event_stream_id
+            ORDER BY event_stream_id
+            ON CONFLICT (id) DO UPDATE SET head_revision = greatest(stream.head_revision, EXCLUDED.head_revision),
+                first_event_time = least(stream.first_event_time, EXCLUDED.first_event_time),
+                last_event_time = greatest(stream.last_event_time, EXCLUDED.last_event_time),
+                event_count = stream.event_count + EXCLUDED.event_count
+        '''.format(streams=connection.ops.quote_name(Stream._meta.db_table), staging=STAGING_TABLE))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant.projections.projectors import RestaurantProjector, MenuItemProjector
+from restaurant.services.projections import ProjectionService
+from restaurant.services.rebuild import PartitionedRebuildService
+
+
+class Command(BaseCommand):
+    help = 'Catch the read models up with the event store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Drop the read models and replay every event')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep processing new events as they are appended (requires a single projector)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--partitions', type=int, default=1,
+                            help='Rebuild with a process per partition of the streams, into a table swapped in at the '
+                                 'end. An interrupted rebuild resumes when run again with as many partitions')
+        parser.add_argument('--lazy', action='store_true',
+                            help='Only decode the event data the projectors read, as they read it')
+        parser.add_argument('projectors', nargs='*', help='Names of the projectors to run (default: all)')
+
+    def handle(self, *args, **options):
+        if options['follow'] and len(options['projectors']) != 1:
+            raise CommandError('--follow requires the name of a single projector')
+        service = ProjectionService(options['batch_size'], options['lazy'])
+        partitioned = PartitionedRebuildService(options['partitions'], options['batch_size'], options['lazy'])
+        for projector in (RestaurantProjector(), MenuItemProjector()):
+            if options['projectors'] and projector.name not in options['projectors']:
+                continue
+            if options['rebuild'] and options['partitions'] > 1:
+                processed = partitioned.rebuild(projector, lambda partition, count, position: self.stdout.write(
+                    '{}: partition {} processed {} events, at position {}'.format(
+                        projector.name, partition, count, position)))
+                # events appended while rebuilding
+                processed += service.run(projector)
+            elif options['rebuild']:
+                processed = service.rebuild(projector)
+            else:
+                processed = service.run(projector)
+            if options['follow']:
+                processed += service.follow(projector)
+            self.stdout.write('{}: processed {} events, now at position {}'.format(
+                projector.name, processed, service.get_position(projector)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.services.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = 'Run the side effects of newly saved events from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follow', action='store_true', help='Keep running side effects as events are saved')
+        parser.add_argument('--idle-timeout', type=float, default=None,
+                            help='When following, stop after this many seconds without any side effect to run')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('handlers', nargs='*', help='Names of the side effects to run (default: all)')
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(options['workers'], options['batch_size'], max_attempts=options['max_attempts'],
+                              handlers=options['handlers'] or None)
+        processed = worker.run(options['follow'], options['idle_timeout'])
+        self.stdout.write('Ran {} side effects'.format(processed))
@@ -0,0 +1,30 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:13
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(verbose_name='date / time of the last event folded into this snapshot')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('type', models.CharField(max_length=125, verbose_name='aggregate type of the entity')),
+                ('version', models.CharField(max_length=40)),
+                ('event_stream_id', models.UUIDField()),
+                ('revision', models.IntegerField()),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField()),
+            ],
+            options={
+                'unique_together': {('event_stream_id', 'version', 'revision')},
+            },
+        ),
+    ]
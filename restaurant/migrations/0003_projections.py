@@ -0,0 +1,44 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:14
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0002_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItemView',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('revision', models.IntegerField(default=0)),
+                ('name', models.CharField(db_index=True, default='', max_length=255)),
+                ('category', models.CharField(db_index=True, default='', max_length=50)),
+                ('price_in_cents', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjectionCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=125, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RestaurantView',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('revision', models.IntegerField(default=0)),
+                ('name', models.CharField(db_index=True, default='', max_length=255)),
+                ('address', models.CharField(default='', max_length=255)),
+                ('year_opened', models.IntegerField(null=True)),
+                ('employees', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('menu_item_ids', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0003_projections'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['event_stream_id', 'time', 'revision'], name='event_stream_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['event_stream_id', 'created_at'], name='event_stream_created_idx'),
+        ),
+    ]
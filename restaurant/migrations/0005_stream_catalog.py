@@ -0,0 +1,34 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+# event types are prefixed by the aggregate type of their stream (restaurant.opened, menuitem.created, ...), so the
+# type of an existing stream is that of its first event
+BACKFILL_STREAMS = '''
+    INSERT INTO restaurant_stream (id, type, head_revision, first_event_time, last_event_time, event_count)
+    SELECT event_stream_id, (array_agg(split_part(type, '.', 1) ORDER BY revision))[1], max(revision), min(time),
+           max(time), count(*)
+    FROM restaurant_event
+    GROUP BY event_stream_id
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0004_as_of_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stream',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('type', models.CharField(db_index=True, max_length=125, verbose_name='aggregate type of the entity')),
+                ('head_revision', models.IntegerField()),
+                ('first_event_time', models.DateTimeField()),
+                ('last_event_time', models.DateTimeField()),
+                ('event_count', models.IntegerField()),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_STREAMS, migrations.RunSQL.noop),
+    ]
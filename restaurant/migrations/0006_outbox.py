@@ -0,0 +1,32 @@
+# Generated by Django 2.1.7 on 2026-10-18 14:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0005_stream_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('handler', models.CharField(max_length=255, verbose_name='name of the side effect handler')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(verbose_name='not claimed before (lease or retry backoff)')),
+                ('attempts', models.IntegerField(default=0)),
+                ('completed_at', models.DateTimeField(null=True)),
+                ('gave_up_at', models.DateTimeField(null=True)),
+                ('last_error', models.TextField(default='')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='restaurant.Event')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxentry',
+            index=models.Index(fields=['completed_at', 'gave_up_at', 'available_at'], name='outbox_pending_idx'),
+        ),
+    ]
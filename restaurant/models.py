@@ -23,3 +23,82 @@ class Event(models.Model):
 
     class Meta:
         unique_together = (('event_stream_id', 'revision'),)
+        indexes = [
+            # as of reads, by the time events occurred and by the time they were recorded
+            models.Index(fields=['event_stream_id', 'time', 'revision'], name='event_stream_time_idx'),
+            models.Index(fields=['event_stream_id', 'created_at'], name='event_stream_created_idx'),
+        ]
+
+
+class Stream(models.Model):
+    """Catalog of the event streams, maintained in the same transaction as the events appended to them.
+
+    Answers existence, head revision and "all streams of a type" lookups without touching the event table, and guards
+    appends: see EventPersistenceService.save_many
+    """
+    id = models.UUIDField(primary_key=True)
+    type = models.CharField('aggregate type of the entity', max_length=125, db_index=True, null=False)
+    head_revision = models.IntegerField(null=False)
+    first_event_time = models.DateTimeField(null=False)
+    last_event_time = models.DateTimeField(null=False)
+    event_count = models.IntegerField(null=False)
+
+
+class Snapshot(models.Model):
+    """The state of an entity at a given revision, so loads only need to replay the events that follow it"""
+    time = models.DateTimeField('date / time of the last event folded into this snapshot', null=False)
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    type = models.CharField('aggregate type of the entity', max_length=125, null=False)
+    # fingerprint of the entity code that produced the state, see EventableEntity.snapshot_version
+    version = models.CharField(max_length=40, null=False)
+    event_stream_id = models.UUIDField(null=False)
+    revision = models.IntegerField(null=False)
+    data = JSONField(null=False)
+
+    class Meta:
+        unique_together = (('event_stream_id', 'version', 'revision'),)
+
+
+class ProjectionCheckpoint(models.Model):
+    """How far (by global Event.id) a projector has processed the event store"""
+    name = models.CharField(max_length=125, primary_key=True)
+    position = models.BigIntegerField(null=False, default=0)
+    updated_at = models.DateTimeField(auto_now=True, null=False)
+
+
+class RestaurantView(models.Model):
+    """Read model holding the current state of every restaurant, maintained by RestaurantProjector"""
+    id = models.UUIDField(primary_key=True)
+    revision = models.IntegerField(null=False, default=0)
+    name = models.CharField(max_length=255, db_index=True, null=False, default='')
+    address = models.CharField(max_length=255, null=False, default='')
+    year_opened = models.IntegerField(null=True)
+    employees = JSONField(null=False, default=list)
+    menu_item_ids = JSONField(null=False, default=list)
+
+
+class MenuItemView(models.Model):
+    """Read model holding the current state of every menu item, maintained by MenuItemProjector"""
+    id = models.UUIDField(primary_key=True)
+    revision = models.IntegerField(null=False, default=0)
+    name = models.CharField(max_length=255, db_index=True, null=False, default='')
+    category = models.CharField(max_length=50, db_index=True, null=False, default='')
+    price_in_cents = models.IntegerField(null=False, default=0)
+
+
+class OutboxEntry(models.Model):
+    """A side effect of an event still to be run by a handler (or already run), written in the same transaction as the
+    event. Claimed by workers for a lease, so an entry whose worker died is claimed again once the lease is up"""
+    event = models.ForeignKey('restaurant.Event', null=False, on_delete=models.CASCADE)
+    handler = models.CharField('name of the side effect handler', max_length=255, null=False)
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    available_at = models.DateTimeField('not claimed before (lease or retry backoff)', null=False)
+    attempts = models.IntegerField(null=False, default=0)
+    completed_at = models.DateTimeField(null=True)
+    gave_up_at = models.DateTimeField(null=True)
+    last_error = models.TextField(null=False, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['completed_at', 'gave_up_at', 'available_at'], name='outbox_pending_idx'),
+        ]
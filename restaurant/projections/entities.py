@@ -1,10 +1,48 @@
+import hashlib
+import time
 import uuid
 from abc import ABCMeta, abstractmethod
-from typing import Dict, Callable, Any, List
+from types import CodeType
+from typing import Dict, Callable, Any, List, Iterable
 
+from restaurant import instrumentation
 from restaurant.events.base import BaseEvent
 from restaurant.events.menu_item import MenuItemCreated, PriceChanged
 from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded, MenuItemRemoved
+from restaurant.projections.reductions import Reduction, Sum, Latest
+
+
+_snapshot_versions: Dict[type, str] = {}
+
+
+def handles(*event_classes: type) -> Callable:
+    """Registers an entity method as the handler of the given event classes, and of their subclasses which have no
+    handler of their own"""
+    def register(func: Callable) -> Callable:
+        func.handled_event_classes = event_classes
+        return func
+    return register
+
+
+def _fingerprint_code(digest, code: CodeType) -> None:
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            # nested functions / comprehensions: their repr contains a memory address, hash their bytecode instead
+            _fingerprint_code(digest, const)
+        else:
+            digest.update(_canonical_repr(const).encode())
+    digest.update(repr(code.co_names).encode())
+
+
+def _canonical_repr(const: Any) -> str:
+    """repr of a code constant which is the same in every process: the iteration order of a set depends on the hash
+    seed of the process (e.g. the frozenset `x in {'a', 'b'}` compiles to), so its elements are sorted"""
+    if isinstance(const, (set, frozenset)):
+        return '{}({{{}}})'.format(type(const).__name__, ', '.join(sorted(map(_canonical_repr, const))))
+    if isinstance(const, tuple):
+        return '({},)'.format(', '.join(map(_canonical_repr, const)))
+    return repr(const)
 
 
 class EventableEntity(object):
@@ -12,6 +50,13 @@ class EventableEntity(object):
 
     __metaclass__= ABCMeta
 
+    # key identifying the kind of aggregate (e.g. for snapshots), set by each concrete entity
+    aggregate_type: str = None
+    # bump when the shape returned by snapshot_state changes in a way the bytecode fingerprint would not catch
+    snapshot_schema = 1
+    # fields which are pure reductions over event data, and so can be computed by the database without a replay
+    reductions: Dict[str, Reduction] = {}
+
     def __init__(self, id: uuid.UUID=None, revision:int=0):
         if id is None:
             self.id = uuid.uuid4()
@@ -20,10 +65,62 @@ class EventableEntity(object):
         self.revision = revision
         self.uncommitted_events = []
 
-    @abstractmethod
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # compile the dispatch table once per class: event class -> handler function, including inherited handlers
+        cls._handlers: Dict[type, Callable] = {}
+        for klass in reversed(cls.__mro__):
+            for name, func in vars(klass).items():
+                for event_class in getattr(func, 'handled_event_classes', ()):
+                    # by name, so that overriding a handler in a subclass replaces it
+                    cls._handlers[event_class] = getattr(cls, name)
+        cls._dispatch = dict(cls._handlers)
+
+    @classmethod
+    def handler_for(cls, event_class: type) -> Callable:
+        """The handler function of an event class, falling back to that of its closest handled base class"""
+        handler = cls._dispatch.get(event_class)
+        if handler is None:
+            for base in event_class.__mro__[1:]:
+                if base in cls._handlers:
+                    handler = cls._dispatch[event_class] = cls._handlers[base]
+                    break
+            else:
+                raise ValueError('{} has no handler for {}'.format(cls.__name__, event_class.__name__))
+        return handler
+
     def event_map(self) -> Dict[Any, Callable]:
+        return {event_class: handler.__get__(self) for event_class, handler in self._handlers.items()}
+
+    @abstractmethod
+    def snapshot_state(self) -> Dict[str, Any]:
+        """JSON-serializable copy of the state built up by the event handlers"""
+        pass
+
+    @abstractmethod
+    def restore_snapshot_state(self, state: Dict[str, Any]) -> None:
         pass
 
+    @classmethod
+    def snapshot_version(cls) -> str:
+        """Fingerprint of the code that produces this entity's snapshot state.
+
+        Any change to a registered handler (or to the snapshot (de)serialization) yields a new version, so snapshots
+        written by older code are ignored rather than restored into state they no longer describe.
+        """
+        if cls not in _snapshot_versions:
+            digest = hashlib.sha1(str(cls.snapshot_schema).encode())
+            handlers = sorted((event_class.get_event_type(), handler)
+                              for event_class, handler in cls._handlers.items())
+            handlers.append(('', cls.snapshot_state))
+            handlers.append(('', cls.restore_snapshot_state))
+            for event_type, func in handlers:
+                digest.update(event_type.encode())
+                digest.update(func.__qualname__.encode())
+                _fingerprint_code(digest, func.__code__)
+            _snapshot_versions[cls] = digest.hexdigest()
+        return _snapshot_versions[cls]
+
     def apply(self, event: BaseEvent) -> None:
         if event.revision <= self.revision:
             raise ValueError('Current entity revision is {}. Attempted to apply an event with revision {}'.format(
@@ -37,10 +134,42 @@ class EventableEntity(object):
             event.set_event_stream_id(self.id)
             event.first_observation = True
             self.uncommitted_events.append(event)
-        self.event_map()[event.__class__](event)
+        self.handler_for(event.__class__)(self, event)
+
+    def replay(self, events: Iterable[BaseEvent]) -> int:
+        """Apply persisted events, read in revision order from the store, without checking each one's revision.
+
+        Only the final revision is checked against the number of events applied, so a gap is still detected, though
+        after the fact: the entity must then be discarded. Returns the number of events applied
+        """
+        started = time.perf_counter() if instrumentation.active else None
+        dispatch = self._dispatch
+        applied = 0
+        event = None
+        for event in events:
+            handler = dispatch.get(event.__class__)
+            if handler is None:
+                handler = self.handler_for(event.__class__)
+            handler(self, event)
+            applied += 1
+        if event is not None:
+            if event.revision != self.revision + applied:
+                raise ValueError('Replayed {} events from revision {} up to revision {}. Events are missing or out of '
+                                 'order'.format(applied, self.revision, event.revision))
+            self.revision = event.revision
+        if started is not None:
+            instrumentation.observe('apply_seconds', time.perf_counter() - started)
+        return applied
 
 
 class Restaurant(EventableEntity):
+    aggregate_type = 'restaurant'
+    reductions = {
+        'name': Latest(RestaurantOpened, 'name'),
+        'year_opened': Latest(RestaurantOpened, 'year'),
+        'address': Latest(RestaurantOpened, 'location'),
+    }
+
     def __init__(self, id: uuid.UUID=None):
         super().__init__(id)
         self.name = ''
@@ -50,32 +179,44 @@ class Restaurant(EventableEntity):
         self.menu_items: List[MenuItem] = []
         self.menu_item_ids = []
 
-    def event_map(self) -> Dict[Any, Callable]:
+    def snapshot_state(self) -> Dict[str, Any]:
         return {
-            RestaurantOpened: self.apply_opened,
-            EmployeeHired: self.apply_hired,
-            EmployeeFired: self.apply_fired,
-            MenuItemAdded: self.apply_menu_item_added,
-            MenuItemRemoved: self.apply_menu_item_removed
+            'name': self.name,
+            'year_opened': self.year_opened,
+            'address': self.address,
+            'employees': list(self.employees),
+            'menu_item_ids': [str(menu_item_id) for menu_item_id in self.menu_item_ids]
         }
 
+    def restore_snapshot_state(self, state: Dict[str, Any]) -> None:
+        self.name = state['name']
+        self.year_opened = state['year_opened']
+        self.address = state['address']
+        self.employees = list(state['employees'])
+        self.menu_item_ids = [uuid.UUID(menu_item_id) for menu_item_id in state['menu_item_ids']]
+
+    @handles(RestaurantOpened)
     def apply_opened(self, event:RestaurantOpened) -> None:
         self.name = event.name
         self.year_opened = event.year
         self.address = event.location
 
+    @handles(EmployeeHired)
     def apply_hired(self, event: EmployeeHired) -> None:
         if event.employee_name not in self.employees:
             self.employees.append(event.employee_name)
 
+    @handles(EmployeeFired)
     def apply_fired(self, event: EmployeeFired) -> None:
         if event.employee_name in self.employees:
             self.employees.remove(event.employee_name)
 
+    @handles(MenuItemAdded)
     def apply_menu_item_added(self, event: MenuItemAdded) -> None:
         if event.menu_item_id not in self.menu_item_ids:
             self.menu_item_ids.append(event.menu_item_id)
 
+    @handles(MenuItemRemoved)
     def apply_menu_item_removed(self, event: MenuItemRemoved) -> None:
         if event.menu_item_id in self.menu_item_ids:
             self.menu_item_ids.remove(event.menu_item_id)
@@ -87,21 +228,36 @@ class MenuItem(EventableEntity):
     CATEGORY_ENTREE = 'entre'
     CATEGORY_DESSERT = 'dessert'
 
+    aggregate_type = 'menuitem'
+    reductions = {
+        'name': Latest(MenuItemCreated, 'name'),
+        'category': Latest(MenuItemCreated, 'category'),
+        'price_in_cents': Sum(PriceChanged, 'delta'),
+    }
+
     def __init__(self, id: uuid.UUID = None):
         super().__init__(id)
         self.name = ''
         self.category = ''
         self.price_in_cents = 0
 
-    def event_map(self) -> Dict[Any, Callable]:
+    def snapshot_state(self) -> Dict[str, Any]:
         return {
-            MenuItemCreated: self.apply_created,
-            PriceChanged: self.apply_price_delta
+            'name': self.name,
+            'category': self.category,
+            'price_in_cents': self.price_in_cents
         }
 
+    def restore_snapshot_state(self, state: Dict[str, Any]) -> None:
+        self.name = state['name']
+        self.category = state['category']
+        self.price_in_cents = state['price_in_cents']
+
+    @handles(MenuItemCreated)
     def apply_created(self, event: MenuItemCreated) -> None:
         self.name = event.name
         self.category = event.category
 
+    @handles(PriceChanged)
     def apply_price_delta(self, event: PriceChanged) -> None:
         self.price_in_cents = self.price_in_cents + event.delta
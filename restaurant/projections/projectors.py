@@ -0,0 +1,133 @@
+from abc import ABCMeta, abstractmethod
+from typing import Dict, Callable, Any, List
+
+from django.db import models
+
+from restaurant.events.base import BaseEvent
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded, MenuItemRemoved
+from restaurant.models import RestaurantView, MenuItemView
+
+
+class Projector(object):
+    """Maintains a read model from the events of the types it subscribes to.
+
+    Projectors are fed batches of events in global order by the ProjectionService, which keeps track of how far each
+    projector (by name) has read.
+    """
+
+    __metaclass__ = ABCMeta
+
+    name: str = None
+
+    @abstractmethod
+    def event_map(self) -> Dict[Any, Callable]:
+        pass
+
+    def event_types(self) -> List[str]:
+        return [event_class.get_event_type() for event_class in self.event_map().keys()]
+
+    def handle_batch(self, events: List[BaseEvent]) -> None:
+        handlers = self.event_map()
+        for event in events:
+            self.handler_for(handlers, event)(event)
+
+    def handler_for(self, handlers: Dict[Any, Callable], event: BaseEvent) -> Callable:
+        """The handler of the event's class, or of its closest base class: lazily decoded events subclass theirs"""
+        handler = handlers.get(event.__class__)
+        if handler is None:
+            handler = next(handlers[base] for base in event.__class__.__mro__ if base in handlers)
+        return handler
+
+    @abstractmethod
+    def reset(self) -> None:
+        """Throw away the read model, ahead of a rebuild"""
+        pass
+
+
+class ModelProjector(Projector):
+    """Projects every stream onto a single row of a Django model whose primary key is the event_stream_id.
+
+    Rows touched by a batch are loaded with one query, updated in memory by the handlers, then written back once per
+    row rather than once per event. Handlers receive the row and the event.
+    """
+
+    model: models.Model = None
+
+    def handle_batch(self, events: List[BaseEvent]) -> None:
+        handlers = self.event_map()
+        rows = self.model.objects.in_bulk({event.event_stream_id for event in events})
+        created = {}
+        changed = {}
+        for event in events:
+            row = rows.get(event.event_stream_id)
+            if row is None:
+                row = self.model(id=event.event_stream_id)
+                rows[row.id] = created[row.id] = row
+            if event.revision <= row.revision:
+                # already projected
+                continue
+            self.handler_for(handlers, event)(row, event)
+            row.revision = event.revision
+            if row.id not in created:
+                changed[row.id] = row
+
+        self.model.objects.bulk_create(created.values(), batch_size=1000)
+        for row in changed.values():
+            row.save()
+
+    def reset(self) -> None:
+        self.model.objects.all().delete()
+
+
+class RestaurantProjector(ModelProjector):
+    name = 'restaurant_view'
+    model = RestaurantView
+
+    def event_map(self) -> Dict[Any, Callable]:
+        return {
+            RestaurantOpened: self.apply_opened,
+            EmployeeHired: self.apply_hired,
+            EmployeeFired: self.apply_fired,
+            MenuItemAdded: self.apply_menu_item_added,
+            MenuItemRemoved: self.apply_menu_item_removed
+        }
+
+    def apply_opened(self, view: RestaurantView, event: RestaurantOpened) -> None:
+        view.name = event.name
+        view.year_opened = event.year
+        view.address = event.location
+
+    def apply_hired(self, view: RestaurantView, event: EmployeeHired) -> None:
+        if event.employee_name not in view.employees:
+            view.employees.append(event.employee_name)
+
+    def apply_fired(self, view: RestaurantView, event: EmployeeFired) -> None:
+        if event.employee_name in view.employees:
+            view.employees.remove(event.employee_name)
+
+    def apply_menu_item_added(self, view: RestaurantView, event: MenuItemAdded) -> None:
+        if str(event.menu_item_id) not in view.menu_item_ids:
+            view.menu_item_ids.append(str(event.menu_item_id))
+
+    def apply_menu_item_removed(self, view: RestaurantView, event: MenuItemRemoved) -> None:
+        if str(event.menu_item_id) in view.menu_item_ids:
+            view.menu_item_ids.remove(str(event.menu_item_id))
+
+
+class MenuItemProjector(ModelProjector):
+    name = 'menu_item_view'
+    model = MenuItemView
+
+    def event_map(self) -> Dict[Any, Callable]:
+        return {
+            MenuItemCreated: self.apply_created,
+            PriceChanged: self.apply_price_delta
+        }
+
+    def apply_created(self, view: MenuItemView, event: MenuItemCreated) -> None:
+        view.name = event.name
+        view.category = event.category
+
+    def apply_price_delta(self, view: MenuItemView, event: PriceChanged) -> None:
+        view.price_in_cents = view.price_in_cents + event.delta
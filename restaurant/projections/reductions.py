@@ -0,0 +1,64 @@
+from abc import ABCMeta, abstractmethod
+from typing import Any, List, Tuple
+
+
+class Reduction(object):
+    """Declares an entity field as a pure reduction over one field of one event class, so the database can compute it
+    with an aggregate instead of the entity being replayed (see BaseEntityService.get_reduced_fields).
+
+    The declaration must agree with the entity's handler of the event class: it is what the handler computes.
+    """
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, event_class: type, field: str):
+        field_types = dict(event_class.schema)
+        if field not in field_types:
+            raise ValueError('{} has no field {}'.format(event_class.__name__, field))
+        self.event_class = event_class
+        self.field = field
+        self.field_type = field_types[field]
+
+    @abstractmethod
+    def aggregate(self) -> Tuple[str, List[Any]]:
+        """SQL aggregate over the data of the events of a stream, and its parameters. NULL when there are none"""
+        pass
+
+    @abstractmethod
+    def reduce(self, events: List[Any]) -> Any:
+        """The same reduction over the events of a stream in revision order, for backends without SQL. None when there
+        are none of the event class"""
+        pass
+
+    def to_python(self, value: Any) -> Any:
+        # values are read from the database as text or integers, converted to the type of the event field
+        return value if value is None or isinstance(value, self.field_type) else self.field_type(value)
+
+
+class Sum(Reduction):
+    """The sum of an integer field, e.g. a price made of price deltas"""
+
+    def __init__(self, event_class: type, field: str):
+        super().__init__(event_class, field)
+        if self.field_type is not int:
+            raise ValueError('Cannot sum {}.{}, which is not an integer'.format(event_class.__name__, field))
+
+    def aggregate(self) -> Tuple[str, List[Any]]:
+        return '(sum((data->>%s)::bigint) FILTER (WHERE type = %s))::bigint', \
+               [self.field, self.event_class.get_event_type()]
+
+    def reduce(self, events: List[Any]) -> Any:
+        values = [getattr(event, self.field) for event in events if event.__class__ is self.event_class]
+        return sum(values) if len(values) > 0 else None
+
+
+class Latest(Reduction):
+    """The value of a field in the event of the highest revision, e.g. a name set on creation and on renames"""
+
+    def aggregate(self) -> Tuple[str, List[Any]]:
+        return '(array_agg(data->>%s ORDER BY revision DESC) FILTER (WHERE type = %s))[1]', \
+               [self.field, self.event_class.get_event_type()]
+
+    def reduce(self, events: List[Any]) -> Any:
+        values = [getattr(event, self.field) for event in events if event.__class__ is self.event_class]
+        return values[-1] if len(values) > 0 else None
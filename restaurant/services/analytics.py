@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from typing import List, Tuple, Optional
+from uuid import UUID
+
+import numpy as np
+from django.db import connection
+
+from restaurant.events.menu_item import PriceChanged
+from restaurant.events.timestamps import to_micros
+from restaurant.models import Event
+
+class PriceHistory(object):
+    """The price changes of many menu items held column by column: stream index, time and delta of every
+    PriceChanged event, sorted by stream then time.
+
+    Times are microseconds since the epoch (UTC). A menu item's price is the sum of its deltas, so the price after each
+    change is a cumulative sum restarted at the first change of every item, computed for all items at once.
+    """
+
+    def __init__(self, event_stream_ids: List[UUID], stream_indexes: np.ndarray, times: np.ndarray,
+                 deltas: np.ndarray):
+        self.event_stream_ids = event_stream_ids
+        self.stream_indexes = stream_indexes
+        self.times = times
+        self.deltas = deltas
+        self._index_of = {event_stream_id: index for index, event_stream_id in enumerate(event_stream_ids)}
+        counts = np.bincount(stream_indexes, minlength=len(event_stream_ids))
+        # first row of every stream, and one past the last row of the last stream
+        self.starts = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.prices = self._segmented_cumsum(deltas, self.starts)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def series(self, event_stream_id: UUID) -> Tuple[np.ndarray, np.ndarray]:
+        """Times (microseconds since the epoch) of the price changes of a menu item, and its price after each"""
+        index = self._index_of.get(event_stream_id)
+        if index is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        start, end = self.starts[index], self.starts[index + 1]
+        return self.times[start:end], self.prices[start:end]
+
+    def price_matrix(self, event_stream_ids: List[UUID], as_of: List[datetime]) -> np.ndarray:
+        """Price of every menu item (rows) as of every point in time (columns), 0 before an item's first price change.
+
+        Answered with a single searchsorted over composite (stream, time) keys for the whole matrix.
+        """
+        rows = np.array([self._index_of.get(event_stream_id, -1) for event_stream_id in event_stream_ids],
+                        dtype=np.int64)
+        columns = np.array([to_micros(time) for time in as_of], dtype=np.int64)
+        matrix = np.zeros((len(rows), len(columns)), dtype=np.int64)
+        known = rows >= 0
+        if len(self.times) == 0 or not known.any() or len(columns) == 0:
+            return matrix
+
+        # keys are stream * width + time offset, with offsets 1..span for events and 0 for "before any event"
+        first = int(self.times.min())
+        width = int(self.times.max()) - first + 2
+        if width * len(self.event_stream_ids) >= np.iinfo(np.int64).max:
+            raise ValueError('Price changes span too long a period for {} menu items'.format(
+                len(self.event_stream_ids)))
+        keys = self.stream_indexes.astype(np.int64) * width + (self.times - first + 1)
+        offsets = np.clip(columns - first + 1, 0, width - 1)
+        queries = rows[known][:, np.newaxis] * width + offsets[np.newaxis, :]
+        # number of rows up to and including the last change by then, of that stream or an earlier one
+        found = np.searchsorted(keys, queries.ravel(), side='right').reshape(queries.shape)
+        has_price = found > self.starts[rows[known]][:, np.newaxis]
+        matrix[known] = np.where(has_price, self.prices[np.maximum(found - 1, 0)], 0)
+        return matrix
+
+    def _segmented_cumsum(self, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        totals = np.cumsum(values, dtype=np.int64)
+        # the running total before each stream starts, subtracted from every row of that stream
+        before = np.concatenate(([0], totals))[starts[:-1]]
+        return totals - np.repeat(before, np.diff(starts))
+
+
+class PriceAnalyticsService(object):
+    """Bulk loads of menu item price history, for analytics over many items and dates"""
+
+    def load(self, event_stream_ids: Optional[List[UUID]]=None) -> PriceHistory:
+        """The price changes of the given menu items, or of all of them, in a single query"""
+        query = (
+            'SELECT CASE WHEN lag(event_stream_id) OVER w IS DISTINCT FROM event_stream_id THEN event_stream_id END, '
+            '(extract(epoch FROM time) * 1000000)::bigint, (data->>%s)::bigint '
+            'FROM {table} WHERE type = %s {filter}'
+            'WINDOW w AS (ORDER BY event_stream_id, time, revision) '
+            'ORDER BY event_stream_id, time, revision'
+        )
+        params = ['delta', PriceChanged.get_event_type()]
+        if event_stream_ids is not None:
+            params.append([str(event_stream_id) for event_stream_id in event_stream_ids])
+        query = query.format(table=connection.ops.quote_name(Event._meta.db_table),
+                             filter='AND event_stream_id = ANY(%s::uuid[]) ' if event_stream_ids is not None else '')
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        event_stream_ids = []
+        new_stream = np.fromiter((row[0] is not None for row in rows), dtype=bool, count=len(rows))
+        for row in rows:
+            if row[0] is not None:
+                event_stream_ids.append(UUID(str(row[0])))
+        stream_indexes = (np.cumsum(new_stream) - 1).astype(np.int64)
+        times = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        deltas = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        return PriceHistory(event_stream_ids, stream_indexes, times, deltas)
+
+
+def day_ends(first_day: date, last_day: date) -> List[datetime]:
+    """The last microsecond (UTC) of every day from first_day to last_day, inclusive"""
+    days = (last_day - first_day).days + 1
+    return [datetime(first_day.year, first_day.month, first_day.day, tzinfo=dt_timezone.utc)
+            + timedelta(days=day + 1, microseconds=-1) for day in range(days)]
+
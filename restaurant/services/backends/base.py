@@ -0,0 +1,133 @@
+from abc import ABCMeta, abstractmethod
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import groupby
+from typing import List, Iterator, Optional, Callable, Tuple, Dict, Any, ContextManager
+from uuid import UUID
+
+from restaurant.events.base import BaseEvent
+from restaurant.events.batch import EventBatch
+from restaurant.events.codecs import get_codec
+from restaurant.events.timestamps import aware
+from restaurant.projections.reductions import Reduction
+
+
+class ConcurrencyConflict(Exception):
+    """Another writer appended to a stream after the entity being saved was loaded"""
+
+    def __init__(self, event_stream_ids: List[UUID]):
+        super().__init__('Concurrent modification of stream(s) {}'.format(', '.join(map(str, event_stream_ids))))
+        self.event_stream_ids = event_stream_ids
+
+
+class StreamAppend(object):
+    """Events to append to a stream, which must be at expected_revision: the events follow on from it"""
+
+    def __init__(self, event_stream_id: UUID, aggregate_type: str, expected_revision: int, events: List[BaseEvent]):
+        self.event_stream_id = event_stream_id
+        self.aggregate_type = aggregate_type
+        self.expected_revision = expected_revision
+        self.events = events
+
+
+def check_follow_on(appends: List[StreamAppend]) -> None:
+    """Raise ConcurrencyConflict for the streams whose events do not follow on from their expected revision: the
+    stream is at the revision the caller expected, but the entity was loaded at another one, so is not its state"""
+    conflicts = [stream_append.event_stream_id for stream_append in appends
+                 if any(event.revision != stream_append.expected_revision + index + 1
+                        for index, event in enumerate(stream_append.events))]
+    if len(conflicts) > 0:
+        raise ConcurrencyConflict(conflicts)
+
+
+class EventStoreBackend(object):
+    """Where events are kept: appends guarded by the revision each stream is expected to be at, reads by stream or in
+    global order, and a catalog of the streams and their aggregate types.
+
+    Read events carry their global position, which is strictly increasing in the order events were appended. The bulk
+    reads (batches, as of many points, reductions) have implementations in terms of the other reads, which backends
+    override with faster ones where they can.
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def append(self, appends: List[StreamAppend]) -> int:
+        """Append the events of every stream atomically. Returns the position of the last event appended.
+
+        Raises ConcurrencyConflict, appending nothing, if any stream is not at its expected revision.
+        """
+        pass
+
+    @abstractmethod
+    def read_stream(self, event_stream_id: UUID, after_revision: int=0, max_date: datetime=None,
+                    recorded_before: datetime=None) -> List[BaseEvent]:
+        """The events of a stream after a revision, in revision order, optionally only those that occurred by max_date
+        and / or were recorded by recorded_before. Raises ValueError if the backend does not keep the time events were
+        recorded"""
+        pass
+
+    @abstractmethod
+    def read_many(self, event_stream_ids: List[UUID], max_date: datetime=None) -> Iterator[BaseEvent]:
+        """The events of many streams, grouped by stream and in revision order within each"""
+        pass
+
+    @abstractmethod
+    def read_all(self, position: int=0, limit: int=None, event_types: List[str]=None) -> List[BaseEvent]:
+        """Up to limit events after a global position, in position order, optionally only those of the given types"""
+        pass
+
+    @abstractmethod
+    def head_revision(self, event_stream_id: UUID, aggregate_type: str=None) -> Optional[int]:
+        """The revision of the last event of a stream, None if it has none (or is not of aggregate_type, if given)"""
+        pass
+
+    @abstractmethod
+    def stream_ids(self, aggregate_type: str) -> Iterator[UUID]:
+        """The ids of the streams of an aggregate type, in id order"""
+        pass
+
+    def stream_exists(self, event_stream_id: UUID, aggregate_type: str=None) -> bool:
+        return self.head_revision(event_stream_id, aggregate_type) is not None
+
+    def read_many_batches(self, event_stream_ids: List[UUID], max_date: datetime=None) -> List[EventBatch]:
+        """The events of many streams as one EventBatch per stream with events, see read_many"""
+        batches = []
+        for event_stream_id, events in groupby(self.read_many(event_stream_ids, max_date),
+                                               key=lambda event: event.event_stream_id):
+            batch = EventBatch(event_stream_id)
+            for event in events:
+                event_type = event.__class__.get_event_type()
+                batch.append(event_type, event.revision, event.user_id, aware(event.timestamp), event.position,
+                             get_codec(event_type).encode(event))
+            batches.append(batch)
+        return batches
+
+    def read_as_of(self, points: List[Tuple[UUID, datetime]], field: str='time') -> Iterator[Tuple[int, BaseEvent]]:
+        """The events of many streams, each as of its own point along field, 'time' (occurred) or 'created_at'
+        (recorded). Yields (index of the point, event), ordered by point then revision"""
+        for index, (event_stream_id, as_of) in enumerate(points):
+            events = self.read_stream(event_stream_id, max_date=as_of) if field == 'time' else \
+                self.read_stream(event_stream_id, recorded_before=as_of)
+            for event in events:
+                yield index, event
+
+    def reduce_streams(self, event_stream_ids: List[UUID], aggregate_type: str, reductions: Dict[str, Reduction],
+                       max_date: datetime=None) -> Dict[UUID, Dict[str, Any]]:
+        """The reductions over the events of every stream of the aggregate type with events by max_date, None where
+        it has no events to reduce"""
+        ids = [event_stream_id for event_stream_id in dict.fromkeys(event_stream_ids)
+               if self.head_revision(event_stream_id, aggregate_type) is not None]
+        reduced = {}
+        for event_stream_id, events in groupby(self.read_many(ids, max_date), key=lambda event: event.event_stream_id):
+            events = list(events)
+            reduced[event_stream_id] = {name: reduction.reduce(events) for name, reduction in reductions.items()}
+        return reduced
+
+    def atomic(self) -> ContextManager:
+        """A block whose appends, and the database writes made along with them, are all kept or none are"""
+        return nullcontext()
+
+    def on_commit(self, func: Callable[[], None]) -> None:
+        """Run func once the events appended so far are durable, e.g. when the enclosing transaction commits"""
+        func()
@@ -0,0 +1,233 @@
+import re
+import time
+from datetime import datetime
+from typing import List, Iterator, Optional, Callable, Dict, Tuple, Any, ContextManager
+from uuid import UUID
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import QuerySet
+
+from restaurant import instrumentation
+from restaurant.events.base import BaseEvent
+from restaurant.events.batch import EventBatch
+from restaurant.events.timestamps import aware
+from restaurant.models import Event, Stream
+from restaurant.projections.reductions import Reduction
+from restaurant.services.backends.base import EventStoreBackend, StreamAppend, ConcurrencyConflict, check_follow_on
+from restaurant.services.outbox import enqueue_side_effects
+from restaurant.services.subscriptions import notify_appended
+from restaurant.services.translation import DjangoEventTranslatorService
+
+UNIQUE_VIOLATION = '23505'
+
+
+class DatabaseEventStore(EventStoreBackend):
+    """Events kept in Postgres through the Event model, with the Stream catalog guarding appends.
+
+    Appends join the current transaction, if any, and write the outbox entries of their side effects in it. read_all
+    reads by Event.id, which transactions committing out of order can leave gaps in while they are in flight: use
+    EventSubscription to follow the store as it is written to. Reads of many streams go through a server-side cursor,
+    chunk_size rows at a time.
+    """
+
+    def __init__(self, batch_size: int=1000, chunk_size: int=2000):
+        self.translation_service = DjangoEventTranslatorService()
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+
+    def append(self, appends: List[StreamAppend]) -> int:
+        events = [event for stream_append in appends for event in stream_append.events]
+        rows = self.translation_service.translate_to_django_models(events)
+        try:
+            with transaction.atomic():
+                self._advance_streams(appends, rows)
+                check_follow_on(appends)
+                # the unique (event_stream_id, revision) constraint backs the catalog up as a concurrency guard
+                rows = Event.objects.bulk_create(rows, batch_size=self.batch_size)
+                enqueue_side_effects(events, rows)
+                notify_appended(rows[-1].id)
+        except IntegrityError as e:
+            if getattr(e.__cause__, 'pgcode', None) != UNIQUE_VIOLATION:
+                raise
+            raise ConcurrencyConflict(self._conflicting_stream_ids(e, appends)) from e
+        return rows[-1].id
+
+    def read_stream(self, event_stream_id: UUID, after_revision: int=0, max_date: datetime=None,
+                    recorded_before: datetime=None) -> List[BaseEvent]:
+        queryset = Event.objects.filter(event_stream_id=event_stream_id, revision__gt=after_revision)
+        return self._translate(self._as_of(queryset, max_date, recorded_before).order_by('revision'))
+
+    def read_many(self, event_stream_ids: List[UUID], max_date: datetime=None) -> Iterator[BaseEvent]:
+        queryset = self._as_of(Event.objects.filter(event_stream_id__in=event_stream_ids), max_date)
+        rows = queryset.order_by('event_stream_id', 'revision').iterator(chunk_size=self.chunk_size)
+        for event in self._instrumented(rows):
+            yield self.translation_service.translate_event_to_domain_event(event)
+
+    def read_many_batches(self, event_stream_ids: List[UUID], max_date: datetime=None) -> List[EventBatch]:
+        # straight from the rows' columns, without building a model instance or event per row
+        batches = []
+        batch = None
+        rows = self._as_of(Event.objects.filter(event_stream_id__in=event_stream_ids), max_date)\
+            .order_by('event_stream_id', 'revision')\
+            .values_list('event_stream_id', 'type', 'revision', 'user_id', 'time', 'id', 'data')\
+            .iterator(chunk_size=self.chunk_size)
+        for event_stream_id, event_type, revision, user_id, time, position, data in self._instrumented(rows):
+            if batch is None or batch.event_stream_id != event_stream_id:
+                batch = EventBatch(event_stream_id)
+                batches.append(batch)
+            batch.append(event_type, revision, user_id, time, position, data)
+        return batches
+
+    def read_as_of(self, points: List[Tuple[UUID, datetime]], field: str='time') -> Iterator[Tuple[int, BaseEvent]]:
+        # in a single query, joining the points to the events
+        if len(points) == 0:
+            return
+        query = (
+            'SELECT points.point_index, events.* '
+            'FROM unnest(%s::uuid[], %s::timestamptz[]) WITH ORDINALITY AS points(event_stream_id, as_of, point_index) '
+            'JOIN {table} AS events ON events.event_stream_id = points.event_stream_id '
+            'AND events.{field} <= points.as_of '
+            'ORDER BY points.point_index, events.revision'
+        ).format(table=connection.ops.quote_name(Event._meta.db_table), field=field)
+        params = [[str(event_stream_id) for event_stream_id, _ in points], [aware(time) for _, time in points]]
+        for event in Event.objects.raw(query, params):
+            yield event.point_index - 1, self.translation_service.translate_event_to_domain_event(event)
+
+    def read_all(self, position: int=0, limit: int=None, event_types: List[str]=None) -> List[BaseEvent]:
+        queryset = Event.objects.filter(id__gt=position)
+        if event_types is not None:
+            queryset = queryset.filter(type__in=event_types)
+        queryset = queryset.order_by('id')
+        return self._translate(queryset[:limit] if limit is not None else queryset)
+
+    def head_revision(self, event_stream_id: UUID, aggregate_type: str=None) -> Optional[int]:
+        streams = Stream.objects.filter(id=event_stream_id)
+        if aggregate_type is not None:
+            streams = streams.filter(type=aggregate_type)
+        return streams.values_list('head_revision', flat=True).first()
+
+    def stream_ids(self, aggregate_type: str) -> Iterator[UUID]:
+        return Stream.objects.filter(type=aggregate_type).values_list('id', flat=True).order_by('id').iterator()
+
+    def reduce_streams(self, event_stream_ids: List[UUID], aggregate_type: str, reductions: Dict[str, Reduction],
+                       max_date: datetime=None) -> Dict[UUID, Dict[str, Any]]:
+        # in a single GROUP BY query, the aggregates declared by the reductions
+        names = list(reductions)
+        aggregates = []
+        params = []
+        for index, name in enumerate(names):
+            aggregate, aggregate_params = reductions[name].aggregate()
+            aggregates.append('{} AS reduced_{}'.format(aggregate, index))
+            params.extend(aggregate_params)
+        ids = [str(event_stream_id) for event_stream_id in event_stream_ids]
+        event_types = sorted({reduction.event_class.get_event_type() for reduction in reductions.values()})
+        params.extend([ids, event_types])
+        time_filter = ''
+        if max_date is not None:
+            time_filter = 'AND time <= %s '
+            params.append(aware(max_date))
+        params.extend([ids, aggregate_type])
+        if max_date is not None:
+            params.append(aware(max_date))
+
+        query = (
+            'SELECT stream.id, {columns} FROM {streams} AS stream LEFT JOIN ('
+            'SELECT event_stream_id, {aggregates} FROM {events} '
+            'WHERE event_stream_id = ANY(%s::uuid[]) AND type = ANY(%s) {time_filter}'
+            'GROUP BY event_stream_id'
+            ') AS reduced ON reduced.event_stream_id = stream.id '
+            'WHERE stream.id = ANY(%s::uuid[]) AND stream.type = %s {existence_filter}'
+        ).format(columns=', '.join('reduced.reduced_{}'.format(index) for index in range(len(names))),
+                 streams=connection.ops.quote_name(Stream._meta.db_table),
+                 aggregates=', '.join(aggregates),
+                 events=connection.ops.quote_name(Event._meta.db_table),
+                 time_filter=time_filter,
+                 existence_filter='AND stream.first_event_time <= %s' if max_date is not None else '')
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        return {UUID(str(row[0])): {name: reductions[name].to_python(value) for name, value in zip(names, row[1:])}
+                for row in rows}
+
+    def atomic(self) -> ContextManager:
+        return transaction.atomic()
+
+    def on_commit(self, func: Callable[[], None]) -> None:
+        transaction.on_commit(func)
+
+    def _advance_streams(self, appends: List[StreamAppend], rows: List[Event]) -> None:
+        """Move the head of each stream in the catalog forward, provided it is still at its expected revision.
+        Otherwise another writer got there first: raise ConcurrencyConflict.
+
+        Streams are upserted in id order, so that concurrent multi-stream appends lock their rows in the same order.
+        """
+        times: Dict[UUID, List[datetime]] = {}
+        for row in rows:
+            times.setdefault(row.event_stream_id, []).append(row.time)
+        appends = sorted(appends, key=lambda stream_append: stream_append.event_stream_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} AS stream (id, type, head_revision, first_event_time, last_event_time, event_count) '
+                'SELECT * FROM unnest(%s::uuid[], %s::varchar[], %s::integer[], %s::timestamptz[], '
+                '%s::timestamptz[], %s::integer[]) '
+                'ON CONFLICT (id) DO UPDATE SET head_revision = EXCLUDED.head_revision, '
+                'first_event_time = least(stream.first_event_time, EXCLUDED.first_event_time), '
+                'last_event_time = greatest(stream.last_event_time, EXCLUDED.last_event_time), '
+                'event_count = stream.event_count + EXCLUDED.event_count '
+                'WHERE stream.head_revision = EXCLUDED.head_revision - EXCLUDED.event_count '
+                'RETURNING id'.format(table=connection.ops.quote_name(Stream._meta.db_table)),
+                [[str(stream_append.event_stream_id) for stream_append in appends],
+                 [stream_append.aggregate_type for stream_append in appends],
+                 [stream_append.expected_revision + len(stream_append.events) for stream_append in appends],
+                 [min(times[stream_append.event_stream_id]) for stream_append in appends],
+                 [max(times[stream_append.event_stream_id]) for stream_append in appends],
+                 [len(stream_append.events) for stream_append in appends]])
+            advanced = {UUID(str(row[0])) for row in cursor.fetchall()}
+        conflicts = [stream_append.event_stream_id for stream_append in appends
+                     if stream_append.event_stream_id not in advanced]
+        if len(conflicts) > 0:
+            raise ConcurrencyConflict(conflicts)
+
+    def _conflicting_stream_ids(self, error: IntegrityError, appends: List[StreamAppend]) -> List[UUID]:
+        # e.g. Key (event_stream_id, revision)=(9b1a0c8e-..., 2) already exists.
+        detail = getattr(getattr(error.__cause__, 'diag', None), 'message_detail', None) or ''
+        match = re.search(r'=\(([0-9a-f-]{36}),', detail)
+        if match is not None:
+            return [UUID(match.group(1))]
+        return [stream_append.event_stream_id for stream_append in appends]
+
+    def _as_of(self, queryset: QuerySet, max_date: datetime=None, recorded_before: datetime=None) -> QuerySet:
+        if max_date is not None:
+            queryset = queryset.filter(time__lte=aware(max_date))
+        if recorded_before is not None:
+            queryset = queryset.filter(created_at__lte=aware(recorded_before))
+        return queryset
+
+    def _instrumented(self, rows: Iterator) -> Iterator:
+        """The rows of a server-side cursor, recording the time spent fetching them, and their number, once the caller
+        is done with them"""
+        if not instrumentation.active:
+            yield from rows
+            return
+        fetched = 0
+        seconds = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                row = next(rows, None)
+                seconds += time.perf_counter() - started
+                if row is None:
+                    return
+                fetched += 1
+                yield row
+        finally:
+            instrumentation.observe('query_seconds', seconds)
+            instrumentation.increment('rows_fetched_total', fetched)
+
+    def _translate(self, queryset: QuerySet) -> List[BaseEvent]:
+        started = time.perf_counter() if instrumentation.active else None
+        rows = list(queryset)
+        if started is not None:
+            instrumentation.observe('query_seconds', time.perf_counter() - started)
+            instrumentation.increment('rows_fetched_total', len(rows))
+        return list(map(self.translation_service.translate_event_to_domain_event, rows))
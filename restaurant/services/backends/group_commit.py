@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import List, Iterator, Optional, Set, Tuple, Dict, Any
+from uuid import UUID
+
+from django.db import connection
+
+from restaurant.events.base import BaseEvent
+from restaurant.events.batch import EventBatch
+from restaurant.projections.reductions import Reduction
+from restaurant.services.backends.base import EventStoreBackend, StreamAppend, ConcurrencyConflict
+from restaurant.services.backends.database import DatabaseEventStore
+
+log = logging.getLogger(__name__)
+
+
+class _PendingAppend(object):
+
+    def __init__(self, appends: List[StreamAppend]):
+        self.appends = appends
+        self.event_stream_ids: Set[UUID] = {stream_append.event_stream_id for stream_append in appends}
+        self.event_count = sum(len(stream_append.events) for stream_append in appends)
+        self.done = threading.Event()
+        self.position: Optional[int] = None
+        self.error: Optional[Exception] = None
+
+    def resolve(self, position: int=None, error: Exception=None) -> None:
+        self.position = position
+        self.error = error
+        self.done.set()
+
+
+class GroupCommitEventStore(EventStoreBackend):
+    """Coalesces the appends of concurrent callers into a single append, and so a single commit, of the wrapped backend.
+
+    Appends are queued for a writer thread, which waits up to flush_window seconds after the first one arrives, or
+    until max_batch_events events are queued, then appends them all at once. Even without a window, appends queue up
+    while the previous group commits, so groups grow with the load: the window trades latency for larger groups.
+
+    Each caller blocks until its own appends are committed, or raises ConcurrencyConflict if they conflicted: a conflict
+    only fails the callers whose streams it is on, the rest of the group is appended again without them.
+
+    The writer thread has its own database connection, so appends do not join the caller's transaction: they are
+    durable as soon as append returns. Reads go straight to the wrapped backend.
+    """
+
+    def __init__(self, backend: EventStoreBackend=None, flush_window: float=0.0, max_batch_events: int=1000):
+        self.backend = backend if backend is not None else DatabaseEventStore()
+        self.flush_window = flush_window
+        self.max_batch_events = max_batch_events
+        # number of appends of the wrapped backend that committed, i.e. of group commits
+        self.commits = 0
+        self._pending: List[_PendingAppend] = []
+        self._pending_events = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._writer: Optional[threading.Thread] = None
+
+    def append(self, appends: List[StreamAppend]) -> int:
+        """Append once the current group is flushed. Returns the position of the last event of the group, which is at
+        or after that of the caller's last event"""
+        pending = _PendingAppend(appends)
+        with self._condition:
+            if self._closed:
+                raise ValueError('The group commit writer is closed')
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._writer.start()
+            self._pending.append(pending)
+            self._pending_events += pending.event_count
+            self._condition.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.position
+
+    def read_stream(self, event_stream_id: UUID, after_revision: int=0, max_date: datetime=None,
+                    recorded_before: datetime=None) -> List[BaseEvent]:
+        return self.backend.read_stream(event_stream_id, after_revision, max_date, recorded_before)
+
+    def read_many(self, event_stream_ids: List[UUID], max_date: datetime=None) -> Iterator[BaseEvent]:
+        return self.backend.read_many(event_stream_ids, max_date)
+
+    def read_all(self, position: int=0, limit: int=None, event_types: List[str]=None) -> List[BaseEvent]:
+        return self.backend.read_all(position, limit, event_types)
+
+    def head_revision(self, event_stream_id: UUID, aggregate_type: str=None) -> Optional[int]:
+        return self.backend.head_revision(event_stream_id, aggregate_type)
+
+    def stream_ids(self, aggregate_type: str) -> Iterator[UUID]:
+        return self.backend.stream_ids(aggregate_type)
+
+    def read_many_batches(self, event_stream_ids: List[UUID], max_date: datetime=None) -> List[EventBatch]:
+        return self.backend.read_many_batches(event_stream_ids, max_date)
+
+    def read_as_of(self, points: List[Tuple[UUID, datetime]], field: str='time') -> Iterator[Tuple[int, BaseEvent]]:
+        return self.backend.read_as_of(points, field)
+
+    def reduce_streams(self, event_stream_ids: List[UUID], aggregate_type: str, reductions: Dict[str, Reduction],
+                       max_date: datetime=None) -> Dict[UUID, Dict[str, Any]]:
+        return self.backend.reduce_streams(event_stream_ids, aggregate_type, reductions, max_date)
+
+    def close(self) -> None:
+        """Flush what is queued and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._writer is not None:
+            self._writer.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                group = self._next_group()
+                if group is None:
+                    return
+                self._flush(group)
+        finally:
+            connection.close()
+
+    def _next_group(self) -> Optional[List[_PendingAppend]]:
+        """Wait for a group of appends to be due, and take it off the queue. None once closed and drained"""
+        with self._condition:
+            while len(self._pending) == 0:
+                if self._closed:
+                    return None
+                self._condition.wait()
+            deadline = time.monotonic() + self.flush_window
+            while self._pending_events < self.max_batch_events and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            group, deferred = [], []
+            streams: Set[UUID] = set()
+            events = 0
+            for pending in self._pending:
+                # appends to a stream already in the group would conflict with it: they go in the next group, against
+                # the revision this one leaves the stream at
+                if (len(group) > 0 and events + pending.event_count > self.max_batch_events) or \
+                        not streams.isdisjoint(pending.event_stream_ids):
+                    deferred.append(pending)
+                    continue
+                group.append(pending)
+                streams.update(pending.event_stream_ids)
+                events += pending.event_count
+            self._pending = deferred
+            self._pending_events -= events
+            return group
+
+    def _flush(self, group: List[_PendingAppend]) -> None:
+        while len(group) > 0:
+            try:
+                position = self.backend.append([stream_append for pending in group
+                                                for stream_append in pending.appends])
+            except ConcurrencyConflict as e:
+                conflicts = set(e.event_stream_ids)
+                failed = [pending for pending in group if not pending.event_stream_ids.isdisjoint(conflicts)]
+                if len(failed) == 0:
+                    failed = group
+                for pending in failed:
+                    pending.resolve(error=ConcurrencyConflict(sorted(pending.event_stream_ids & conflicts) or
+                                                              e.event_stream_ids))
+                group = [pending for pending in group if pending not in failed]
+                continue
+            except Exception as e:
+                log.exception('Group commit of {} appends failed'.format(len(group)))
+                for pending in group:
+                    pending.resolve(error=e)
+                return
+            self.commits += 1
+            for pending in group:
+                pending.resolve(position)
+            return
@@ -0,0 +1,236 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from datetime import datetime
+from typing import List, Iterator, Optional, Dict, Tuple
+from uuid import UUID
+
+from restaurant.events.base import BaseEvent
+from restaurant.events.codecs import get_codec
+from restaurant.events.timestamps import to_micros, from_micros
+from restaurant.services.backends.base import EventStoreBackend, StreamAppend, ConcurrencyConflict, check_follow_on
+
+log = logging.getLogger(__name__)
+
+# crc32 of the rest of the record, payload length, position, stream id, revision, user id, time in microseconds since
+# the epoch, flags, aggregate type length, event type length. The payload is the aggregate type of the stream, the
+# event type, then the JSON data blob
+HEADER = struct.Struct('<IIQ16siqqBBH')
+BATCH_END = 1
+_OFFSET_BITS = 40
+_OFFSET_MASK = (1 << _OFFSET_BITS) - 1
+
+
+class SegmentLogEventStore(EventStoreBackend):
+    """Events kept in append-only segment files in a directory, without a database.
+
+    Each append is written as one contiguous run of records, the last flagged as ending the batch, so that a torn
+    write is detected and discarded when the store is opened again. Segments roll over once they exceed segment_size.
+    The index, global position to (segment, offset) and stream to its aggregate type and the positions of its
+    revisions, is held in memory and rebuilt by scanning the segments on open. Reads go through mmap: headers are
+    unpacked in place and payloads decoded straight from the mapped pages. The time events were recorded is not kept:
+    reads bounded by it raise ValueError.
+
+    A directory must only be opened by one store at a time, in one process.
+    """
+
+    def __init__(self, directory: str, segment_size: int=64 * 1024 * 1024, fsync: bool=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._locations = array('Q')
+        self._streams: Dict[UUID, array] = {}
+        self._types: Dict[UUID, str] = {}
+        self._sizes: List[int] = []
+        self._maps: List[Optional[mmap.mmap]] = []
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(name for name in os.listdir(directory) if name.endswith('.segment'))
+        for number, name in enumerate(segments):
+            if name != self._segment_name(number):
+                raise ValueError('Unexpected segment {} in {}'.format(name, directory))
+            self._recover(number, is_last=number == len(segments) - 1)
+        if len(self._sizes) == 0:
+            self._sizes.append(0)
+            self._maps.append(None)
+        self._active = open(self._segment_path(len(self._sizes) - 1), 'ab')
+
+    def close(self) -> None:
+        with self._lock:
+            self._active.close()
+            self._maps = [None] * len(self._maps)
+
+    def append(self, appends: List[StreamAppend]) -> int:
+        with self._lock:
+            conflicts = [stream_append.event_stream_id for stream_append in appends
+                         if (self.head_revision(stream_append.event_stream_id) or 0) != stream_append.expected_revision]
+            if len(conflicts) > 0:
+                raise ConcurrencyConflict(conflicts)
+            check_follow_on(appends)
+
+            events: List[Tuple[StreamAppend, BaseEvent]] = [(stream_append, event) for stream_append in appends
+                                                            for event in stream_append.events]
+            position = len(self._locations)
+            if len(events) == 0:
+                return position
+            records = [self._encode(position + index + 1, stream_append.aggregate_type, event,
+                                    BATCH_END if index == len(events) - 1 else 0)
+                       for index, (stream_append, event) in enumerate(events)]
+
+            size = sum(map(len, records))
+            if self._sizes[-1] > 0 and self._sizes[-1] + size > self.segment_size:
+                self._roll()
+            segment = len(self._sizes) - 1
+            offset = self._sizes[segment]
+            self._active.write(b''.join(records))
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+
+            # grow the segment before indexing its new records, so that reads of them remap it
+            self._sizes[segment] = offset + size
+            for (stream_append, _), record in zip(events, records):
+                self._index(stream_append.event_stream_id, stream_append.aggregate_type, segment, offset)
+                offset += len(record)
+            return position + len(events)
+
+    def read_stream(self, event_stream_id: UUID, after_revision: int=0, max_date: datetime=None,
+                    recorded_before: datetime=None) -> List[BaseEvent]:
+        if recorded_before is not None:
+            raise ValueError('The segment log does not keep the time events were recorded')
+        with self._lock:
+            positions = self._streams.get(event_stream_id, array('Q'))[after_revision:]
+        max_time = to_micros(max_date) if max_date is not None else None
+        events = []
+        for position in positions:
+            event = self._read(position, max_time=max_time)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def read_many(self, event_stream_ids: List[UUID], max_date: datetime=None) -> Iterator[BaseEvent]:
+        for event_stream_id in event_stream_ids:
+            yield from self.read_stream(event_stream_id, max_date=max_date)
+
+    def read_all(self, position: int=0, limit: int=None, event_types: List[str]=None) -> List[BaseEvent]:
+        with self._lock:
+            head = len(self._locations)
+        types = {event_type.encode() for event_type in event_types} if event_types is not None else None
+        events = []
+        while position < head and (limit is None or len(events) < limit):
+            position += 1
+            event = self._read(position, types=types)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def head_revision(self, event_stream_id: UUID, aggregate_type: str=None) -> Optional[int]:
+        positions = self._streams.get(event_stream_id)
+        if positions is None or (aggregate_type is not None and self._types[event_stream_id] != aggregate_type):
+            return None
+        return len(positions)
+
+    def stream_ids(self, aggregate_type: str) -> Iterator[UUID]:
+        with self._lock:
+            ids = [event_stream_id for event_stream_id, stream_type in self._types.items()
+                   if stream_type == aggregate_type]
+        return iter(sorted(ids))
+
+    def _encode(self, position: int, aggregate_type: str, event: BaseEvent, flags: int=0) -> bytes:
+        aggregate_type = aggregate_type.encode()
+        event_type = event.__class__.get_event_type().encode()
+        payload = aggregate_type + event_type + json.dumps(get_codec(event.__class__.get_event_type()).encode(event),
+                                                           separators=(',', ':')).encode()
+        header = HEADER.pack(0, len(payload), position, event.event_stream_id.bytes, event.revision, event.user_id,
+                             to_micros(event.timestamp), flags, len(aggregate_type), len(event_type))
+        record = header + payload
+        return struct.pack('<I', zlib.crc32(memoryview(record)[4:])) + record[4:]
+
+    def _read(self, position: int, max_time: int=None, types: set=None) -> Optional[BaseEvent]:
+        location = self._locations[position - 1]
+        segment, offset = location >> _OFFSET_BITS, location & _OFFSET_MASK
+        mapped = self._map(segment)
+        _, length, _, stream_id, revision, user_id, time, _, aggregate_type_length, type_length = \
+            HEADER.unpack_from(mapped, offset)
+        if max_time is not None and time > max_time:
+            return None
+        start = offset + HEADER.size + aggregate_type_length
+        length -= aggregate_type_length
+        with memoryview(mapped) as view:
+            event_type = view[start:start + type_length]
+            if types is not None and event_type.tobytes() not in types:
+                return None
+            codec = get_codec(str(event_type, 'ascii'))
+            data = json.loads(str(view[start + type_length:start + length], 'utf-8'))
+        return codec.decode(data, UUID(bytes=stream_id), user_id, revision, from_micros(time),
+                            position)
+
+    def _map(self, segment: int) -> mmap.mmap:
+        """The mapping of a segment, remapped if the segment grew since it was mapped"""
+        mapped = self._maps[segment]
+        if mapped is None or len(mapped) < self._sizes[segment]:
+            with self._lock:
+                with open(self._segment_path(segment), 'rb') as segment_file:
+                    # previous mappings are closed once the last read using them is done
+                    mapped = self._maps[segment] = mmap.mmap(segment_file.fileno(), self._sizes[segment],
+                                                             access=mmap.ACCESS_READ)
+        return mapped
+
+    def _index(self, event_stream_id: UUID, aggregate_type: str, segment: int, offset: int) -> None:
+        self._locations.append(segment << _OFFSET_BITS | offset)
+        if event_stream_id not in self._streams:
+            self._streams[event_stream_id] = array('Q')
+            self._types[event_stream_id] = aggregate_type
+        self._streams[event_stream_id].append(len(self._locations))
+
+    def _roll(self) -> None:
+        self._active.close()
+        self._sizes.append(0)
+        self._maps.append(None)
+        self._active = open(self._segment_path(len(self._sizes) - 1), 'ab')
+
+    def _recover(self, segment: int, is_last: bool) -> None:
+        """Index the complete batches of a segment. A torn batch at the end of the last segment is truncated away"""
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        self._sizes.append(0)
+        self._maps.append(None)
+        offset = committed = 0
+        batch: List[Tuple[UUID, str, int]] = []
+        if size > 0:
+            with open(path, 'rb') as segment_file, \
+                    mmap.mmap(segment_file.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                while offset + HEADER.size <= size:
+                    crc, length, position, stream_id, _, _, _, flags, aggregate_type_length, _ = \
+                        HEADER.unpack_from(mapped, offset)
+                    end = offset + HEADER.size + length
+                    if end > size or zlib.crc32(mapped[offset + 4:end]) != crc or \
+                            position != len(self._locations) + len(batch) + 1:
+                        break
+                    aggregate_type = str(mapped[offset + HEADER.size:offset + HEADER.size + aggregate_type_length],
+                                         'ascii')
+                    batch.append((UUID(bytes=stream_id), aggregate_type, offset))
+                    offset = end
+                    if flags & BATCH_END:
+                        for event_stream_id, aggregate_type, record_offset in batch:
+                            self._index(event_stream_id, aggregate_type, segment, record_offset)
+                        batch = []
+                        committed = offset
+        if committed < size:
+            if not is_last:
+                raise ValueError('Segment {} is corrupt after offset {}'.format(path, committed))
+            log.warning('Discarding {} bytes of incomplete appends at the end of {}'.format(size - committed, path))
+            with open(path, 'r+b') as segment_file:
+                segment_file.truncate(committed)
+        self._sizes[segment] = committed
+
+    def _segment_name(self, segment: int) -> str:
+        return '{:08d}.segment'.format(segment)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, self._segment_name(segment))
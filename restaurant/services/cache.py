@@ -0,0 +1,83 @@
+import copy
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple, Any
+from uuid import UUID
+
+from django.conf import settings
+
+from restaurant.projections.entities import EventableEntity
+
+
+class EntityCache(object):
+    """Size bounded cache of entities, keyed by stream id, evicting the least recently used entry when full.
+
+    Only the state built up by the entity's event handlers is kept, as its snapshot_state, and every get builds a new
+    entity from it: applying events to an entity handed out by the cache never changes the cached state, and state
+    which is not derived from the events (e.g. the menu items loaded along with a restaurant) is not cached. A cached
+    entity may be behind the store: callers catch it up with the events after its revision.
+    """
+
+    def __init__(self, max_entries: int=1000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # stream id -> (entity class, revision, snapshot state)
+        self._entries: 'OrderedDict[UUID, Tuple[type, int, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, event_stream_id: UUID) -> Optional[EventableEntity]:
+        with self._lock:
+            entry = self._entries.get(event_stream_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(event_stream_id)
+        entity_class, revision, state = entry
+        entity = entity_class(event_stream_id)
+        entity.restore_snapshot_state(copy.deepcopy(state))
+        entity.revision = revision
+        return entity
+
+    def put(self, entity: EventableEntity) -> None:
+        if self.max_entries <= 0:
+            return
+        entry = (entity.__class__, entity.revision, entity.snapshot_state())
+        with self._lock:
+            cached = self._entries.get(entity.id)
+            if cached is not None and cached[1] > entity.revision:
+                # never replace a cached entity by an older one
+                return
+            self._entries[entity.id] = entry
+            self._entries.move_to_end(entity.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, event_stream_id: UUID) -> None:
+        with self._lock:
+            self._entries.pop(event_stream_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+_caches: Dict[str, EntityCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_entity_cache(aggregate_type: str) -> EntityCache:
+    """The process wide cache of entities of an aggregate type, sized by the ENTITY_CACHE_SIZE setting"""
+    with _caches_lock:
+        if aggregate_type not in _caches:
+            _caches[aggregate_type] = EntityCache(getattr(settings, 'ENTITY_CACHE_SIZE', 1000))
+        return _caches[aggregate_type]
@@ -1,48 +1,227 @@
+import copy
+import logging
+import random
+import time as clock
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
-from typing import Optional, List
+from itertools import groupby
+from typing import Optional, List, Iterator, Callable, Tuple, Dict, Any
 from uuid import UUID
 
+from django.conf import settings
+
+from restaurant import instrumentation
 from restaurant.events.base import BaseEvent
 from restaurant.events.menu_item import MenuItemCreated, PriceChanged
 from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded, MenuItemRemoved
 from restaurant.models import User
 from restaurant.projections.entities import Restaurant, MenuItem, EventableEntity
-from restaurant.services.events import EventQueryService, EventPersistenceService
+from restaurant.services.backends.base import EventStoreBackend
+from restaurant.services.backends.database import DatabaseEventStore
+from restaurant.services.cache import EntityCache, get_entity_cache
+from restaurant.services.events import EventQueryService, EventPersistenceService, ConcurrencyConflict
+from restaurant.services.loaders import BatchLoader
+from restaurant.services.snapshots import SnapshotPolicy, SnapshotService
+
+log = logging.getLogger(__name__)
 
 
 class BaseEntityService:
+    """Loads entities from, and saves them to, an event store backend (the database by default), with their snapshots
+    in a snapshot service (the Snapshot table by default: pass a MemorySnapshotService with a backend without a
+    database).
+
+    The process wide entity caches hold entities of the database: with another backend, the service has a cache of its
+    own.
+    """
 
-    def __init__(self):
-        self._event_persistence_service = EventPersistenceService()
-        self._event_query_service = EventQueryService()
+    def __init__(self, snapshot_policy: SnapshotPolicy=None, use_cache: bool=True, backend: EventStoreBackend=None,
+                 snapshot_service: SnapshotService=None):
+        self._backend = backend if backend is not None else DatabaseEventStore()
+        self._event_persistence_service = EventPersistenceService(backend=self._backend)
+        self._event_query_service = EventQueryService(self._backend)
+        self._snapshot_service = snapshot_service if snapshot_service is not None else SnapshotService()
+        self._snapshot_policy = snapshot_policy if snapshot_policy is not None else SnapshotPolicy.from_settings()
+        self.max_retries: int = getattr(settings, 'COMMAND_MAX_RETRIES', 3)
+        self.retry_backoff: float = getattr(settings, 'COMMAND_RETRY_BACKOFF', 0.01)
+        self._cache: Optional[EntityCache] = None
+        if use_cache and isinstance(self._backend, DatabaseEventStore):
+            self._cache = get_entity_cache(self._get_base_entity(None).aggregate_type)
+        elif use_cache:
+            self._cache = EntityCache(getattr(settings, 'ENTITY_CACHE_SIZE', 1000))
 
     __metaclass__ = ABCMeta
 
-    def _load_entity_up_to(self, event_stream_id: UUID, time=datetime.utcnow()):
-        events = self._event_query_service.find_events_by_id(event_stream_id, time)
-        if len(events) == 0:
+    def _load_current(self, event_stream_id: UUID) -> Optional[EventableEntity]:
+        if not instrumentation.active:
+            return self._load_current_uninstrumented(event_stream_id)
+        started = clock.perf_counter()
+        entity = self._load_current_uninstrumented(event_stream_id)
+        instrumentation.observe('load_seconds', clock.perf_counter() - started)
+        return entity
+
+    def _load_current_uninstrumented(self, event_stream_id: UUID) -> Optional[EventableEntity]:
+        if self._cache is None:
+            return self._load_entity_up_to(event_stream_id)
+        entity = self._cache.get(event_stream_id)
+        if instrumentation.active:
+            instrumentation.increment('cache_misses_total' if entity is None else 'cache_hits_total')
+        if entity is None:
+            entity = self._load_entity_up_to(event_stream_id)
+            if entity is None:
+                return None
+        elif self._catch_up(entity) == 0:
+            return entity
+        self._cache.put(entity)
+        return entity
+
+    def list_ids(self) -> Iterator[UUID]:
+        """The ids of every entity of this service's aggregate type, from the stream catalog"""
+        return self._event_query_service.find_stream_ids(self._get_base_entity(None).aggregate_type)
+
+    def get_reduced_fields(self, ids: List[UUID], fields: List[str]=None,
+                           time: datetime=None) -> Dict[UUID, Dict[str, Any]]:
+        """The fields declared as reductions by the entity (all of them by default) of many entities, by time, computed
+        by the database without loading their events (other backends replay them). Entities which do not exist are left
+        out"""
+        entity = self._get_base_entity(None)
+        reductions = entity.reductions
+        if fields is not None:
+            unknown = [field for field in fields if field not in reductions]
+            if len(unknown) > 0:
+                raise ValueError('{} fields {} are not reductions'.format(type(entity).__name__, unknown))
+            reductions = {field: reductions[field] for field in fields}
+        reduced = self._event_query_service.reduce_streams(ids, entity.aggregate_type, reductions, time)
+        for values in reduced.values():
+            for field, value in values.items():
+                # no events to reduce: the value the entity starts with
+                if value is None:
+                    values[field] = getattr(entity, field)
+        return reduced
+
+    def get_revision(self, id: UUID) -> Optional[int]:
+        """The current revision of an entity of this service's aggregate type, None if there is no such entity, from the
+        stream catalog without loading any events"""
+        return self._event_query_service.get_head_revision(id, self._get_base_entity(None).aggregate_type)
+
+    def take_snapshot(self, event_stream_id: UUID) -> Optional[EventableEntity]:
+        """Bring the snapshot of an entity up to its current revision, regardless of the snapshot policy"""
+        return self._load_entity_up_to(event_stream_id, snapshot_policy=SnapshotPolicy(every_n_revisions=1))
+
+    def _load_entity_up_to(self, event_stream_id: UUID, time: datetime=None, snapshot_policy: SnapshotPolicy=None,
+                           recorded_at: datetime=None):
+        """Load an entity as of the time events occurred and / or were recorded, None meaning now"""
+        # start from the latest snapshot, if any, and only replay the events that follow it
+        entity = self._get_base_entity(event_stream_id)
+        snapshot_revision = self._snapshot_service.restore_latest(entity, time, recorded_at)
+        events = self._event_query_service.find_events_by_id(event_stream_id, time, snapshot_revision, recorded_at)
+        if snapshot_revision == 0 and len(events) == 0:
             return None
-        return self._build_entity_for_events(event_stream_id, events)
+        entity.replay(events)
+        if instrumentation.active:
+            instrumentation.observe('events_per_load', len(events))
+
+        policy = snapshot_policy if snapshot_policy is not None else self._snapshot_policy
+        if len(events) > 0 and policy.should_snapshot(snapshot_revision, entity.revision, len(events)):
+            self._snapshot_service.save(entity, events[-1].timestamp)
+        return entity
 
-    def _load_multiple_up_to(self, ids: List[UUID], time=datetime.utcnow()) -> List:
+    def _load_multiple_up_to(self, ids: List[UUID], time: datetime=None) -> List:
+        """The entities with events by time, in the order of ids"""
+        batches = {batch.event_stream_id: batch
+                   for batch in self._event_query_service.find_event_batches_for_id_in(ids, time)}
         entities = []
-        event_group = {}
-        for event in self._event_query_service.find_events_for_id_in(ids, time):
-            if event.event_stream_id not in event_group.keys():
-                event_group[event.event_stream_id] = []
-            event_group[event.event_stream_id].append(event)
-
-        for event_stream_id in event_group.keys():
-            entities.append(self._build_entity_for_events(event_stream_id, event_group[event_stream_id]))
+        for event_stream_id in ids:
+            if event_stream_id in batches:
+                entity = self._get_base_entity(event_stream_id)
+                entity.replay(batches.pop(event_stream_id))
+                entities.append(entity)
+        return entities
+
+    def _stream_multiple_up_to(self, ids: List[UUID], time: datetime=None) -> Iterator:
+        """Fold each stream into its entity as its events arrive, so only one stream is held in memory at a time"""
+        events = self._event_query_service.stream_events_for_id_in(ids, time)
+        for event_stream_id, stream_events in groupby(events, key=lambda event: event.event_stream_id):
+            entity = self._get_base_entity(event_stream_id)
+            entity.replay(stream_events)
+            yield entity
+
+    def _load_multiple_as_of(self, points: List[Tuple[UUID, datetime]], field: str) -> List:
+        entities = [None] * len(points)
+        for index, indexed_events in groupby(self._event_query_service.find_events_as_of(points, field),
+                                             key=lambda indexed_event: indexed_event[0]):
+            entities[index] = self._get_base_entity(points[index][0])
+            entities[index].replay(event for _, event in indexed_events)
         return entities
 
     def _build_entity_for_events(self, event_stream_id: UUID, events: List[BaseEvent]) -> EventableEntity:
         entity = self._get_base_entity(event_stream_id)
-        for event in events:
-            entity.apply(event)
+        entity.replay(events)
         return entity
 
+    def save_many(self, entities: List[EventableEntity]) -> None:
+        """Persist the uncommitted events of many entities, and the snapshots due, in a single transaction with the
+        database backend"""
+        with self._backend.atomic():
+            due = [entity for entity in entities if len(entity.uncommitted_events) > 0 and
+                   self._snapshot_policy.should_snapshot(entity.revision - len(entity.uncommitted_events),
+                                                         entity.revision)]
+            last_events = [entity.uncommitted_events[-1] for entity in due]
+            self._event_persistence_service.save_many(entities)
+            for entity, last_event in zip(due, last_events):
+                self._snapshot_service.save(entity, last_event.timestamp)
+            if self._cache is not None:
+                self._backend.on_commit(lambda: self._cache_saved(entities))
+
+    def _cache_saved(self, entities: List[EventableEntity]) -> None:
+        for entity in entities:
+            # entities changed again since they were saved are left out, the cache only holds committed state
+            if len(entity.uncommitted_events) == 0:
+                self._cache.put(entity)
+
+    def _save(self, entity: EventableEntity) -> None:
+        self.save_many([entity])
+
+    def _execute(self, entity: EventableEntity, command: Callable[[EventableEntity], None]) -> None:
+        """Run a command, which validates and applies events to the entity, then save the entity.
+
+        If another writer appended to the stream since the entity was loaded, the entity is brought back to the state
+        it was loaded in, caught up with the new events only, and the command is run (and so validated) again, up to
+        max_retries times with jittered exponential backoff. A command which fails leaves the entity as it was loaded.
+
+        Only the state built up by the event handlers is brought back: state which is not derived from the events, such
+        as the menu items loaded along with a restaurant, is left as the command changed it, for the command to bring
+        in line with the caught up state when run again.
+        """
+        loaded = (entity.revision, entity.snapshot_state(), list(entity.uncommitted_events))
+        attempt = 0
+        while True:
+            try:
+                command(entity)
+                self._save(entity)
+                return
+            except ConcurrencyConflict:
+                self._restore(entity, loaded)
+                if attempt >= self.max_retries:
+                    raise
+                log.debug('Concurrent modification of entity {}, retrying'.format(entity.id))
+                clock.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+                attempt += 1
+                self._catch_up(entity)
+            except Exception:
+                self._restore(entity, loaded)
+                raise
+
+    def _restore(self, entity: EventableEntity, loaded: Tuple[int, Dict[str, Any], List[BaseEvent]]) -> None:
+        revision, state, uncommitted_events = loaded
+        entity.restore_snapshot_state(copy.deepcopy(state))
+        entity.revision = revision
+        entity.uncommitted_events = list(uncommitted_events)
+
+    def _catch_up(self, entity: EventableEntity) -> int:
+        """Apply the events appended to the entity's stream after its current revision. Returns how many there were"""
+        return entity.replay(self._event_query_service.find_events_by_id(entity.id, after_revision=entity.revision))
+
     @abstractmethod
     def _get_base_entity(self, event_stream_id: UUID) -> EventableEntity:
         pass
@@ -51,73 +230,121 @@ class BaseEntityService:
 class RestaurantService(BaseEntityService):
 
     def get_current(self, id: UUID) -> Optional[Restaurant]:
-       return self._load_entity_up_to(id)
+       return self._load_current(id)
 
     def get_multiple_current(self, ids: List[UUID]) -> List[Restaurant]:
         return self._load_multiple_up_to(ids)
+
+    def stream_multiple_current(self, ids: List[UUID]) -> Iterator[Restaurant]:
+        return self._stream_multiple_up_to(ids)
+
+    def get_as_of(self, id: UUID, time: datetime=None, recorded_at: datetime=None) -> Optional[Restaurant]:
+        """The restaurant as of the time events occurred and / or were recorded"""
+        return self._load_entity_up_to(id, time, recorded_at=recorded_at)
+
+    def get_multiple_as_of(self, points: List[Tuple[UUID, datetime]], field: str='time') -> List[Optional[Restaurant]]:
+        """Load many restaurants, each as of its own point in time (along field, 'time' or 'created_at'), in one query"""
+        return self._load_multiple_as_of(points, field)
     # todo: replace both of the above with a RestuarauntQuery object and the following with a Restaurant Command
 
     def load_associated(self, restaraunt: Restaurant) -> None:
-        restaraunt.menu_items = MenuItemService().get_multiple_current(restaraunt.menu_item_ids)
+        self.load_associated_many([restaraunt])
+
+    def load_associated_many(self, restaurants: List[Restaurant], loader: BatchLoader=None) -> None:
+        """Attach the menu items of many restaurants, loaded in a single query whatever the number of restaurants.
+
+        Menu items on several menus are loaded once and shared. Pass a loader to also share them with other loads
+        """
+        if loader is None:
+            loader = BatchLoader(MenuItemService(backend=self._backend,
+                                                 snapshot_service=self._snapshot_service).stream_multiple_current)
+        for restaurant in restaurants:
+            loader.want(restaurant.menu_item_ids)
+        loader.dispatch()
+        for restaurant in restaurants:
+            restaurant.menu_items = [loader.get(menu_item_id) for menu_item_id in restaurant.menu_item_ids
+                                     if loader.get(menu_item_id) is not None]
 
-    def open_restaurant(self, user: User, name:str, location:str, year=datetime.utcnow().year) -> Restaurant:
+    def open_restaurant(self, user: User, name:str, location:str, year: int=None) -> Restaurant:
         restaurant = Restaurant()
+        year = year if year is not None else datetime.utcnow().year
         restaurant.apply(RestaurantOpened(name, year, location, user.id, 1))
-        self._event_persistence_service.save(restaurant)
+        self._save(restaurant)
         return restaurant
 
     def hire_employees(self, user: User, restaurant: Restaurant, employees: List[str]) -> None:
-        """Hire emplyees for a restaurant. Restaurant must be at current state"""
-        for employee in employees:
-            restaurant.apply(EmployeeHired(employee, user.id, restaurant.revision+1))
-        self._event_persistence_service.save(restaurant)
+        """Hire emplyees for a restaurant. Retried against the latest state if the restaurant changed concurrently"""
+        def hire(restaurant: Restaurant) -> None:
+            for employee in employees:
+                restaurant.apply(EmployeeHired(employee, user.id, restaurant.revision+1))
+        self._execute(restaurant, hire)
 
     def fire_employee(self, user: User, restaurant: Restaurant, employee: str) -> None:
-        if employee in restaurant.employees:
-            restaurant.apply(EmployeeFired(employee, user.id, restaurant.revision+1))
-            self._event_persistence_service.save(restaurant)
-        else:
-            raise ValueError("Employee {} doesn't work at {}".format(employee, restaurant.name))
+        def fire(restaurant: Restaurant) -> None:
+            if employee in restaurant.employees:
+                restaurant.apply(EmployeeFired(employee, user.id, restaurant.revision+1))
+            else:
+                raise ValueError("Employee {} doesn't work at {}".format(employee, restaurant.name))
+        self._execute(restaurant, fire)
 
     def add_items_to_menu(self, user: User, restaurant: Restaurant, items: List[MenuItem]) -> None:
-        for item in items:
-            restaurant.apply(MenuItemAdded(item.id, user.id, restaurant.revision + 1))
-            restaurant.menu_items.append(item)
-        self._event_persistence_service.save(restaurant)
+        def add(restaurant: Restaurant) -> None:
+            for item in items:
+                restaurant.apply(MenuItemAdded(item.id, user.id, restaurant.revision + 1))
+            self._match_menu_items(restaurant, items)
+        self._execute(restaurant, add)
 
     def remove_items_from_menu(self, user: User, restaurant: Restaurant, items: List[MenuItem]) -> None:
-        for item in items:
-            restaurant.apply(MenuItemRemoved(item.id, user.id, restaurant.revision + 1))
-            restaurant.menu_items.remove(item)
-        self._event_persistence_service.save(restaurant)
+        def remove(restaurant: Restaurant) -> None:
+            for item in items:
+                restaurant.apply(MenuItemRemoved(item.id, user.id, restaurant.revision + 1))
+            self._match_menu_items(restaurant, items)
+        self._execute(restaurant, remove)
+
+    def _match_menu_items(self, restaurant: Restaurant, items: List[MenuItem]) -> None:
+        """Bring the loaded menu items in line with the menu, which a retried command caught up with the changes of
+        other writers: items are matched by id, so running it again after a conflict changes nothing"""
+        known = {item.id: item for item in restaurant.menu_items + items}
+        restaurant.menu_items = [known[menu_item_id] for menu_item_id in restaurant.menu_item_ids
+                                 if menu_item_id in known]
 
     def _get_base_entity(self, event_stream_id: UUID) -> EventableEntity:
         return Restaurant(event_stream_id)
 
     def _restaurant_exists(self, restaurant_id: UUID) -> bool:
-        return self._event_query_service.count_events_by_id(restaurant_id) > 0
+        return self._event_query_service.stream_exists(restaurant_id, Restaurant.aggregate_type)
 
 
 class MenuItemService(BaseEntityService):
 
     def get_current(self, id: UUID) -> Optional[MenuItem]:
-        return self._load_entity_up_to(id)
+        return self._load_current(id)
 
     def get_multiple_current(self, ids: List[UUID]) -> List[MenuItem]:
         return self._load_multiple_up_to(ids)
 
+    def stream_multiple_current(self, ids: List[UUID]) -> Iterator[MenuItem]:
+        return self._stream_multiple_up_to(ids)
+
+    def get_as_of(self, id: UUID, time: datetime=None, recorded_at: datetime=None) -> Optional[MenuItem]:
+        """The menu item as of the time events occurred and / or were recorded"""
+        return self._load_entity_up_to(id, time, recorded_at=recorded_at)
+
+    def get_multiple_as_of(self, points: List[Tuple[UUID, datetime]], field: str='time') -> List[Optional[MenuItem]]:
+        """Load many menu items, each as of its own point in time (along field, 'time' or 'created_at'), in one query"""
+        return self._load_multiple_as_of(points, field)
+
     def create_menu_item(self, user: User, name: str, category: str, price_in_cents: int) -> MenuItem:
         menu_item = MenuItem()
         menu_item.apply(MenuItemCreated(name, category, user.id, 1))
         # menu_item.apply(PriceChanged(price_in_cents - menu_item.price_in_cents, user.id, 1))
         self._set_price_pure(user, menu_item, price_in_cents)
-        self._event_persistence_service.save(menu_item)
+        self._save(menu_item)
         return menu_item
 
     def set_price(self, user: User, menu_item: MenuItem, new_price_in_cents: int) -> None:
         # menu_item.apply(PriceChanged(new_price_in_cents - menu_item.price_in_cents, user.id, menu_item.revision + 1))
-        self._set_price_pure(user, menu_item, new_price_in_cents)
-        self._event_persistence_service.save(menu_item)
+        self._execute(menu_item, lambda menu_item: self._set_price_pure(user, menu_item, new_price_in_cents))
 
     def _set_price_pure(self, user: User, menu_item: MenuItem, new_price_in_cents: int) -> None:
         menu_item.apply(PriceChanged(new_price_in_cents - menu_item.price_in_cents, user.id, menu_item.revision + 1))
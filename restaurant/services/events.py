@@ -1,41 +1,135 @@
 import logging
+import time as clock
 from datetime import datetime
-from typing import List
+from typing import List, Iterator, Tuple, Optional, Dict, Any
 from uuid import UUID
 
+from restaurant import instrumentation
 from restaurant.events.base import BaseEvent
-from restaurant.models import Event
+from restaurant.events.batch import EventBatch
 from restaurant.projections.entities import EventableEntity
-from restaurant.services.translation import DjangoEventTranslatorService
+from restaurant.projections.reductions import Reduction
+# ConcurrencyConflict is raised by the backends, and re-exported for callers of the services
+from restaurant.services.backends.base import EventStoreBackend, StreamAppend, ConcurrencyConflict
+from restaurant.services.backends.database import DatabaseEventStore
 
 log = logging.getLogger(__name__)
 
-
 class EventPersistenceService(object):
 
-    def __init__(self):
-        self.translation_service = DjangoEventTranslatorService()
+    def __init__(self, batch_size: int=1000, backend: EventStoreBackend=None):
+        self.backend = backend if backend is not None else DatabaseEventStore(batch_size)
+
+    def save(self, entity: EventableEntity, expected_revision: int=None) -> None:
+        """Append the uncommitted events of the entity, provided the stream is still at expected_revision if given (e.g.
+        the revision of an ETag the caller was shown), or else at the revision the entity was loaded at.
+
+        Raises ConcurrencyConflict if the stream was appended to since.
+        """
+        pending = [entity] if len(entity.uncommitted_events) > 0 else []
+        self._append(pending, {entity.id: expected_revision} if expected_revision is not None else {})
+
+    def save_many(self, entities: List[EventableEntity]) -> None:
+        """Persist the uncommitted events of all entities atomically, in a single transaction with the database backend.
+
+        Each entity is expected to be at the revision it was loaded at plus its uncommitted events: if any stream was
+        appended to in the meantime, nothing is saved and ConcurrencyConflict is raised. The entities' uncommitted
+        events are only cleared once the transaction commits, so that they can be retried if an enclosing transaction
+        rolls back.
+        """
+        self._append([entity for entity in entities if len(entity.uncommitted_events) > 0], {})
 
-    def save(self, entity: EventableEntity) -> None:
-        log.debug('Persisting {} events for entity {}'.format(len(entity.uncommitted_events), entity.id))
-        Event.objects.bulk_create(self.translation_service.translate_to_django_models(entity.uncommitted_events),
-                                  batch_size=100)
-        entity.uncommitted_events = []
+    def _append(self, pending: List[EventableEntity], expected_revisions: Dict[UUID, int]) -> None:
+        log.debug('Persisting {} events for {} entities'.format(
+            sum(len(entity.uncommitted_events) for entity in pending), len(pending)))
+        if len(pending) == 0:
+            return
+        started = clock.perf_counter() if instrumentation.active else None
+        self.backend.append([StreamAppend(entity.id, entity.aggregate_type,
+                                          expected_revisions.get(entity.id, self._loaded_revision(entity)),
+                                          entity.uncommitted_events) for entity in pending])
+        if started is not None:
+            instrumentation.observe('save_seconds', clock.perf_counter() - started)
+            instrumentation.increment('events_saved_total', sum(len(entity.uncommitted_events) for entity in pending))
+        self.backend.on_commit(lambda: self._clear_uncommitted(pending))
+
+    def _loaded_revision(self, entity: EventableEntity) -> int:
+        return entity.revision - len(entity.uncommitted_events)
+
+    def _clear_uncommitted(self, entities: List[EventableEntity]) -> None:
+        for entity in entities:
+            entity.uncommitted_events = []
 
 
 class EventQueryService(object):
+    """Reads streams, optionally as of a point in time.
+
+    Time travel works along two axes: max_date bounds the time the events occurred (Event.time), recorded_before
+    bounds the time they were written to the store (Event.created_at), e.g. to reproduce what a report showed on a
+    given day even if events were back dated since. None means no bound, i.e. the current state. Backends which do not
+    keep the time events were recorded raise ValueError on reads bounded by it.
+
+    Every read goes through the backend, as do lookups in its catalog of streams.
+    """
+
+    AS_OF_FIELDS = ('time', 'created_at')
 
-    def __init__(self):
-        self.translation_service = DjangoEventTranslatorService()
+    def __init__(self, backend: EventStoreBackend=None):
+        self.backend = backend if backend is not None else DatabaseEventStore()
 
-    def find_events_by_id(self, event_stream_id: UUID, max_date=datetime.utcnow()) -> List[BaseEvent]:
-        return list(map(self.translation_service.translate_event_to_domain_event,
-                   Event.objects.filter(event_stream_id=event_stream_id, time__lte=max_date).order_by('revision').all()))
+    def find_events_by_id(self, event_stream_id: UUID, max_date: datetime=None, after_revision: int=0,
+                          recorded_before: datetime=None) -> List[BaseEvent]:
+        return self.backend.read_stream(event_stream_id, after_revision, max_date, recorded_before)
 
     def count_events_by_id(self, event_stream_id: UUID) -> int:
-        return Event.objects.filter(event_stream_id=event_stream_id).count()
+        # revisions run from 1 without gaps
+        return self.backend.head_revision(event_stream_id) or 0
+
+    def get_head_revision(self, event_stream_id: UUID, aggregate_type: str=None) -> Optional[int]:
+        """The revision of the last event of a stream, None if it has none (or is not of aggregate_type, if given), from
+        the stream catalog"""
+        return self.backend.head_revision(event_stream_id, aggregate_type)
+
+    def stream_exists(self, event_stream_id: UUID, aggregate_type: str=None) -> bool:
+        return self.backend.stream_exists(event_stream_id, aggregate_type)
+
+    def find_stream_ids(self, aggregate_type: str) -> Iterator[UUID]:
+        return self.backend.stream_ids(aggregate_type)
+
+    def find_events_for_id_in(self, event_stream_ids: List[UUID], max_date: datetime=None) -> List[BaseEvent]:
+        events = list(self.backend.read_many(event_stream_ids, max_date))
+        # one UUID object per stream rather than per event
+        shared_ids = {}
+        for event in events:
+            event.event_stream_id = shared_ids.setdefault(event.event_stream_id, event.event_stream_id)
+        return events
+
+    def find_event_batches_for_id_in(self, event_stream_ids: List[UUID], max_date: datetime=None) -> List[EventBatch]:
+        """Like find_events_for_id_in, but holds the events of each stream as a compact EventBatch, for bulk loads"""
+        return self.backend.read_many_batches(event_stream_ids, max_date)
+
+    def stream_events_for_id_in(self, event_stream_ids: List[UUID], max_date: datetime=None) -> Iterator[BaseEvent]:
+        """Like find_events_for_id_in, but yields the events grouped by stream as the backend reads them, so callers
+        need not hold them all at once"""
+        return self.backend.read_many(event_stream_ids, max_date)
+
+    def find_events_as_of(self, points: List[Tuple[UUID, datetime]], field: str='time') -> Iterator[Tuple[int, BaseEvent]]:
+        """Events of many streams, each as of its own point in time, in a single query with the database backend.
+
+        points are (event_stream_id, as of) pairs; the same stream may appear several times. Yields (index of the
+        point, event), ordered by point then revision. field is the time axis: 'time' or 'created_at'
+        """
+        if field not in self.AS_OF_FIELDS:
+            raise ValueError('Cannot load as of {}, expected one of {}'.format(field, self.AS_OF_FIELDS))
+        return self.backend.read_as_of(points, field)
+
+    def reduce_streams(self, event_stream_ids: List[UUID], aggregate_type: str, reductions: Dict[str, Reduction],
+                       max_date: datetime=None) -> Dict[UUID, Dict[str, Any]]:
+        """Compute the reductions over the events of many streams of an aggregate type, in a single GROUP BY query with
+        the database backend.
 
-    def find_events_for_id_in(self, event_stream_ids: List[UUID], max_date=datetime.utcnow()) -> List[BaseEvent]:
-        return list(map(self.translation_service.translate_event_to_domain_event,
-                        Event.objects.filter(event_stream_id__in=event_stream_ids, time__lte=max_date)
-                        .order_by('revision').all()))
+        Returns the reduced values of every stream which exists (by max_date), None where it has no events to reduce
+        """
+        if len(event_stream_ids) == 0 or len(reductions) == 0:
+            return {}
+        return self.backend.reduce_streams(event_stream_ids, aggregate_type, reductions, max_date)
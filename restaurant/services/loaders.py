@@ -0,0 +1,45 @@
+from typing import Callable, Dict, Iterable, List, Optional
+from uuid import UUID
+
+from restaurant.projections.entities import EventableEntity
+
+
+class BatchLoader(object):
+    """Loads entities by id in batches, DataLoader style: ids wanted by many callers are collected first, then every id
+    not loaded yet is fetched with a single call of batch_load. Each entity is loaded once and shared by all callers.
+
+    batch_load takes a list of distinct ids and returns (or yields) the entities which exist, in any order.
+    """
+
+    def __init__(self, batch_load: Callable[[List[UUID]], Iterable[EventableEntity]]):
+        self._batch_load = batch_load
+        self._loaded: Dict[UUID, Optional[EventableEntity]] = {}
+        # insertion ordered set of the ids to fetch on the next dispatch
+        self._wanted: Dict[UUID, None] = {}
+
+    def want(self, ids: Iterable[UUID]) -> None:
+        for id in ids:
+            if id not in self._loaded:
+                self._wanted[id] = None
+
+    def dispatch(self) -> int:
+        """Fetch every wanted id at once. Returns how many ids were fetched"""
+        ids = list(self._wanted)
+        self._wanted = {}
+        if len(ids) == 0:
+            return 0
+        for id in ids:
+            self._loaded[id] = None
+        for entity in self._batch_load(ids):
+            self._loaded[entity.id] = entity
+        return len(ids)
+
+    def get(self, id: UUID) -> Optional[EventableEntity]:
+        """A loaded entity, None if it does not exist. Raises KeyError if it was never wanted and dispatched"""
+        return self._loaded[id]
+
+    def load_many(self, ids: List[UUID]) -> List[EventableEntity]:
+        """The entities which exist among ids, in the order of ids"""
+        self.want(ids)
+        self.dispatch()
+        return [self._loaded[id] for id in ids if self._loaded[id] is not None]
@@ -0,0 +1,190 @@
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Executor
+from datetime import timedelta
+from itertools import groupby
+from typing import Callable, Dict, List, Optional
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from restaurant.events.base import BaseEvent
+from restaurant.models import Event, OutboxEntry
+from restaurant.services.translation import DjangoEventTranslatorService
+
+log = logging.getLogger(__name__)
+
+
+class SideEffectHandler(object):
+    """A function run with every event of the given types once it was first saved, at most concurrency at a time"""
+
+    def __init__(self, name: str, event_types: List[str], func: Callable[[BaseEvent], None], concurrency: int=1):
+        if concurrency < 1:
+            raise ValueError('Side effect {} needs a concurrency of at least 1'.format(name))
+        self.name = name
+        self.event_types = event_types
+        self.func = func
+        self.concurrency = concurrency
+
+
+_side_effect_handlers: Dict[str, SideEffectHandler] = {}
+_handlers_by_event_type: Dict[str, List[SideEffectHandler]] = {}
+
+
+def side_effect(*event_classes: type, name: str=None, concurrency: int=1) -> Callable:
+    """Registers a function as the side effect of the given event classes, run by an OutboxWorker once the events are
+    first saved. It runs at least once per event, so has to be idempotent. Named after the function by default: the
+    name is stored with the outbox entries, so must stay the same while entries are pending"""
+    def register(func: Callable[[BaseEvent], None]) -> Callable[[BaseEvent], None]:
+        handler = SideEffectHandler(name if name is not None else '{}.{}'.format(func.__module__, func.__qualname__),
+                                    [event_class.get_event_type() for event_class in event_classes], func, concurrency)
+        if handler.name in _side_effect_handlers and _side_effect_handlers[handler.name].func is not func:
+            raise ValueError('Side effect {} is already registered'.format(handler.name))
+        _side_effect_handlers[handler.name] = handler
+        _index_handlers()
+        return func
+    return register
+
+
+def remove_side_effect(name: str) -> None:
+    _side_effect_handlers.pop(name, None)
+    _index_handlers()
+
+
+def get_side_effect_handlers() -> Dict[str, SideEffectHandler]:
+    return dict(_side_effect_handlers)
+
+
+def _index_handlers() -> None:
+    _handlers_by_event_type.clear()
+    for handler in _side_effect_handlers.values():
+        for event_type in handler.event_types:
+            _handlers_by_event_type.setdefault(event_type, []).append(handler)
+
+
+def enqueue_side_effects(events: List[BaseEvent], rows: List[Event]) -> int:
+    """Write the outbox entries of the events seen for the first time, in the current transaction. rows are the saved
+    Event models of the events, in the same order. Returns the number of entries written"""
+    if len(_handlers_by_event_type) == 0:
+        return 0
+    now = timezone.now()
+    entries = [OutboxEntry(event_id=row.id, handler=handler.name, available_at=now)
+               for event, row in zip(events, rows) if event.first_observation
+               for handler in _handlers_by_event_type.get(row.type, ())]
+    OutboxEntry.objects.bulk_create(entries)
+    return len(entries)
+
+
+class ClaimedEntry(object):
+
+    def __init__(self, id: int, handler: SideEffectHandler, attempts: int, event: BaseEvent):
+        self.id = id
+        self.handler = handler
+        self.attempts = attempts
+        self.event = event
+        self.error: Optional[str] = None
+
+
+class OutboxWorker(object):
+    """Runs the side effects written to the outbox, at least once each, on a pool of threads.
+
+    Entries are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED, so that workers (threads or processes) never
+    claim the same entries, and leased for lease seconds: the claim commits straight away, so no lock is held while the
+    handlers run, and the entries of a worker which died are claimed again once their lease is up.
+
+    Within a worker, the entries of a handler run at most handler.concurrency at a time. A failed entry is retried
+    after retry_delay * 2 ^ (attempts - 1) seconds, and given up on (gave_up_at) after max_attempts.
+    Only the entries of the handlers registered in this process, or of those named, are claimed.
+    """
+
+    def __init__(self, workers: int=4, batch_size: int=100, lease: float=60.0, max_attempts: int=5,
+                 retry_delay: float=1.0, handlers: List[str]=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.handlers = handlers
+        self.translation_service = DjangoEventTranslatorService()
+
+    def run(self, follow: bool=False, idle_timeout: float=None, poll_interval: float=1.0) -> int:
+        """Run batches until the outbox has nothing left to claim or, when following, until idle_timeout seconds
+        pass without any. Returns the number of entries run"""
+        processed = 0
+        idle_since = time.monotonic()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='side-effects') as executor:
+            while True:
+                count = self.run_batch(executor)
+                processed += count
+                if count > 0:
+                    idle_since = time.monotonic()
+                    continue
+                if not follow or (idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout):
+                    return processed
+                time.sleep(poll_interval)
+
+    def run_batch(self, executor: Executor) -> int:
+        """Claim a batch of entries, run them and record the outcome. Returns the number of entries claimed"""
+        claimed = self.claim()
+        chunks = []
+        for _, entries in groupby(sorted(claimed, key=lambda entry: entry.handler.name),
+                                  key=lambda entry: entry.handler.name):
+            entries = list(entries)
+            # each chunk runs its entries one after the other, so a handler never runs more than concurrency at a time
+            concurrency = entries[0].handler.concurrency
+            chunks.extend(entries[index::concurrency] for index in range(min(concurrency, len(entries))))
+        for future in [executor.submit(self._run_entries, chunk) for chunk in chunks]:
+            future.result()
+        self._record(claimed)
+        return len(claimed)
+
+    def claim(self) -> List[ClaimedEntry]:
+        handlers = get_side_effect_handlers()
+        names = [name for name in handlers if self.handlers is None or name in self.handlers]
+        if len(names) == 0:
+            return []
+        query = (
+            'UPDATE {table} SET available_at = now() + %s * interval \'1 second\', attempts = attempts + 1 '
+            'WHERE id IN ('
+            'SELECT id FROM {table} WHERE completed_at IS NULL AND gave_up_at IS NULL AND available_at <= now() '
+            'AND handler = ANY(%s) ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED'
+            ') RETURNING id, event_id, handler, attempts'
+        ).format(table=connection.ops.quote_name(OutboxEntry._meta.db_table))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(query, [self.lease, names, self.batch_size])
+                rows = cursor.fetchall()
+        events = Event.objects.in_bulk([event_id for _, event_id, _, _ in rows])
+        # an event deleted since takes its entries with it
+        return [ClaimedEntry(id, handlers[handler], attempts,
+                             self.translation_service.translate_event_to_domain_event(events[event_id]))
+                for id, event_id, handler, attempts in sorted(rows) if event_id in events]
+
+    def _run_entries(self, entries: List[ClaimedEntry]) -> None:
+        try:
+            for entry in entries:
+                try:
+                    entry.handler.func(entry.event)
+                except Exception:
+                    log.warning('Side effect {} failed for event {} (attempt {})'.format(
+                        entry.handler.name, entry.event.position, entry.attempts), exc_info=True)
+                    entry.error = traceback.format_exc()
+        finally:
+            # handlers may have used the database from this pool thread
+            connection.close()
+
+    def _record(self, entries: List[ClaimedEntry]) -> None:
+        now = timezone.now()
+        completed = [entry.id for entry in entries if entry.error is None]
+        with transaction.atomic():
+            if len(completed) > 0:
+                OutboxEntry.objects.filter(id__in=completed).update(completed_at=now, last_error='')
+            for entry in entries:
+                if entry.error is None:
+                    continue
+                if entry.attempts >= self.max_attempts:
+                    OutboxEntry.objects.filter(id=entry.id).update(gave_up_at=now, last_error=entry.error)
+                else:
+                    retry_at = now + timedelta(seconds=self.retry_delay * 2 ** (entry.attempts - 1))
+                    OutboxEntry.objects.filter(id=entry.id).update(available_at=retry_at, last_error=entry.error)
@@ -0,0 +1,65 @@
+import logging
+
+from django.db import transaction
+
+from restaurant.models import ProjectionCheckpoint
+from restaurant.projections.projectors import Projector
+from restaurant.services.subscriptions import EventSubscription
+
+log = logging.getLogger(__name__)
+
+
+class ProjectionService(object):
+    """Catches projectors up with the event store.
+
+    Each projector has a checkpoint holding the global position (Event.id) up to which it has processed the store. The
+    events of the projector's types after that position are read in batches, in global order, and every batch is
+    committed together with the new checkpoint, so an interrupted run resumes where it stopped and never applies an
+    event twice.
+
+    With lazy, event data is only decoded for the fields the projectors read (see EventSubscription).
+    """
+
+    def __init__(self, batch_size: int=1000, lazy: bool=False):
+        self.batch_size = batch_size
+        self.lazy = lazy
+
+    def run(self, projector: Projector) -> int:
+        """Process every event after the projector's checkpoint. Returns the number of events processed"""
+        return self._process(projector, follow=False)
+
+    def follow(self, projector: Projector, idle_timeout: float=None) -> int:
+        """Catch up, then keep processing events as they are appended until idle_timeout seconds pass without any"""
+        return self._process(projector, follow=True, idle_timeout=idle_timeout)
+
+    def rebuild(self, projector: Projector) -> int:
+        """Drop the read model and replay the whole event store into it"""
+        with transaction.atomic():
+            projector.reset()
+            ProjectionCheckpoint.objects.update_or_create(name=projector.name, defaults={'position': 0})
+        return self.run(projector)
+
+    def get_position(self, projector: Projector) -> int:
+        checkpoint = ProjectionCheckpoint.objects.filter(name=projector.name).first()
+        return checkpoint.position if checkpoint is not None else 0
+
+    def _process(self, projector: Projector, follow: bool, idle_timeout: float=None) -> int:
+        checkpoint, _ = ProjectionCheckpoint.objects.get_or_create(name=projector.name)
+        subscription = EventSubscription(checkpoint.position, projector.event_types(), self.batch_size,
+                                         lazy=self.lazy)
+        processed = 0
+        position = checkpoint.position
+        for events in subscription.batches(follow, idle_timeout):
+            with transaction.atomic():
+                # locking the checkpoint keeps concurrent runs of the same projector from interleaving
+                checkpoint = ProjectionCheckpoint.objects.select_for_update().get(name=projector.name)
+                if checkpoint.position != position:
+                    log.warning('Projector {} was advanced by another process, stopping'.format(projector.name))
+                    break
+                if len(events) > 0:
+                    projector.handle_batch(events)
+                checkpoint.position = position = subscription.position
+                checkpoint.save()
+            processed += len(events)
+        log.debug('Projector {} processed {} events'.format(projector.name, processed))
+        return processed
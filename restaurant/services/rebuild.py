@@ -0,0 +1,231 @@
+import copy
+import logging
+import multiprocessing
+import queue
+import time
+from typing import Callable, Dict, List
+
+from django.db import connection, connections, models, transaction
+from django.db.models.expressions import RawSQL
+
+from restaurant.models import Event, ProjectionCheckpoint
+from restaurant.projections.projectors import ModelProjector
+from restaurant.services.translation import DjangoEventTranslatorService
+
+log = logging.getLogger(__name__)
+
+# partition of a stream: the first 32 bits of the md5 of its id, modulo the number of partitions. Stable across
+# processes and Postgres versions, so that a resumed rebuild partitions the streams as the interrupted one did
+PARTITION_SQL = 'mod((\'x\' || left(md5(event_stream_id::text), 8))::bit(32)::bigint, %s)'
+
+_shadow_models: Dict[type, type] = {}
+
+
+def shadow_model(model: type) -> type:
+    """An unmanaged copy of a model on the shadow table a rebuild writes to, <table>_rebuild"""
+    if model not in _shadow_models:
+        attrs = {field.name: field.clone() for field in model._meta.local_fields}
+        attrs['__module__'] = model.__module__
+        attrs['Meta'] = type('Meta', (), {'db_table': model._meta.db_table + '_rebuild', 'managed': False,
+                                          'app_label': model._meta.app_label})
+        _shadow_models[model] = type(model.__name__ + 'Rebuild', (models.Model,), attrs)
+    return _shadow_models[model]
+
+
+class PartitionedRebuildService(object):
+    """Rebuilds the read model of a ModelProjector from scratch with a process per partition of the streams.
+
+    Streams are hashed into partitions, and each process replays the events of its partition, up to the position the
+    store had reached when the rebuild started, into a shadow table through its own connection and server-side cursor.
+    Partitions hold disjoint sets of streams, so they never write the same rows. Each partition commits a checkpoint
+    with every batch: an interrupted rebuild resumes where each partition stopped when run again with the same number
+    of partitions. Once all partitions are done, the shadow table is swapped in for the read model and the projector's
+    checkpoint set to the rebuild's position, all in one transaction. ProjectionService.run then catches up with the
+    events appended since.
+
+    The position rebuilt up to is only taken once every write transaction which could still commit an event below it
+    has finished, waiting up to settle_timeout seconds for them.
+
+    Processes are forked, so rebuild must not be called inside a transaction.
+    """
+
+    def __init__(self, partitions: int=4, batch_size: int=1000, lazy: bool=False, progress_interval: float=1.0,
+                 settle_timeout: float=60.0):
+        if partitions < 1:
+            raise ValueError('A rebuild needs at least one partition')
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.lazy = lazy
+        self.progress_interval = progress_interval
+        self.settle_timeout = settle_timeout
+        self.translation_service = DjangoEventTranslatorService()
+
+    def rebuild(self, projector: ModelProjector, progress: Callable[[int, int, int], None]=None) -> int:
+        """Rebuild the read model, calling progress(partition, events processed so far, position) as partitions advance.
+        Returns the number of events processed by this run, less those processed before being resumed"""
+        if connection.in_atomic_block:
+            raise ValueError('A partitioned rebuild cannot run inside a transaction')
+        target = self.prepare(projector)
+        # forked processes must not share the parent's connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        updates = context.Queue()
+        processes = [context.Process(target=self._run_partition, args=(projector, partition, updates),
+                                     name='rebuild-{}-{}'.format(projector.name, partition))
+                     for partition in range(self.partitions)]
+        for process in processes:
+            process.start()
+
+        processed = [0] * self.partitions
+        while any(process.is_alive() for process in processes) or not updates.empty():
+            try:
+                partition, count, position = updates.get(timeout=self.progress_interval)
+            except queue.Empty:
+                continue
+            processed[partition] += count
+            if progress is not None:
+                progress(partition, processed[partition], position)
+        for process in processes:
+            process.join()
+
+        failed = [partition for partition, process in enumerate(processes) if process.exitcode != 0]
+        if len(failed) > 0:
+            raise RuntimeError('Rebuilding partitions {} of {} failed, run the rebuild again to resume'.format(
+                failed, projector.name))
+        self.swap(projector, target)
+        return sum(processed)
+
+    def prepare(self, projector: ModelProjector) -> int:
+        """Create the shadow table and the partition checkpoints, unless resuming. Returns the position rebuilt up to"""
+        if not isinstance(projector, ModelProjector):
+            raise ValueError('Only the read models of ModelProjectors can be rebuilt in partitions')
+        names = self._checkpoint_names(projector)
+        checkpoints = ProjectionCheckpoint.objects.filter(name__in=names + [self._target_name(projector)])
+        if checkpoints.count() == len(names) + 1 and self._shadow_exists(projector):
+            target = ProjectionCheckpoint.objects.get(name=self._target_name(projector)).position
+            log.info('Resuming the rebuild of {} up to position {}'.format(projector.name, target))
+            return target
+
+        table = connection.ops.quote_name(projector.model._meta.db_table)
+        shadow = connection.ops.quote_name(shadow_model(projector.model)._meta.db_table)
+        target = self._settled_position()
+        with transaction.atomic():
+            ProjectionCheckpoint.objects.filter(name__startswith=self._checkpoint_prefix(projector)).delete()
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TABLE IF EXISTS {}'.format(shadow))
+                cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING ALL)'.format(shadow, table))
+            ProjectionCheckpoint.objects.bulk_create(
+                [ProjectionCheckpoint(name=name, position=0) for name in names] +
+                [ProjectionCheckpoint(name=self._target_name(projector), position=target)])
+        return target
+
+    def rebuild_partition(self, projector: ModelProjector, partition: int,
+                          progress: Callable[[int, int], None]=None) -> int:
+        """Replay the events of a partition after its checkpoint into the shadow table. Returns the number replayed"""
+        name = self._checkpoint_names(projector)[partition]
+        target = ProjectionCheckpoint.objects.get(name=self._target_name(projector)).position
+        position = ProjectionCheckpoint.objects.get(name=name).position
+        projector = copy.copy(projector)
+        projector.model = shadow_model(projector.model)
+        rows = Event.objects.filter(id__gt=position, id__lte=target, type__in=projector.event_types())\
+            .annotate(partition=RawSQL(PARTITION_SQL, [self.partitions])).filter(partition=partition).order_by('id')
+        if self.lazy:
+            events = map(self.translation_service.translate_row_to_lazy_domain_event,
+                         self.translation_service.lazy_rows(rows).iterator(chunk_size=self.batch_size))
+        else:
+            events = map(self.translation_service.translate_event_to_domain_event,
+                         rows.iterator(chunk_size=self.batch_size))
+
+        processed = 0
+        batch = []
+        for event in events:
+            batch.append(event)
+            if len(batch) == self.batch_size:
+                self._commit(projector, name, batch, batch[-1].position)
+                processed += len(batch)
+                if progress is not None:
+                    progress(len(batch), batch[-1].position)
+                batch = []
+        # the partition is done: its checkpoint goes to the target, whether or not its last event was there
+        self._commit(projector, name, batch, target)
+        processed += len(batch)
+        if progress is not None:
+            progress(len(batch), target)
+        return processed
+
+    def swap(self, projector: ModelProjector, target: int) -> None:
+        """Replace the read model with the shadow table, once every partition has reached the target"""
+        names = self._checkpoint_names(projector)
+        unfinished = ProjectionCheckpoint.objects.filter(name__in=names, position__lt=target).count()
+        if unfinished > 0:
+            raise ValueError('{} partitions of the rebuild of {} are unfinished'.format(unfinished, projector.name))
+        table = connection.ops.quote_name(projector.model._meta.db_table)
+        shadow = connection.ops.quote_name(shadow_model(projector.model)._meta.db_table)
+        replaced = connection.ops.quote_name(projector.model._meta.db_table + '_replaced')
+        with transaction.atomic():
+            # locking the checkpoint keeps ProjectionService runs of the projector from writing to the old table
+            ProjectionCheckpoint.objects.select_for_update().get_or_create(name=projector.name)
+            with connection.cursor() as cursor:
+                cursor.execute('ALTER TABLE {} RENAME TO {}'.format(table, replaced))
+                cursor.execute('ALTER TABLE {} RENAME TO {}'.format(shadow, table))
+                cursor.execute('DROP TABLE {}'.format(replaced))
+            ProjectionCheckpoint.objects.filter(name=projector.name).update(position=target)
+            ProjectionCheckpoint.objects.filter(name__startswith=self._checkpoint_prefix(projector)).delete()
+        log.info('Swapped in the rebuilt {} at position {}'.format(projector.name, target))
+
+    def _run_partition(self, projector: ModelProjector, partition: int, updates: multiprocessing.Queue) -> None:
+        try:
+            self.rebuild_partition(projector, partition,
+                                   lambda count, position: updates.put((partition, count, position)))
+        finally:
+            connections.close_all()
+            updates.close()
+            updates.join_thread()
+
+    def _commit(self, projector: ModelProjector, name: str, events: List, position: int) -> None:
+        with transaction.atomic():
+            if len(events) > 0:
+                projector.handle_batch(events)
+            ProjectionCheckpoint.objects.filter(name=name).update(position=position)
+
+    def _settled_position(self) -> int:
+        """The last position of the store, once every write transaction that could still commit an event below it
+        has finished: events are numbered before they commit.
+
+        As in EventSubscription, those are the transactions which started before the position was read and hold the
+        ROW EXCLUSIVE lock inserts take on the event table. Raises RuntimeError if they are still open after
+        settle_timeout, rather than rebuilding past events which may yet commit.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT clock_timestamp(), coalesce(max(id), 0) FROM {}'.format(
+                connection.ops.quote_name(Event._meta.db_table)))
+            started, position = cursor.fetchone()
+            deadline = time.monotonic() + self.settle_timeout
+            while True:
+                cursor.execute(
+                    'SELECT EXISTS(SELECT 1 FROM pg_locks l JOIN pg_stat_activity a ON a.pid = l.pid '
+                    'WHERE l.locktype = \'relation\' AND l.relation = %s::regclass AND l.mode = \'RowExclusiveLock\' '
+                    'AND l.granted AND l.pid <> pg_backend_pid() AND a.xact_start < %s)',
+                    [Event._meta.db_table, started])
+                if not cursor.fetchone()[0]:
+                    return position
+                if time.monotonic() >= deadline:
+                    raise RuntimeError('Write transactions older than the rebuild of position {} are still open after '
+                                       '{}s, run the rebuild again once they finish'.format(position,
+                                                                                           self.settle_timeout))
+                time.sleep(0.05)
+
+    def _shadow_exists(self, projector: ModelProjector) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [shadow_model(projector.model)._meta.db_table])
+            return cursor.fetchone()[0]
+
+    def _checkpoint_prefix(self, projector: ModelProjector) -> str:
+        return '{}:rebuild:'.format(projector.name)
+
+    def _checkpoint_names(self, projector: ModelProjector) -> List[str]:
+        return ['{}{}/{}'.format(self._checkpoint_prefix(projector), partition, self.partitions)
+                for partition in range(self.partitions)]
+
+    def _target_name(self, projector: ModelProjector) -> str:
+        return '{}target'.format(self._checkpoint_prefix(projector))
@@ -0,0 +1,147 @@
+import copy
+import logging
+import threading
+from datetime import datetime
+from typing import Optional, Dict, List, Any
+from uuid import UUID
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from restaurant.events.timestamps import aware
+from restaurant.models import Snapshot
+from restaurant.projections.entities import EventableEntity
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotPolicy(object):
+    """Decides when the state of an entity is worth persisting as a snapshot.
+
+    A snapshot is taken when the entity crosses a multiple of `every_n_revisions`, or when a load had to replay at
+    least `replay_threshold` events on top of the latest snapshot. Either rule may be disabled by passing None.
+    """
+
+    def __init__(self, every_n_revisions: Optional[int]=None, replay_threshold: Optional[int]=None):
+        self.every_n_revisions = every_n_revisions
+        self.replay_threshold = replay_threshold
+
+    @staticmethod
+    def from_settings() -> 'SnapshotPolicy':
+        return SnapshotPolicy(getattr(settings, 'SNAPSHOT_EVERY_N_REVISIONS', None),
+                              getattr(settings, 'SNAPSHOT_REPLAY_THRESHOLD', None))
+
+    def should_snapshot(self, from_revision: int, to_revision: int, replayed: int=0) -> bool:
+        if self.every_n_revisions and to_revision // self.every_n_revisions > from_revision // self.every_n_revisions:
+            return True
+        if self.replay_threshold and replayed >= self.replay_threshold:
+            return True
+        return False
+
+
+class SnapshotService(object):
+
+    def restore_latest(self, entity: EventableEntity, max_date: datetime=None, recorded_before: datetime=None) -> int:
+        """Restore the latest valid snapshot into a freshly built entity.
+
+        With max_date, the snapshot must only contain events that occurred by then. With recorded_before, it must have
+        been taken by then, so that it cannot contain events recorded afterwards. Returns the revision the entity was
+        restored to, 0 if there was no usable snapshot
+        """
+        snapshots = Snapshot.objects.filter(event_stream_id=entity.id, version=entity.__class__.snapshot_version())
+        if max_date is not None:
+            snapshots = snapshots.filter(time__lte=aware(max_date))
+        if recorded_before is not None:
+            snapshots = snapshots.filter(created_at__lte=aware(recorded_before))
+        snapshot = snapshots.order_by('-revision').first()
+        if snapshot is None:
+            return 0
+        entity.restore_snapshot_state(snapshot.data)
+        entity.revision = snapshot.revision
+        return snapshot.revision
+
+    def save(self, entity: EventableEntity, time: datetime) -> None:
+        """Snapshot the entity at its current revision. time is that of the last event applied to the entity.
+
+        Every event applied to the entity must be persisted, or be persisted in the same transaction
+        """
+        time = aware(time)
+        log.debug('Snapshotting entity {} at revision {}'.format(entity.id, entity.revision))
+        try:
+            with transaction.atomic():
+                Snapshot.objects.create(
+                    event_stream_id=entity.id,
+                    type=entity.aggregate_type,
+                    version=entity.__class__.snapshot_version(),
+                    revision=entity.revision,
+                    time=time,
+                    data=entity.snapshot_state()
+                )
+        except IntegrityError:
+            # a concurrent load already snapshotted this exact revision
+            log.debug('Snapshot for entity {} at revision {} already exists'.format(entity.id, entity.revision))
+
+    def delete_stale(self, entity_class: type) -> int:
+        """Remove snapshots written by a previous version of the entity's event handlers"""
+        deleted, _ = Snapshot.objects.filter(type=entity_class.aggregate_type)\
+            .exclude(version=entity_class.snapshot_version()).delete()
+        return deleted
+
+
+class MemorySnapshotService(SnapshotService):
+    """Snapshots held in memory rather than in the Snapshot table, for event stores without a database such as the
+    segment log. They are lost with the process, which only costs loads replaying more events"""
+
+    def __init__(self):
+        # by stream, in revision order
+        self._snapshots: Dict[UUID, List[_MemorySnapshot]] = {}
+        self._lock = threading.Lock()
+
+    def restore_latest(self, entity: EventableEntity, max_date: datetime=None, recorded_before: datetime=None) -> int:
+        version = entity.__class__.snapshot_version()
+        with self._lock:
+            snapshots = list(self._snapshots.get(entity.id, ()))
+        for snapshot in reversed(snapshots):
+            if snapshot.version == version and (max_date is None or snapshot.time <= aware(max_date)) and \
+                    (recorded_before is None or snapshot.created_at <= aware(recorded_before)):
+                entity.restore_snapshot_state(copy.deepcopy(snapshot.data))
+                entity.revision = snapshot.revision
+                return snapshot.revision
+        return 0
+
+    def save(self, entity: EventableEntity, time: datetime) -> None:
+        log.debug('Snapshotting entity {} at revision {}'.format(entity.id, entity.revision))
+        snapshot = _MemorySnapshot(entity.aggregate_type, entity.__class__.snapshot_version(), entity.revision,
+                                   aware(time), copy.deepcopy(entity.snapshot_state()))
+        with self._lock:
+            snapshots = self._snapshots.setdefault(entity.id, [])
+            if any(existing.revision == snapshot.revision and existing.version == snapshot.version
+                   for existing in snapshots):
+                return
+            snapshots.append(snapshot)
+            snapshots.sort(key=lambda existing: existing.revision)
+
+    def delete_stale(self, entity_class: type) -> int:
+        version = entity_class.snapshot_version()
+        deleted = 0
+        with self._lock:
+            for snapshots in self._snapshots.values():
+                kept = [snapshot for snapshot in snapshots
+                        if snapshot.type != entity_class.aggregate_type or snapshot.version == version]
+                deleted += len(snapshots) - len(kept)
+                snapshots[:] = kept
+        return deleted
+
+
+class _MemorySnapshot(object):
+
+    __slots__ = ('type', 'version', 'revision', 'time', 'created_at', 'data')
+
+    def __init__(self, type: str, version: str, revision: int, time: datetime, data: Any):
+        self.type = type
+        self.version = version
+        self.revision = revision
+        self.time = time
+        self.created_at = timezone.now()
+        self.data = data
@@ -0,0 +1,200 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+from uuid import UUID
+
+from django.db import connection
+from django.utils import timezone
+
+from restaurant.events.codecs import get_codec
+from restaurant.models import Event, Stream, Snapshot
+from restaurant.projections.entities import Restaurant, MenuItem
+
+# constructor values of the sample events profiled, by schema type
+SAMPLE_VALUES = {
+    str: 'Sample',
+    int: 1,
+    UUID: uuid.UUID(int=1),
+    datetime: datetime(2019, 1, 1),
+}
+
+
+class ReplayCost(object):
+    """Seconds taken to replay one event of a type: building it from its stored data, then applying it"""
+
+    def __init__(self, event_type: str, aggregate_type: str, decode_seconds: float, apply_seconds: float):
+        self.event_type = event_type
+        self.aggregate_type = aggregate_type
+        self.decode_seconds = decode_seconds
+        self.apply_seconds = apply_seconds
+
+    @property
+    def seconds(self) -> float:
+        return self.decode_seconds + self.apply_seconds
+
+
+def profile_replay_costs(entity_classes: Iterable[type]=(Restaurant, MenuItem), samples: int=2000,
+                         repeat: int=3) -> Dict[str, ReplayCost]:
+    """Measure the replay cost of every event type handled by the entity classes, as the best of repeat runs of samples
+    decodes and applications of a sample event. Handlers are applied to the same entity over and over, so the cost of
+    handlers whose work grows with the entity's state (e.g. a list membership test) is that of a small entity"""
+    costs = {}
+    for entity_class in entity_classes:
+        for event_class in entity_class._handlers:
+            event_type = event_class.get_event_type()
+            codec = get_codec(event_type)
+            event = event_class(**{name: SAMPLE_VALUES.get(field_type, 1) for name, field_type in event_class.schema},
+                                user_id=1, revision=1)
+            data = codec.encode(event)
+            entity = entity_class()
+            costs[event_type] = ReplayCost(
+                event_type, entity_class.aggregate_type,
+                _time_per_call(codec.decode, (data, entity.id, 1, 1, event.timestamp, 1), samples, repeat),
+                _time_per_call(entity_class.handler_for(event_class), (entity, event), samples, repeat))
+    return costs
+
+
+def _time_per_call(func, args: Tuple, samples: int, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(samples):
+            func(*args)
+        elapsed = (time.perf_counter() - started) / samples
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class StreamAnalysisService(object):
+    """Statistics on the shape of the event store, to decide where snapshots or archiving pay off, computed with
+    aggregate queries over the Stream catalog and the Event table: no event is loaded.
+
+    Replay costs are estimated from the per event type costs measured by profile_replay_costs. Events of types which
+    were not profiled are costed at the mean of those which were.
+    """
+
+    def __init__(self, costs: Dict[str, ReplayCost]=None, entity_classes: Iterable[type]=(Restaurant, MenuItem)):
+        self.entity_classes = list(entity_classes)
+        self.costs = costs if costs is not None else profile_replay_costs(self.entity_classes)
+
+    def analyze(self, top: int=10, window: timedelta=timedelta(days=7)) -> Dict[str, Any]:
+        """The full report, as JSON serializable data"""
+        now = timezone.now()
+        return {
+            'generated_at': now.isoformat(),
+            'replay_costs': [{
+                'event_type': cost.event_type,
+                'aggregate_type': cost.aggregate_type,
+                'decode_us': cost.decode_seconds * 1e6,
+                'apply_us': cost.apply_seconds * 1e6,
+                'replay_us': cost.seconds * 1e6,
+            } for cost in sorted(self.costs.values(), key=lambda cost: cost.event_type)],
+            'stream_lengths': self.stream_lengths(),
+            'event_types': self.event_type_mix(),
+            'hot_streams': {'since': (now - window).isoformat(), 'streams': self.hot_streams(window, top)},
+            'costliest_streams': self.costliest_streams(top),
+        }
+
+    def stream_lengths(self) -> List[Dict[str, Any]]:
+        """The distribution of the number of events per stream, for each aggregate type"""
+        rows = self._fetch(
+            'SELECT type, count(*), sum(event_count), avg(event_count), '
+            'percentile_disc(ARRAY[0.5, 0.9, 0.99]) WITHIN GROUP (ORDER BY event_count), max(event_count) '
+            'FROM {stream} GROUP BY type ORDER BY type')
+        return [{
+            'aggregate_type': aggregate_type,
+            'streams': streams,
+            'events': int(events),
+            'mean': float(mean),
+            'p50': percentiles[0],
+            'p90': percentiles[1],
+            'p99': percentiles[2],
+            'max': longest,
+        } for aggregate_type, streams, events, mean, percentiles, longest in rows]
+
+    def event_type_mix(self) -> List[Dict[str, Any]]:
+        """The number of events of each type, and their share of the events of their aggregate type"""
+        rows = self._fetch(
+            'SELECT s.type, e.type, count(*), count(*)::float8 / sum(count(*)) OVER (PARTITION BY s.type) '
+            'FROM {event} e JOIN {stream} s ON s.id = e.event_stream_id '
+            'GROUP BY s.type, e.type ORDER BY s.type, count(*) DESC, e.type')
+        return [{'aggregate_type': aggregate_type, 'event_type': event_type, 'events': events, 'share': share}
+                for aggregate_type, event_type, events, share in rows]
+
+    def hot_streams(self, window: timedelta, limit: int=10) -> List[Dict[str, Any]]:
+        """The streams with the most events appended within the window up to now, with their append rate over the
+        window and over their lifetime"""
+        since = timezone.now() - window
+        days = window.total_seconds() / 86400
+        rows = self._fetch(
+            'SELECT s.id, s.type, recent.events, s.event_count, s.first_event_time, s.last_event_time '
+            'FROM (SELECT event_stream_id, count(*) AS events FROM {event} WHERE created_at >= %s '
+            'GROUP BY event_stream_id ORDER BY count(*) DESC, event_stream_id LIMIT %s) recent '
+            'JOIN {stream} s ON s.id = recent.event_stream_id ORDER BY recent.events DESC, s.id', [since, limit])
+        return [{
+            'event_stream_id': str(event_stream_id),
+            'aggregate_type': aggregate_type,
+            'events': events,
+            'events_per_day': events / days,
+            'lifetime_events_per_day': _daily_rate(event_count, first_event_time, last_event_time),
+        } for event_stream_id, aggregate_type, events, event_count, first_event_time, last_event_time in rows]
+
+    def costliest_streams(self, limit: int=10) -> List[Dict[str, Any]]:
+        """The streams which take longest to replay in full, with the events a load still replays after their latest
+        current snapshot, and the estimated cost of that load"""
+        event_types = sorted(self.costs)
+        seconds = [self.costs[event_type].seconds for event_type in event_types]
+        default = sum(seconds) / len(seconds) if len(seconds) > 0 else 0.0
+        rows = self._fetch(
+            'SELECT s.id, s.type, s.event_count, s.head_revision, s.first_event_time, s.last_event_time, cost.seconds '
+            'FROM (SELECT e.event_stream_id, sum(coalesce(c.seconds, %s)) AS seconds FROM {event} e '
+            'LEFT JOIN unnest(%s::varchar[], %s::float8[]) AS c(type, seconds) ON c.type = e.type '
+            'GROUP BY e.event_stream_id ORDER BY 2 DESC, e.event_stream_id LIMIT %s) cost '
+            'JOIN {stream} s ON s.id = cost.event_stream_id ORDER BY cost.seconds DESC, s.id',
+            [default, event_types, seconds, limit])
+        snapshots = self._snapshot_revisions([row[0] for row in rows])
+
+        streams = []
+        for event_stream_id, aggregate_type, event_count, head_revision, first_event_time, last_event_time, cost \
+                in rows:
+            snapshot_revision = snapshots.get(event_stream_id, 0)
+            replayed = head_revision - snapshot_revision
+            streams.append({
+                'event_stream_id': str(event_stream_id),
+                'aggregate_type': aggregate_type,
+                'events': event_count,
+                'head_revision': head_revision,
+                'snapshot_revision': snapshot_revision,
+                'events_per_load': replayed,
+                'replay_ms': cost * 1e3,
+                # assumes the events after the snapshot have the same mix as the stream as a whole
+                'load_ms': cost * 1e3 * replayed / event_count if event_count > 0 else 0.0,
+                'lifetime_events_per_day': _daily_rate(event_count, first_event_time, last_event_time),
+            })
+        return streams
+
+    def _snapshot_revisions(self, event_stream_ids: List[UUID]) -> Dict[UUID, int]:
+        """The revision of the latest snapshot of each stream that loads would restore, i.e. of the current version"""
+        if len(event_stream_ids) == 0:
+            return {}
+        rows = Snapshot.objects.filter(
+            event_stream_id__in=event_stream_ids,
+            version__in=[entity_class.snapshot_version() for entity_class in self.entity_classes]
+        ).values_list('event_stream_id', 'revision')
+        revisions = {}
+        for event_stream_id, revision in rows:
+            revisions[event_stream_id] = max(revision, revisions.get(event_stream_id, 0))
+        return revisions
+
+    def _fetch(self, query: str, params: List=None) -> List[Tuple]:
+        with connection.cursor() as cursor:
+            cursor.execute(query.format(event=connection.ops.quote_name(Event._meta.db_table),
+                                        stream=connection.ops.quote_name(Stream._meta.db_table)), params)
+            return cursor.fetchall()
+
+
+def _daily_rate(events: int, first_event_time: datetime, last_event_time: datetime) -> Optional[float]:
+    """Events per day between a stream's first and last events. None for streams without a time span"""
+    days = (last_event_time - first_event_time).total_seconds() / 86400
+    return events / days if days > 0 else None
@@ -0,0 +1,189 @@
+import logging
+import select
+import time
+from datetime import datetime
+from typing import List, Iterator, Tuple
+
+from django.db import connection
+
+from restaurant.events.base import BaseEvent
+from restaurant.models import Event
+from restaurant.services.translation import DjangoEventTranslatorService
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'restaurant_events'
+
+
+def notify_appended(position: int) -> None:
+    """Wake up subscribers. Postgres holds notifications back until the surrounding transaction commits"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, str(position)])
+
+
+class EventSubscription(object):
+    """Reads the events of the store in global order (Event.id) after a given position and keeps following new ones.
+
+    Catching up is done with keyset pagination. Once caught up, the subscription LISTENs for the notification sent
+    when EventPersistenceService.save commits, and falls back to polling with an interval that backs off while the
+    store is idle.
+
+    Ids are handed out before commit, so a transaction may still commit an event below an id that is already visible.
+    Reading stops at such a gap until it is filled, or until it is known to be permanent (a rolled back insert): the
+    ids of the gap were handed out before the events after it were read, so once no transaction writing to the event
+    table which started before that read is still open, nothing can fill the gap any more. A long running write
+    transaction (a large import, say) therefore holds the subscription up until it ends. With gap_timeout, a gap still
+    open after that many seconds is skipped anyway, with a warning: its events are then never read.
+
+    Events of other types than event_types are filtered out by the query. With lazy, the data of the events read is
+    only decoded when their fields are accessed.
+    """
+
+    def __init__(self, position: int=0, event_types: List[str]=None, batch_size: int=500,
+                 min_poll_interval: float=0.01, max_poll_interval: float=2.0, gap_timeout: float=None,
+                 lazy: bool=False):
+        self.position = position
+        self.event_types = event_types
+        self.batch_size = batch_size
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.gap_timeout = gap_timeout
+        self.lazy = lazy
+        # the last position read when gaps were last checked, and the database time just after it was read
+        self._horizon: Tuple[int, datetime] = None
+        # when the gap at the current position was first seen, for gap_timeout
+        self._gap_seen_at: float = None
+        self.translation_service = DjangoEventTranslatorService()
+
+    def __iter__(self) -> Iterator[BaseEvent]:
+        for events in self.batches():
+            yield from events
+
+    def batches(self, follow: bool=True, idle_timeout: float=None) -> Iterator[List[BaseEvent]]:
+        """Yield the events after the current position in batches, advancing position past each one.
+
+        A batch may be empty when none of the events it covered were of the requested types. Once caught up, stops
+        unless following, in which case it waits for new events until idle_timeout seconds pass without any.
+        """
+        listen_attempted = listening = False
+        interval = self.min_poll_interval
+        idle_since = time.monotonic()
+        try:
+            while True:
+                events, end, caught_up = self._read_batch()
+                if end > self.position:
+                    self.position = end
+                    yield events
+                if len(events) > 0:
+                    interval = self.min_poll_interval
+                    idle_since = time.monotonic()
+                if not caught_up:
+                    continue
+                if not follow:
+                    return
+                if not listen_attempted:
+                    # listen before reading once more, so that nothing appended in between is missed
+                    listen_attempted = True
+                    listening = self._listen()
+                    continue
+                if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                    return
+                if self._wait(interval, listening):
+                    interval = self.min_poll_interval
+                else:
+                    interval = min(interval * 2, self.max_poll_interval)
+        finally:
+            if listening:
+                self._unlisten()
+
+    def _read_batch(self) -> Tuple[List[BaseEvent], int, bool]:
+        positions = list(Event.objects.filter(id__gt=self.position).order_by('id')
+                         .values_list('id', flat=True)[:self.batch_size])
+        if len(positions) == 0:
+            return [], self.position, True
+
+        end = self.position
+        for position in positions:
+            if position != end + 1 and not self._gap_is_permanent(position, positions[-1]):
+                break
+            end = position
+        if end == self.position:
+            if self._gap_timed_out():
+                end = positions[0]
+            else:
+                return [], end, True
+        self._gap_seen_at = None
+
+        rows = Event.objects.filter(id__gt=self.position, id__lte=end)
+        if self.event_types is not None:
+            rows = rows.filter(type__in=self.event_types)
+        rows = rows.order_by('id')
+        if self.lazy:
+            events = list(map(self.translation_service.translate_row_to_lazy_domain_event,
+                              self.translation_service.lazy_rows(rows)))
+        else:
+            events = list(map(self.translation_service.translate_event_to_domain_event, rows))
+        return events, end, end != positions[-1] or len(positions) < self.batch_size
+
+    def _gap_is_permanent(self, position: int, last_read: int) -> bool:
+        """Whether the gap before position can no longer be filled.
+
+        The ids of the gap were drawn before the positions after it were read. Inserts take a ROW EXCLUSIVE lock on the
+        event table before drawing ids and hold it until they commit or roll back, so the transactions which drew them
+        are among those holding the lock which started before that read. The time of the read is kept for as long as
+        the gap is waited on, so that the transactions which could fill it only ever get fewer, even under a constant
+        stream of new writes.
+        """
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            if self._horizon is None or position > self._horizon[0]:
+                cursor.execute('SELECT clock_timestamp()')
+                self._horizon = (last_read, cursor.fetchone()[0])
+            cursor.execute(
+                'SELECT NOT EXISTS(SELECT 1 FROM pg_locks l JOIN pg_stat_activity a ON a.pid = l.pid '
+                'WHERE l.locktype = \'relation\' AND l.relation = %s::regclass AND l.mode = \'RowExclusiveLock\' '
+                'AND l.granted AND l.pid <> pg_backend_pid() AND a.xact_start < %s)',
+                [Event._meta.db_table, self._horizon[1]])
+            return cursor.fetchone()[0]
+
+    def _gap_timed_out(self) -> bool:
+        if self.gap_timeout is None:
+            return False
+        if self._gap_seen_at is None:
+            self._gap_seen_at = time.monotonic()
+            return False
+        if time.monotonic() - self._gap_seen_at < self.gap_timeout:
+            return False
+        log.warning('Skipping the gap after position {}, still open after {}s: events committed in it will not be '
+                    'read'.format(self.position, self.gap_timeout))
+        return True
+
+    def _listen(self) -> bool:
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN {}'.format(NOTIFY_CHANNEL))
+        return True
+
+    def _unlisten(self) -> None:
+        if connection.connection is not None:
+            with connection.cursor() as cursor:
+                cursor.execute('UNLISTEN {}'.format(NOTIFY_CHANNEL))
+
+    def _wait(self, timeout: float, listening: bool) -> bool:
+        """Block until notified or until timeout. Returns whether a notification arrived"""
+        if not listening:
+            time.sleep(timeout)
+            return False
+        raw_connection = connection.connection
+        if raw_connection.notifies:
+            raw_connection.notifies.clear()
+            return True
+        if select.select([raw_connection], [], [], timeout) == ([], [], []):
+            return False
+        raw_connection.poll()
+        notified = len(raw_connection.notifies) > 0
+        raw_connection.notifies.clear()
+        return notified
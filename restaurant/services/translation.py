@@ -1,53 +1,55 @@
 
-from typing import List, Dict
+import time as clock
+from typing import List, Dict, Tuple
+from django.db.models import QuerySet, TextField
+from django.db.models.functions import Cast
 from django.utils import timezone
 
-from restaurant.events.base import BaseEvent, DjangoModelTranslatableBaseEvent
-from restaurant.models import Event, User
+from restaurant import instrumentation
+from restaurant.events.base import BaseEvent
+from restaurant.events.codecs import get_codec
+from restaurant.models import Event
 
 class DjangoEventTranslatorService(object):
 
-    def __init__(self):
-        # put together base event keys with a dummy base_event
-        self.root_event_attrs = dir(DjangoModelTranslatableBaseEvent(1, 0))
-        self.event_mapping: Dict[str, DjangoModelTranslatableBaseEvent] = {}
-        for subclass in DjangoModelTranslatableBaseEvent.__subclasses__():
-            self.event_mapping[subclass.get_event_type()] = subclass
+    # the columns read for lazy translation, with the data blob as its JSON text rather than parsed by the driver
+    LAZY_FIELDS = ('id', 'event_stream_id', 'type', 'revision', 'user_id', 'time', 'raw_data')
 
     def translate_to_django_models(self, events: List[BaseEvent]) -> List[Event]:
-        # maintain list of users
-        user_cache = {}
-        return list(map(lambda event: self._translate_individual_event(event, user_cache), events))
+        return list(map(self._translate_individual_event, events))
 
     def translate_event_to_domain_event(self, event: Event)->BaseEvent:
-        domain_event = self.event_mapping[event.type].create_from_event(event)
-        domain_event.set_event_stream_id(event.event_stream_id)
-        domain_event.clean_data_post_save()
+        if not instrumentation.active:
+            return get_codec(event.type).decode(event.data, event.event_stream_id, event.user_id_id, event.revision,
+                                                event.time, event.id)
+        started = clock.perf_counter()
+        domain_event = get_codec(event.type).decode(event.data, event.event_stream_id, event.user_id_id,
+                                                    event.revision, event.time, event.id)
+        instrumentation.observe('translate_seconds', clock.perf_counter() - started)
         return domain_event
 
-    def _translate_individual_event(self, event:BaseEvent, user_cache: Dict) -> Event:
+    def lazy_rows(self, queryset: QuerySet) -> QuerySet:
+        """The rows of an Event queryset as tuples of LAZY_FIELDS, for translate_row_to_lazy_domain_event"""
+        return queryset.annotate(raw_data=Cast('data', TextField())).values_list(*self.LAZY_FIELDS)
+
+    def translate_row_to_lazy_domain_event(self, row: Tuple) -> BaseEvent:
+        """Build an event whose data is only decoded, field by field, when it is read"""
+        position, event_stream_id, event_type, revision, user_id, time, raw_data = row
+        return get_codec(event_type).decode_lazy(raw_data, event_stream_id, user_id, revision, time, position)
+
+    def _translate_individual_event(self, event:BaseEvent) -> Event:
         #extract data from non-core events
         # There are more pythonic ways to do the following, but I'm explicit here to make it clear what's happening
         # as we translate the DomainEvents into the Django ORM models
-        if event.user_id in user_cache.keys():
-            user = user_cache[event.user_id]
-        else:
-            user = User.objects.get(id=event.user_id)
-            user_cache[user.id] = user
         outcome = Event()
         outcome.event_stream_id = event.event_stream_id
         outcome.revision = event.revision
-        outcome.user_id = user
+        # the foreign key is enforced by the database, no need to fetch the user
+        outcome.user_id_id = event.user_id
         outcome.time = timezone.make_aware(event.timestamp, timezone.get_current_timezone())
         outcome.type = event.__class__.get_event_type()
         outcome.data = self._build_data_blob(event)
         return outcome
 
     def _build_data_blob(self, event: BaseEvent) -> Dict:
-        data = {}
-        event.encode_data_before_save()
-        for attr in dir(event):
-            if attr not in self.root_event_attrs and not attr.startswith("_"):
-                data[attr] = event.__getattribute__(attr)
-
-        return data
+        return get_codec(event.__class__.get_event_type()).encode(event)
@@ -1,8 +1,13 @@
-from typing import List
+from typing import List, Callable
 
-from pytest import fixture
+import pytest
+from pytest import fixture, mark
 
 from restaurant.models import User
+from restaurant.services.backends.base import EventStoreBackend
+from restaurant.services.backends.database import DatabaseEventStore
+from restaurant.services.backends.segments import SegmentLogEventStore
+from restaurant.services.snapshots import SnapshotService, MemorySnapshotService
 
 
 @fixture(scope="function")
@@ -21,3 +26,32 @@ def test_users(transactional_db) -> List[User]:
         email='alice@test.com'
     )
     return User.objects.all()
+
+
+@fixture(params=[pytest.param('database', marks=mark.django_db(transaction=True)), 'segments'])
+def backend(request, tmp_path) -> EventStoreBackend:
+    if request.param == 'database':
+        request.getfixturevalue('test_users')
+        yield DatabaseEventStore()
+        return
+    store = SegmentLogEventStore(str(tmp_path / 'events'), segment_size=4096)
+    yield store
+    store.close()
+
+
+@fixture
+def snapshot_service(backend) -> SnapshotService:
+    """Where snapshots go along with the backend: the Snapshot table with the database, memory otherwise"""
+    return SnapshotService() if isinstance(backend, DatabaseEventStore) else MemorySnapshotService()
+
+
+@fixture
+def entity_store(backend, snapshot_service) -> dict:
+    """The options of entity services on the backend"""
+    return {'backend': backend, 'snapshot_service': snapshot_service}
+
+
+@fixture
+def assert_backend_queries(backend, django_assert_num_queries) -> Callable:
+    """Assert the number of queries the database backend makes, and that other backends make none"""
+    return lambda queries: django_assert_num_queries(queries if isinstance(backend, DatabaseEventStore) else 0)
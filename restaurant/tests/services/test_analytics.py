@@ -0,0 +1,62 @@
+import random
+from datetime import datetime, date, timedelta
+
+import pytest
+from pytest import mark
+
+np = pytest.importorskip('numpy')
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged  # noqa: E402
+from restaurant.projections.entities import MenuItem  # noqa: E402
+from restaurant.services.analytics import PriceAnalyticsService, day_ends  # noqa: E402
+from restaurant.services.entities import MenuItemService  # noqa: E402
+from restaurant.services.events import EventPersistenceService  # noqa: E402
+
+
+@mark.integration
+class TestPriceAnalytics:
+
+    def test_matches_scalar_replay(self, transactional_db, test_users):
+        generator = random.Random(42)
+        start = datetime(2019, 1, 1, 9)
+        items = []
+        for _ in range(8):
+            menu_item = MenuItem()
+            created = start + timedelta(days=generator.randint(0, 5))
+            menu_item.apply(MenuItemCreated('Item', MenuItem.CATEGORY_ENTREE, test_users[0].id, 1, created))
+            changed = created
+            for revision in range(2, generator.randint(2, 12)):
+                changed += timedelta(hours=generator.randint(0, 48))
+                menu_item.apply(PriceChanged(generator.randint(-100, 300), test_users[0].id, revision, changed))
+            items.append(menu_item)
+        EventPersistenceService().save_many(items)
+
+        ids = [item.id for item in items] + [MenuItem().id]
+        history = PriceAnalyticsService().load()
+        dates = day_ends(date(2018, 12, 30), date(2019, 1, 20))
+        matrix = history.price_matrix(ids, dates)
+        assert matrix.shape == (9, 22)
+
+        service = MenuItemService()
+        for row, event_stream_id in enumerate(ids):
+            for column, day_end in enumerate(dates):
+                replayed = service.get_as_of(event_stream_id, day_end.replace(tzinfo=None))
+                assert matrix[row, column] == (replayed.price_in_cents if replayed is not None else 0)
+
+        times, prices = history.series(items[0].id)
+        assert prices[-1] == items[0].price_in_cents
+        assert list(times) == sorted(times)
+        assert len(history.series(MenuItem().id)[0]) == 0
+
+    def test_load_selected_items(self, transactional_db, test_users):
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        tea = service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+        service.set_price(test_users[0], coffee, 275)
+
+        history = PriceAnalyticsService().load([coffee.id])
+        assert history.event_stream_ids == [coffee.id]
+        assert len(history) == 2
+        now = datetime.utcnow() + timedelta(minutes=1)
+        assert history.price_matrix([tea.id, coffee.id], [now]).tolist() == [[0], [275]]
+        assert PriceAnalyticsService().load([]).price_matrix([coffee.id], [now]).tolist() == [[0]]
@@ -0,0 +1,249 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+
+import pytest
+from pytest import mark
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, MenuItemAdded
+from restaurant.projections.entities import Restaurant, MenuItem
+from restaurant.projections.reductions import Sum, Latest
+from restaurant.services.backends.base import StreamAppend, ConcurrencyConflict
+from restaurant.services.backends.database import DatabaseEventStore
+from restaurant.services.backends.group_commit import GroupCommitEventStore
+from restaurant.services.backends.segments import SegmentLogEventStore
+from restaurant.services.events import EventPersistenceService, EventQueryService
+
+USER_ID = 100
+
+
+def opened_restaurant(name: str='Bob\'s Cafe', timestamp: datetime=None) -> Restaurant:
+    restaurant = Restaurant()
+    restaurant.apply(RestaurantOpened(name, 2019, '123 Test Street', USER_ID, 1, timestamp))
+    return restaurant
+
+
+def append(backend, *entities) -> int:
+    position = backend.append([StreamAppend(entity.id, entity.aggregate_type,
+                                            entity.revision - len(entity.uncommitted_events),
+                                            entity.uncommitted_events) for entity in entities])
+    for entity in entities:
+        entity.uncommitted_events = []
+    return position
+
+
+@mark.integration
+class TestEventStoreBackends:
+
+    def test_append_and_read_stream(self, backend):
+        bobs = opened_restaurant()
+        bobs.apply(EmployeeHired('Sam', USER_ID, 2))
+        coffee = MenuItem()
+        coffee.apply(MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, USER_ID, 1))
+        bobs.apply(MenuItemAdded(coffee.id, USER_ID, 3))
+        append(backend, bobs, coffee)
+
+        events = backend.read_stream(bobs.id)
+        assert [type(event) for event in events] == [RestaurantOpened, EmployeeHired, MenuItemAdded]
+        assert [event.revision for event in events] == [1, 2, 3]
+        assert events[0].name == 'Bob\'s Cafe'
+        assert events[2].menu_item_id == coffee.id
+        assert all(event.event_stream_id == bobs.id and event.user_id == USER_ID for event in events)
+        assert [event.revision for event in backend.read_stream(bobs.id, after_revision=2)] == [3]
+        assert backend.head_revision(bobs.id) == 3
+        assert backend.head_revision(coffee.id) == 1
+        assert backend.head_revision(MenuItem().id) is None
+        assert backend.read_stream(MenuItem().id) == []
+
+        assert backend.head_revision(bobs.id, Restaurant.aggregate_type) == 3
+        assert backend.head_revision(bobs.id, MenuItem.aggregate_type) is None
+        assert backend.stream_exists(coffee.id, MenuItem.aggregate_type)
+        assert not backend.stream_exists(coffee.id, Restaurant.aggregate_type)
+        assert list(backend.stream_ids(Restaurant.aggregate_type)) == [bobs.id]
+        assert list(backend.stream_ids(MenuItem.aggregate_type)) == [coffee.id]
+
+    def test_stale_appends_conflict(self, backend):
+        bobs = opened_restaurant()
+        append(backend, bobs)
+        other = opened_restaurant('The Testing Bar')
+        bobs.apply(EmployeeHired('Sam', USER_ID, 2))
+        append(backend, bobs)
+
+        stale = Restaurant(bobs.id)
+        stale.revision = 1
+        stale.apply(EmployeeHired('Sally', USER_ID, 2))
+        with pytest.raises(ConcurrencyConflict) as conflict:
+            append(backend, other, stale)
+        assert conflict.value.event_stream_ids == [bobs.id]
+        assert backend.head_revision(other.id) is None
+        assert [event.employee_name for event in backend.read_stream(bobs.id)[1:]] == ['Sam']
+
+    def test_read_many_and_as_of(self, backend):
+        start = datetime(2019, 1, 1)
+        coffee, tea = MenuItem(), MenuItem()
+        for menu_item in (coffee, tea):
+            menu_item.apply(MenuItemCreated('Item', MenuItem.CATEGORY_DRINK, USER_ID, 1, start))
+            menu_item.apply(PriceChanged(100, USER_ID, 2, start + timedelta(days=1)))
+        append(backend, coffee, tea)
+
+        events = list(backend.read_many([tea.id, coffee.id]))
+        streams = [(event_stream_id, [event.revision for event in stream_events])
+                   for event_stream_id, stream_events in groupby(events, key=lambda event: event.event_stream_id)]
+        assert sorted(streams) == sorted([(coffee.id, [1, 2]), (tea.id, [1, 2])])
+        assert [event.revision for event in backend.read_stream(coffee.id, max_date=start)] == [1]
+        assert len(list(backend.read_many([coffee.id, tea.id], max_date=start + timedelta(hours=1)))) == 2
+
+        batches = backend.read_many_batches([coffee.id, tea.id], max_date=start)
+        assert sorted(batch.event_stream_id for batch in batches) == sorted([coffee.id, tea.id])
+        assert all([event.revision for event in batch] == [1] for batch in batches)
+        assert [(index, event.revision) for index, event in backend.read_as_of(
+            [(tea.id, start + timedelta(days=1)), (coffee.id, start - timedelta(days=1)), (coffee.id, start)])] \
+            == [(0, 1), (0, 2), (2, 1)]
+        reductions = {'price_in_cents': Sum(PriceChanged, 'delta'), 'name': Latest(MenuItemCreated, 'name')}
+        assert backend.reduce_streams([coffee.id, tea.id, MenuItem().id], MenuItem.aggregate_type, reductions) == {
+            coffee.id: {'price_in_cents': 100, 'name': 'Item'}, tea.id: {'price_in_cents': 100, 'name': 'Item'}}
+        assert backend.reduce_streams([coffee.id], MenuItem.aggregate_type, reductions, start) == \
+            {coffee.id: {'price_in_cents': None, 'name': 'Item'}}
+        assert backend.reduce_streams([coffee.id], Restaurant.aggregate_type, reductions) == {}
+
+    def test_read_all(self, backend):
+        restaurants = [opened_restaurant('Cafe {}'.format(i)) for i in range(3)]
+        first = append(backend, restaurants[0])
+        for restaurant in restaurants[1:]:
+            restaurant.apply(EmployeeHired('Carl', USER_ID, 2))
+        last = append(backend, *restaurants[1:])
+
+        events = backend.read_all()
+        assert len(events) == 5
+        assert events[0].position == first
+        assert events[-1].position == last
+        assert [event.position for event in events] == sorted(event.position for event in events)
+        assert [event.name for event in backend.read_all(first, limit=1)] == ['Cafe 1']
+        assert [event.event_stream_id for event in backend.read_all(event_types=[EmployeeHired.get_event_type()])] \
+            == [restaurants[1].id, restaurants[2].id]
+        assert backend.read_all(last) == []
+
+    def test_services_on_the_backend(self, backend):
+        bobs = opened_restaurant()
+        bobs.apply(EmployeeHired('Sam', USER_ID, 2))
+        EventPersistenceService(backend=backend).save(bobs)
+        assert bobs.uncommitted_events == []
+
+        restored = Restaurant(bobs.id)
+        restored.replay(EventQueryService(backend).find_events_by_id(bobs.id))
+        assert restored.employees == ['Sam']
+        assert EventQueryService(backend).get_head_revision(bobs.id) == 2
+
+
+class TestSegmentLog:
+
+    def test_reopen_and_roll_over(self, tmp_path):
+        directory = str(tmp_path / 'events')
+        store = SegmentLogEventStore(directory, segment_size=1024)
+        menu_item = MenuItem()
+        menu_item.apply(MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, USER_ID, 1))
+        for revision in range(2, 101):
+            menu_item.apply(PriceChanged(1, USER_ID, revision))
+            if revision % 10 == 0:
+                append(store, menu_item)
+        store.close()
+        assert len(os.listdir(directory)) > 1
+
+        reopened = SegmentLogEventStore(directory, segment_size=1024)
+        assert reopened.head_revision(menu_item.id) == 100
+        assert list(reopened.stream_ids(MenuItem.aggregate_type)) == [menu_item.id]
+        restored = MenuItem(menu_item.id)
+        restored.replay(reopened.read_stream(menu_item.id))
+        assert restored.price_in_cents == 99
+        reopened.close()
+
+    def test_torn_appends_are_discarded(self, tmp_path):
+        directory = str(tmp_path / 'events')
+        store = SegmentLogEventStore(directory)
+        bobs, other = opened_restaurant(), opened_restaurant('The Testing Bar')
+        append(store, bobs)
+        append(store, other)
+        store.close()
+
+        # lose the end of the last append
+        path = os.path.join(directory, '00000000.segment')
+        with open(path, 'r+b') as segment:
+            segment.truncate(os.path.getsize(path) - 5)
+
+        reopened = SegmentLogEventStore(directory)
+        assert reopened.head_revision(bobs.id) == 1
+        assert reopened.head_revision(other.id) is None
+        other.revision = 0
+        other.apply(RestaurantOpened('The Testing Bar', 2017, '125 Test Street', USER_ID, 1))
+        append(reopened, other)
+        assert [event.position for event in reopened.read_all()] == [1, 2]
+        reopened.close()
+
+
+@mark.integration
+class TestGroupCommit:
+
+    def test_concurrent_saves_share_commits(self, transactional_db, test_users):
+        store = GroupCommitEventStore(flush_window=0.05)
+        service = EventPersistenceService(backend=store)
+        menu_items = []
+        for i in range(20):
+            menu_item = MenuItem()
+            menu_item.apply(MenuItemCreated('Item {}'.format(i), MenuItem.CATEGORY_DRINK, USER_ID, 1))
+            menu_item.apply(PriceChanged(100 + i, USER_ID, 2))
+            menu_items.append(menu_item)
+        threads = [threading.Thread(target=service.save, args=(menu_item,)) for menu_item in menu_items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.close()
+
+        assert store.commits < len(menu_items)
+        for i, menu_item in enumerate(menu_items):
+            assert menu_item.uncommitted_events == []
+            assert [event.revision for event in store.read_stream(menu_item.id)] == [1, 2]
+            assert store.read_stream(menu_item.id)[1].delta == 100 + i
+
+    def test_conflicts_only_fail_their_callers(self, transactional_db, test_users):
+        bobs = opened_restaurant()
+        append(DatabaseEventStore(), bobs)
+        stale = Restaurant(bobs.id)
+        stale.apply(RestaurantOpened('Stale Cafe', 2019, '123 Test Street', USER_ID, 1))
+        hired = Restaurant(bobs.id)
+        hired.revision = 1
+        hired.apply(EmployeeHired('Sam', USER_ID, 2))
+        # the same stream twice in a group: the second goes in the next group, where it conflicts
+        twice = Restaurant(bobs.id)
+        twice.revision = 1
+        twice.apply(EmployeeHired('Sally', USER_ID, 2))
+        others = [opened_restaurant('Cafe {}'.format(i)) for i in range(3)]
+
+        store = GroupCommitEventStore(flush_window=0.1)
+        results = {}
+
+        def save(name: str, entity: Restaurant) -> None:
+            try:
+                append(store, entity)
+                results[name] = 'committed'
+            except ConcurrencyConflict as e:
+                results[name] = e.event_stream_ids
+
+        threads = [threading.Thread(target=save, args=(name, entity)) for name, entity in
+                   [('stale', stale), ('hired', hired), ('twice', twice)] +
+                   [('other {}'.format(i), other) for i, other in enumerate(others)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.close()
+
+        assert results.pop('stale') == [bobs.id]
+        assert sorted([results.pop('hired'), results.pop('twice')], key=str) == [[bobs.id], 'committed']
+        assert results == {'other {}'.format(i): 'committed' for i in range(3)}
+        assert store.head_revision(bobs.id) == 2
+        assert all(store.head_revision(other.id) == 1 for other in others)
+        with pytest.raises(ValueError):
+            append(store, opened_restaurant())
@@ -0,0 +1,74 @@
+from pytest import mark
+
+from restaurant.events.restaurant import EmployeeHired, MenuItemAdded
+from restaurant.projections.entities import Restaurant, MenuItem
+from restaurant.services.cache import EntityCache, get_entity_cache
+from restaurant.services.entities import RestaurantService
+
+
+class TestEntityCache:
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = EntityCache(max_entries=2)
+        first, second, third = Restaurant(), Restaurant(), Restaurant()
+        cache.put(first)
+        cache.put(second)
+        assert cache.get(first.id) is not None
+        cache.put(third)
+
+        assert cache.get(second.id) is None
+        assert cache.get(first.id) is not None
+        assert cache.get(third.id) is not None
+        assert cache.stats() == {'entries': 2, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+    def test_copy_on_read(self):
+        cache = EntityCache()
+        restaurant = Restaurant()
+        cache.put(restaurant)
+        restaurant.employees.append('Sam')
+
+        cached = cache.get(restaurant.id)
+        assert cached.employees == []
+        cached.apply(EmployeeHired('Sally', 100, 1))
+        assert cache.get(restaurant.id).employees == []
+        assert cache.get(restaurant.id).revision == 0
+
+    def test_only_event_derived_state_is_cached(self):
+        cache = EntityCache()
+        restaurant = Restaurant()
+        menu_item = MenuItem()
+        restaurant.apply(MenuItemAdded(menu_item.id, 100, 1))
+        restaurant.menu_items = [menu_item]
+        cache.put(restaurant)
+
+        cached = cache.get(restaurant.id)
+        assert cached.menu_item_ids == [menu_item.id]
+        assert cached.menu_items == []
+        assert cached.uncommitted_events == []
+        assert cached.revision == 1
+
+
+@mark.integration
+class TestCachedLoading:
+
+    def test_hits_only_fetch_the_tail(self, transactional_db, test_users, django_assert_num_queries):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        service.hire_employees(test_users[0], bobs, ['Sam', 'Sally'])
+
+        with django_assert_num_queries(1):
+            cached = service.get_current(bobs.id)
+        assert cached.employees == ['Sam', 'Sally']
+        assert cached is not bobs
+
+        # appended by another process, without going through this cache
+        other = RestaurantService(use_cache=False)
+        stale = other.get_current(bobs.id)
+        other.fire_employee(test_users[0], stale, 'Sam')
+
+        hits = get_entity_cache(Restaurant.aggregate_type).hits
+        with django_assert_num_queries(1):
+            refreshed = service.get_current(bobs.id)
+        assert get_entity_cache(Restaurant.aggregate_type).hits == hits + 1
+        assert refreshed.revision == 4
+        assert refreshed.employees == ['Sally']
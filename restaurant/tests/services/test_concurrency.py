@@ -0,0 +1,139 @@
+import pytest
+from pytest import mark
+
+from restaurant.events.restaurant import EmployeeHired
+from restaurant.models import Event
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.events import EventPersistenceService, ConcurrencyConflict
+
+
+@mark.integration
+class TestOptimisticConcurrency:
+
+    def test_stale_append_raises_conflict(self, transactional_db, test_users):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        first, second = service.get_current(bobs.id), service.get_current(bobs.id)
+
+        first.apply(EmployeeHired('Sam', test_users[0].id, 2))
+        EventPersistenceService().save(first, expected_revision=1)
+        second.apply(EmployeeHired('Sally', test_users[0].id, 2))
+        with pytest.raises(ConcurrencyConflict) as conflict:
+            EventPersistenceService().save(second, expected_revision=1)
+
+        assert conflict.value.event_stream_ids == [bobs.id]
+        assert len(second.uncommitted_events) == 1
+        assert Event.objects.filter(event_stream_id=bobs.id).count() == 2
+
+    def test_stale_expected_revision_raises_conflict(self, transactional_db, test_users):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        # e.g. the revision of an ETag, seen before someone else hired Sam
+        seen = 1
+        stale = RestaurantService(use_cache=False).get_current(bobs.id)
+        service.hire_employees(test_users[0], bobs, ['Sam'])
+
+        latest = service.get_current(bobs.id)
+        latest.apply(EmployeeHired('Sally', test_users[0].id, 3))
+        with pytest.raises(ConcurrencyConflict) as conflict:
+            EventPersistenceService().save(latest, expected_revision=seen)
+        assert conflict.value.event_stream_ids == [bobs.id]
+
+        # expecting the current revision, with an entity loaded before it
+        stale.apply(EmployeeHired('Mark', test_users[0].id, 2))
+        with pytest.raises(ConcurrencyConflict):
+            EventPersistenceService().save(stale, expected_revision=2)
+
+        EventPersistenceService().save(latest, expected_revision=2)
+        assert Event.objects.filter(event_stream_id=bobs.id).count() == 3
+
+    def test_commands_retry_against_the_latest_state(self, transactional_db, test_users):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        first, second = service.get_current(bobs.id), service.get_current(bobs.id)
+
+        service.hire_employees(test_users[0], first, ['Sam'])
+        service.hire_employees(test_users[1], second, ['Sally', 'Mark'])
+
+        assert second.revision == 4
+        assert second.employees == ['Sam', 'Sally', 'Mark']
+        assert len(second.uncommitted_events) == 0
+        assert list(Event.objects.filter(event_stream_id=bobs.id).order_by('revision')
+                    .values_list('revision', flat=True)) == [1, 2, 3, 4]
+        assert service.get_current(bobs.id).employees == ['Sam', 'Sally', 'Mark']
+
+    def test_retried_commands_are_validated_again(self, transactional_db, test_users):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        service.hire_employees(test_users[0], bobs, ['Sam'])
+        first, second = service.get_current(bobs.id), service.get_current(bobs.id)
+
+        service.fire_employee(test_users[0], first, 'Sam')
+        with pytest.raises(ValueError):
+            service.fire_employee(test_users[1], second, 'Sam')
+        assert Event.objects.filter(event_stream_id=bobs.id).count() == 3
+
+    def test_prices_are_recomputed_on_retry(self, transactional_db, test_users):
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        stale = service.get_current(coffee.id)
+
+        service.set_price(test_users[0], coffee, 300)
+        service.set_price(test_users[0], stale, 275)
+        assert service.get_current(coffee.id).price_in_cents == 275
+
+    def test_retries_are_bounded(self, transactional_db, test_users):
+        service = RestaurantService()
+        service.max_retries = 0
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        stale = service.get_current(bobs.id)
+        service.hire_employees(test_users[0], bobs, ['Sam'])
+        with pytest.raises(ConcurrencyConflict):
+            service.hire_employees(test_users[0], stale, ['Sally'])
+
+    def _restaurant_with_menu(self, test_users) -> tuple:
+        menu_item_service = MenuItemService()
+        coffee = menu_item_service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        tea = menu_item_service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        service.add_items_to_menu(test_users[0], bobs, [coffee, tea])
+        first, second = service.get_current(bobs.id), service.get_current(bobs.id)
+        service.load_associated_many([first, second])
+        return service, first, second, coffee, tea
+
+    def test_menu_additions_are_retried(self, transactional_db, test_users):
+        service, first, second, coffee, tea = self._restaurant_with_menu(test_users)
+        cake = MenuItemService().create_menu_item(test_users[0], 'Cake', MenuItem.CATEGORY_DESSERT, 400)
+
+        service.remove_items_from_menu(test_users[0], first, [tea])
+        service.add_items_to_menu(test_users[1], second, [cake])
+
+        assert second.revision == 5
+        assert second.menu_item_ids == [coffee.id, cake.id]
+        assert [item.id for item in second.menu_items] == [coffee.id, cake.id]
+        assert len(second.uncommitted_events) == 0
+        assert service.get_current(second.id).menu_item_ids == [coffee.id, cake.id]
+
+    def test_menu_removals_are_retried(self, transactional_db, test_users):
+        service, first, second, coffee, tea = self._restaurant_with_menu(test_users)
+
+        service.remove_items_from_menu(test_users[0], first, [tea])
+        service.remove_items_from_menu(test_users[1], second, [coffee])
+
+        assert second.revision == 5
+        assert second.menu_item_ids == []
+        assert second.menu_items == []
+        assert service.get_current(second.id).menu_item_ids == []
+
+    def test_failed_commands_leave_the_entity_as_loaded(self, transactional_db, test_users):
+        service, first, second, coffee, tea = self._restaurant_with_menu(test_users)
+        service.max_retries = 0
+
+        service.remove_items_from_menu(test_users[0], first, [tea])
+        with pytest.raises(ConcurrencyConflict):
+            service.remove_items_from_menu(test_users[1], second, [coffee])
+        assert second.revision == 3
+        assert second.menu_item_ids == [coffee.id, tea.id]
+        assert second.uncommitted_events == []
@@ -1,15 +1,21 @@
+from datetime import datetime, timedelta
+
 import pytest
 from pytest import mark
 
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged
 from restaurant.projections.entities import MenuItem
+from restaurant.services.backends.database import DatabaseEventStore
 from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.events import EventQueryService, EventPersistenceService
+from restaurant.services.loaders import BatchLoader
 
 
 @mark.integration
 class TestRestaurantService:
 
-    def test_restaurant_commands(self, transactional_db, test_users):
-        service = RestaurantService()
+    def test_restaurant_commands(self, entity_store, test_users):
+        service = RestaurantService(**entity_store)
         bobs = service.open_restaurant(test_users[0], 'Bob\'s Coffee Shop', '123 Test Street')
         service.hire_employees(test_users[0], bobs, ['Sam', 'Mark', 'Alice'])
 
@@ -29,9 +35,9 @@ class TestRestaurantService:
         assert 'Mark' in bobs.employees
 
 
-    def test_menu(self, transactional_db, test_users):
-        service = RestaurantService()
-        menu_item_service = MenuItemService()
+    def test_menu(self, entity_store, test_users):
+        service = RestaurantService(**entity_store)
+        menu_item_service = MenuItemService(**entity_store)
         coffee_shop = service.open_restaurant(test_users[0], 'The Corner Shop', '123 Test Street')
         service.hire_employees(test_users[0], coffee_shop, ['Sam', 'Sally'])
 
@@ -47,11 +53,45 @@ class TestRestaurantService:
         assert len(refreshed.menu_items) == 2
 
 
+    def test_load_associated_many(self, entity_store, test_users, assert_backend_queries):
+        service = RestaurantService(**entity_store)
+        menu_item_service = MenuItemService(**entity_store)
+        items = [menu_item_service.create_menu_item(test_users[0], 'Item {}'.format(i), MenuItem.CATEGORY_DRINK, 100)
+                 for i in range(4)]
+        restaurants = []
+        for i in range(6):
+            restaurant = service.open_restaurant(test_users[0], 'Cafe {}'.format(i), '123 Test Street')
+            service.add_items_to_menu(test_users[0], restaurant, items[i % 2:i % 2 + 3])
+            restaurants.append(restaurant)
+        restaurants = service.get_multiple_current([restaurant.id for restaurant in restaurants])
+        # a menu item which was never saved is left out, as by load_associated
+        missing = MenuItem()
+        restaurants[0].menu_item_ids.append(missing.id)
+
+        with assert_backend_queries(1):
+            service.load_associated_many(restaurants)
+        for restaurant in restaurants:
+            assert [item.id for item in restaurant.menu_items] == \
+                [menu_item_id for menu_item_id in restaurant.menu_item_ids if menu_item_id != missing.id]
+            assert all(item.revision == 2 for item in restaurant.menu_items)
+        # menu items on several menus are loaded once
+        assert restaurants[0].menu_items[1] is restaurants[1].menu_items[0] is restaurants[2].menu_items[1]
+
+        loader = BatchLoader(menu_item_service.stream_multiple_current)
+        service.load_associated_many(restaurants[:1], loader)
+        with assert_backend_queries(0):
+            service.load_associated_many(restaurants[2:3], loader)
+        with assert_backend_queries(1):
+            loaded = loader.load_many([items[3].id, missing.id, items[0].id])
+        assert [item.id for item in loaded] == [items[3].id, items[0].id]
+        assert loaded[1] is restaurants[0].menu_items[0]
+
+
 @mark.integration
 class TestMenuItemService:
 
-    def test_menu_item(self, transactional_db, test_users):
-        service = MenuItemService()
+    def test_menu_item(self, entity_store, test_users):
+        service = MenuItemService(**entity_store)
         lasagna = service.create_menu_item(test_users[0], 'House Special: Lasagna', MenuItem.CATEGORY_ENTREE, 1499)
         cola = service.create_menu_item(test_users[0], 'Coca Cola - L', MenuItem.CATEGORY_DRINK, 299)
 
@@ -80,5 +120,71 @@ class TestMenuItemService:
         assert items[1].category == MenuItem.CATEGORY_DRINK
         assert items[1].price_in_cents == 275
 
-
-
+    def test_stream_multiple_current(self, entity_store, test_users):
+        service = MenuItemService(**entity_store)
+        items = [service.create_menu_item(test_users[0], 'Item {}'.format(i), MenuItem.CATEGORY_DRINK, 100 + i)
+                 for i in range(5)]
+        for item in items:
+            service.set_price(test_users[0], item, item.price_in_cents * 2)
+
+        streamed = {item.id: item for item in service.stream_multiple_current([item.id for item in items])}
+        assert len(streamed) == 5
+        for item in items:
+            assert streamed[item.id].revision == 3
+            assert streamed[item.id].name == item.name
+            assert streamed[item.id].price_in_cents == item.price_in_cents
+
+    def test_stream_events_spans_chunks(self, transactional_db, test_users):
+        service = MenuItemService()
+        items = [service.create_menu_item(test_users[0], 'Item {}'.format(i), MenuItem.CATEGORY_DRINK, 100)
+                 for i in range(3)]
+
+        events = list(EventQueryService(DatabaseEventStore(chunk_size=2))
+                      .stream_events_for_id_in([item.id for item in items]))
+        assert len(events) == 6
+        keys = [(event.event_stream_id, event.revision) for event in events]
+        assert keys == sorted(keys)
+
+    def test_reduced_fields_match_replay(self, backend, entity_store, test_users, assert_backend_queries):
+        service = MenuItemService(use_cache=False, **entity_store)
+        items = [service.create_menu_item(test_users[0], 'Item {}'.format(i), MenuItem.CATEGORY_DRINK, 100 + i)
+                 for i in range(5)]
+        for item in items[:3]:
+            service.set_price(test_users[0], item, item.price_in_cents * 3)
+        # no price change at all: the price the entity starts with
+        unpriced = MenuItem()
+        unpriced.apply(MenuItemCreated('Water', MenuItem.CATEGORY_DRINK, test_users[0].id, 1))
+        EventPersistenceService(backend=backend).save(unpriced)
+        bobs = RestaurantService(**entity_store).open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street', 2018)
+
+        ids = [item.id for item in items] + [unpriced.id, bobs.id, MenuItem().id]
+        with assert_backend_queries(1):
+            reduced = service.get_reduced_fields(ids)
+        replayed = service.get_multiple_current(ids[:6])
+        assert set(reduced) == {item.id for item in replayed}
+        for item in replayed:
+            assert reduced[item.id] == {'name': item.name, 'category': item.category,
+                                        'price_in_cents': item.price_in_cents}
+        assert reduced[unpriced.id]['price_in_cents'] == 0
+
+        assert service.get_reduced_fields(ids[:2], ['price_in_cents']) == \
+            {items[0].id: {'price_in_cents': 300}, items[1].id: {'price_in_cents': 303}}
+        assert RestaurantService(**entity_store).get_reduced_fields(ids) == \
+            {bobs.id: {'name': 'Bob\'s Cafe', 'year_opened': 2018, 'address': '123 Test Street'}}
+        with pytest.raises(ValueError):
+            service.get_reduced_fields(ids, ['revision'])
+
+    def test_reduced_fields_as_of(self, backend, entity_store, test_users):
+        start = datetime(2019, 1, 1)
+        coffee = MenuItem()
+        coffee.apply(MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, test_users[0].id, 1, start))
+        for revision in range(2, 6):
+            coffee.apply(PriceChanged(100, test_users[0].id, revision, start + timedelta(days=revision)))
+        EventPersistenceService(backend=backend).save(coffee)
+
+        service = MenuItemService(**entity_store)
+        assert service.get_reduced_fields([coffee.id], time=start - timedelta(days=1)) == {}
+        for day in range(7):
+            as_of = start + timedelta(days=day)
+            assert service.get_reduced_fields([coffee.id], ['price_in_cents'], as_of)[coffee.id]['price_in_cents'] \
+                == service.get_as_of(coffee.id, as_of).price_in_cents
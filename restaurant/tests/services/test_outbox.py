@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from django.core.management import call_command
+from django.db import transaction
+from pytest import fixture, mark
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged
+from restaurant.models import OutboxEntry
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import MenuItemService
+from restaurant.services.outbox import side_effect, remove_side_effect, OutboxWorker
+
+
+@fixture
+def side_effects():
+    """Registers test side effects, named as given, and removes them again afterwards"""
+    names = []
+
+    def register(name: str, *event_classes: type, concurrency: int=1):
+        names.append(name)
+        return side_effect(*event_classes, name=name, concurrency=concurrency)
+    yield register
+    for name in names:
+        remove_side_effect(name)
+
+
+@mark.integration
+class TestOutbox:
+
+    def test_side_effects_run_once_saved(self, transactional_db, test_users, side_effects):
+        seen = []
+        side_effects('announce', MenuItemCreated)(lambda event: seen.append((event.name, event.event_stream_id)))
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        # written in the same transaction as the events: nothing for a save rolled back
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+                raise ValueError()
+        service.set_price(test_users[0], coffee, 275)
+
+        assert OutboxEntry.objects.count() == 1
+        assert seen == []
+        assert OutboxWorker().run() == 1
+        assert seen == [('Coffee', coffee.id)]
+        entry = OutboxEntry.objects.get()
+        assert entry.completed_at is not None and entry.attempts == 1
+        assert OutboxWorker().run() == 0
+
+    def test_failures_are_retried_then_given_up(self, transactional_db, test_users, side_effects):
+        attempts = []
+
+        def flaky(event):
+            attempts.append(event.delta)
+            if event.delta < 0 or len(attempts) == 1:
+                raise RuntimeError('Mail server down')
+        side_effects('flaky', PriceChanged)(flaky)
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        service.set_price(test_users[0], coffee, 200)
+
+        assert OutboxWorker(max_attempts=3, retry_delay=0).run() == 5
+        assert sorted(attempts) == [-50, -50, -50, 250, 250]
+        succeeded = OutboxEntry.objects.get(event__revision=2)
+        assert succeeded.completed_at is not None and succeeded.attempts == 2 and succeeded.last_error == ''
+        failed = OutboxEntry.objects.get(event__revision=3)
+        assert failed.completed_at is None and failed.gave_up_at is not None and failed.attempts == 3
+        assert 'Mail server down' in failed.last_error
+
+    def test_claims_and_concurrency_limits(self, transactional_db, test_users, side_effects):
+        running, most = [0], [0]
+        lock = threading.Lock()
+
+        def slow(event):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+        side_effects('slow', MenuItemCreated, concurrency=2)(slow)
+        service = MenuItemService()
+        for i in range(8):
+            service.create_menu_item(test_users[0], 'Item {}'.format(i), MenuItem.CATEGORY_DRINK, 100)
+
+        first, second = OutboxWorker(batch_size=3).claim(), OutboxWorker(batch_size=3).claim()
+        assert len(first) == len(second) == 3
+        assert not {entry.id for entry in first} & {entry.id for entry in second}
+        # the claimed entries are leased, the rest are run straight away
+        assert OutboxWorker(workers=8).run() == 2
+        OutboxEntry.objects.update(available_at=OutboxEntry.objects.get(id=first[0].id).created_at)
+        assert OutboxWorker(workers=8).run() == 6
+        assert most[0] == 2
+        assert OutboxEntry.objects.filter(completed_at__isnull=True).count() == 0
+
+    def test_command(self, transactional_db, test_users, side_effects, capsys):
+        seen = []
+        side_effects('announce', MenuItemCreated)(lambda event: seen.append(event.name))
+        side_effects('other', MenuItemCreated)(lambda event: None)
+        MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        call_command('run_side_effects', 'announce')
+        assert seen == ['Coffee']
+        assert 'Ran 1 side effects' in capsys.readouterr().out
+        assert OutboxEntry.objects.filter(handler='other', completed_at__isnull=True).count() == 1
@@ -0,0 +1,84 @@
+from django.core.management import call_command
+from pytest import mark
+
+from restaurant.models import Snapshot
+from restaurant.projections.entities import Restaurant, MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.snapshots import SnapshotPolicy
+
+
+class TestSnapshotState:
+
+    def test_restaurant_round_trip(self):
+        restaurant = Restaurant()
+        restaurant.name = 'Bob\'s Cafe'
+        restaurant.year_opened = 2019
+        restaurant.employees = ['Sam', 'Sally']
+        restaurant.menu_item_ids = [MenuItem().id]
+
+        restored = Restaurant(restaurant.id)
+        restored.restore_snapshot_state(restaurant.snapshot_state())
+        assert restored.snapshot_state() == restaurant.snapshot_state()
+        assert restored.menu_item_ids == restaurant.menu_item_ids
+
+    def test_policy(self):
+        policy = SnapshotPolicy(every_n_revisions=10, replay_threshold=25)
+        assert policy.should_snapshot(0, 10) is True
+        assert policy.should_snapshot(8, 12) is True
+        assert policy.should_snapshot(10, 19) is False
+        assert policy.should_snapshot(10, 19, replayed=25) is True
+        assert SnapshotPolicy().should_snapshot(0, 1000, 1000) is False
+
+    def test_version_is_stable_and_per_entity(self):
+        assert Restaurant.snapshot_version() == Restaurant.snapshot_version()
+        assert Restaurant.snapshot_version() != MenuItem.snapshot_version()
+
+
+@mark.integration
+class TestSnapshotLoading:
+
+    def test_commands_snapshot_every_n_revisions(self, transactional_db, test_users):
+        service = MenuItemService(SnapshotPolicy(every_n_revisions=5))
+        soup = service.create_menu_item(test_users[0], 'Soup', MenuItem.CATEGORY_APPETIZER, 500)
+        for price in range(501, 510):
+            service.set_price(test_users[0], soup, price)
+
+        assert list(Snapshot.objects.filter(event_stream_id=soup.id).values_list('revision', flat=True)
+                    .order_by('revision')) == [5, 10]
+        restored = service.get_current(soup.id)
+        assert restored.revision == 11
+        assert restored.price_in_cents == 509
+        assert restored.name == 'Soup'
+
+    def test_load_replays_only_the_tail(self, transactional_db, test_users):
+        service = RestaurantService(SnapshotPolicy(replay_threshold=3), use_cache=False)
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        service.hire_employees(test_users[0], bobs, ['Sam', 'Sally', 'Mark'])
+        assert Snapshot.objects.filter(event_stream_id=bobs.id).count() == 0
+
+        # loading replays 4 events, which is over the threshold
+        assert service.get_current(bobs.id).revision == 4
+        snapshot = Snapshot.objects.get(event_stream_id=bobs.id)
+        assert snapshot.revision == 4
+        assert snapshot.type == Restaurant.aggregate_type
+
+        service.fire_employee(test_users[0], bobs, 'Sam')
+        restored = service.get_current(bobs.id)
+        assert restored.revision == 5
+        assert restored.employees == ['Sally', 'Mark']
+
+    def test_stale_snapshots_are_ignored(self, transactional_db, test_users):
+        service = RestaurantService(SnapshotPolicy(), use_cache=False)
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        service.take_snapshot(bobs.id)
+        snapshot = Snapshot.objects.get(event_stream_id=bobs.id)
+        # pretend the snapshot was written before the event handlers changed
+        snapshot.version = 'outdated'
+        snapshot.data['name'] = 'Not Bob\'s'
+        snapshot.save()
+
+        assert service.get_current(bobs.id).name == 'Bob\'s Cafe'
+
+        call_command('backfill_snapshots', '--purge-stale')
+        assert list(Snapshot.objects.filter(event_stream_id=bobs.id).values_list('version', flat=True)) == \
+            [Restaurant.snapshot_version()]
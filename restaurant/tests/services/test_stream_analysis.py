@@ -0,0 +1,92 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from pytest import mark
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged
+from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded, \
+    MenuItemRemoved
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.snapshots import SnapshotPolicy
+from restaurant.services.stream_analysis import StreamAnalysisService, ReplayCost, profile_replay_costs
+
+
+class TestReplayCostProfiler:
+
+    def test_profiles_every_handled_event_type(self):
+        costs = profile_replay_costs(samples=50, repeat=1)
+        assert set(costs) == {event_class.get_event_type() for event_class in (
+            RestaurantOpened, EmployeeHired, EmployeeFired, MenuItemAdded, MenuItemRemoved, MenuItemCreated,
+            PriceChanged)}
+        assert costs['menuitem.price.changed'].aggregate_type == MenuItem.aggregate_type
+        assert all(cost.decode_seconds > 0 and cost.apply_seconds > 0 for cost in costs.values())
+
+
+@mark.integration
+class TestStreamAnalysis:
+
+    @staticmethod
+    def _costs() -> dict:
+        # employee events are not costed, so count as the mean: 4 microseconds
+        return {event_type: ReplayCost(event_type, aggregate_type, seconds, 0.0) for event_type, aggregate_type, seconds
+                in (('menuitem.created', 'menuitem', 1e-6), ('menuitem.price.changed', 'menuitem', 1e-6),
+                    ('restaurant.opened', 'restaurant', 10e-6))}
+
+    def _populate(self, test_users) -> tuple:
+        restaurant_service = RestaurantService(SnapshotPolicy())
+        menu_item_service = MenuItemService(SnapshotPolicy())
+        bobs = restaurant_service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        restaurant_service.hire_employees(test_users[0], bobs, ['Sam', 'Sally', 'Mark'])
+        coffee = menu_item_service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        for price in range(251, 255):
+            menu_item_service.set_price(test_users[0], coffee, price)
+        tea = menu_item_service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+        menu_item_service.take_snapshot(coffee.id)
+        return bobs, coffee, tea
+
+    def test_report(self, transactional_db, test_users):
+        bobs, coffee, tea = self._populate(test_users)
+        report = StreamAnalysisService(self._costs()).analyze(top=2, window=timedelta(days=1))
+
+        assert report['stream_lengths'] == [
+            {'aggregate_type': 'menuitem', 'streams': 2, 'events': 8, 'mean': 4.0, 'p50': 2, 'p90': 6, 'p99': 6,
+             'max': 6},
+            {'aggregate_type': 'restaurant', 'streams': 1, 'events': 4, 'mean': 4.0, 'p50': 4, 'p90': 4, 'p99': 4,
+             'max': 4},
+        ]
+        assert [(mix['aggregate_type'], mix['event_type'], mix['events']) for mix in report['event_types']] == [
+            ('menuitem', 'menuitem.price.changed', 6), ('menuitem', 'menuitem.created', 2),
+            ('restaurant', 'restaurant.employee.hired', 3), ('restaurant', 'restaurant.opened', 1)]
+        assert report['event_types'][0]['share'] == 6 / 8
+
+        hot = report['hot_streams']['streams']
+        assert [(stream['event_stream_id'], stream['events']) for stream in hot] == [(str(coffee.id), 6),
+                                                                                    (str(bobs.id), 4)]
+        assert hot[0]['events_per_day'] == 6
+
+        costliest = report['costliest_streams']
+        assert [stream['event_stream_id'] for stream in costliest] == [str(bobs.id), str(coffee.id)]
+        assert abs(costliest[0]['replay_ms'] - 0.022) < 1e-9
+        assert costliest[0]['events_per_load'] == 4
+        assert costliest[0]['load_ms'] == costliest[0]['replay_ms']
+        # loads restore the snapshot, and have nothing left to replay
+        assert costliest[1]['snapshot_revision'] == 6
+        assert costliest[1]['events_per_load'] == 0
+        assert costliest[1]['load_ms'] == 0
+        json.dumps(report)
+
+    def test_command(self, transactional_db, test_users):
+        bobs, _, _ = self._populate(test_users)
+        output = StringIO()
+        call_command('analyze_streams', '--json', '--top', '1', '--samples', '10', stdout=output)
+        report = json.loads(output.getvalue())
+        assert report['costliest_streams'][0]['aggregate_type'] in ('menuitem', 'restaurant')
+        assert len(report['hot_streams']['streams']) == 1
+
+        output = StringIO()
+        call_command('analyze_streams', '--samples', '10', stdout=output)
+        assert 'Costliest streams to replay' in output.getvalue()
+        assert str(bobs.id) in output.getvalue()
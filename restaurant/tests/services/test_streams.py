@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+
+import pytest
+from pytest import mark
+
+from restaurant.events.restaurant import EmployeeHired, RestaurantOpened
+from restaurant.models import Event, Stream
+from restaurant.projections.entities import MenuItem, Restaurant
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.events import EventPersistenceService, EventQueryService, ConcurrencyConflict
+
+
+@mark.integration
+class TestStreamCatalog:
+
+    def test_appends_maintain_the_catalog(self, transactional_db, test_users):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        bobs.apply(EmployeeHired('Sam', test_users[0].id, 2, datetime(2019, 1, 1)))
+        bobs.apply(EmployeeHired('Sally', test_users[0].id, 3))
+        EventPersistenceService().save(bobs)
+
+        stream = Stream.objects.get(id=bobs.id)
+        assert stream.type == Restaurant.aggregate_type
+        assert stream.head_revision == 3
+        assert stream.event_count == 3
+        assert stream.first_event_time == datetime(2019, 1, 1, tzinfo=timezone.utc)
+        assert stream.last_event_time == Event.objects.get(event_stream_id=bobs.id, revision=3).time
+        assert EventQueryService().get_head_revision(bobs.id) == 3
+        assert EventQueryService().get_head_revision(MenuItem().id) is None
+
+    def test_catalog_guards_appends(self, transactional_db, test_users):
+        service = RestaurantService(use_cache=False)
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        first, second = service.get_current(bobs.id), service.get_current(bobs.id)
+        first.apply(EmployeeHired('Sam', test_users[0].id, 2))
+        second.apply(EmployeeHired('Sally', test_users[0].id, 2))
+        EventPersistenceService().save(first)
+        other = Restaurant()
+        other.apply(RestaurantOpened('The Testing Bar', 2017, '125 Test Street', test_users[0].id, 1))
+
+        # the stale stream is caught before any event is inserted, and nothing else is saved
+        with pytest.raises(ConcurrencyConflict) as conflict:
+            EventPersistenceService().save_many([second, other])
+        assert conflict.value.event_stream_ids == [bobs.id]
+        assert Stream.objects.get(id=bobs.id).head_revision == 2
+        assert Event.objects.filter(event_stream_id=bobs.id).count() == 2
+        assert not Stream.objects.filter(id=other.id).exists()
+
+    def test_lookups_by_type(self, transactional_db, test_users):
+        restaurant_service = RestaurantService()
+        bobs = restaurant_service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        coffee = MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+
+        assert list(restaurant_service.list_ids()) == [bobs.id]
+        assert list(MenuItemService().list_ids()) == [coffee.id]
+        assert restaurant_service._restaurant_exists(bobs.id)
+        assert not restaurant_service._restaurant_exists(coffee.id)
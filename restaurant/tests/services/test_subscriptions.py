@@ -0,0 +1,97 @@
+import threading
+import time
+
+from django.db import connection, transaction
+from pytest import mark
+
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.subscriptions import EventSubscription
+
+
+@mark.integration
+class TestEventSubscription:
+
+    def test_catch_up_in_global_order(self, transactional_db, test_users):
+        restaurant_service = RestaurantService()
+        bobs = restaurant_service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        restaurant_service.hire_employees(test_users[0], bobs, ['Sam', 'Sally'])
+
+        subscription = EventSubscription(batch_size=2)
+        events = [event for batch in subscription.batches(follow=False) for event in batch]
+        assert len(events) == 5
+        assert [event.position for event in events] == sorted(event.position for event in events)
+        assert subscription.position == events[-1].position
+
+        # resuming from a position only returns what follows it, filtered by type in the query
+        subscription = EventSubscription(events[1].position, ['restaurant.employee.hired'])
+        hired = [event for batch in subscription.batches(follow=False) for event in batch]
+        assert [event.employee_name for event in hired] == ['Sam', 'Sally']
+        assert subscription.position == events[-1].position
+
+    def test_follow_wakes_up_on_append(self, transactional_db, test_users):
+        service = RestaurantService()
+        bobs = service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+
+        def hire():
+            time.sleep(0.2)
+            service.hire_employees(test_users[0], bobs, ['Sam'])
+            connection.close()
+
+        writer = threading.Thread(target=hire)
+        writer.start()
+        subscription = EventSubscription(min_poll_interval=10, max_poll_interval=10)
+        started = time.monotonic()
+        received = []
+        for event in subscription:
+            received.append(event)
+            if len(received) == 2:
+                break
+        writer.join()
+
+        assert received[1].employee_name == 'Sam'
+        # woken up by the notification rather than by the (10 second) fallback poll
+        assert time.monotonic() - started < 5
+
+    def test_waits_for_open_writers_below_a_gap(self, transactional_db, test_users):
+        service = MenuItemService(use_cache=False)
+        inserted, release = threading.Event(), threading.Event()
+
+        def slow_save():
+            try:
+                with transaction.atomic():
+                    service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+                    inserted.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        writer = threading.Thread(target=slow_save)
+        writer.start()
+        inserted.wait(10)
+        # committed after the ids drawn by the open transaction
+        service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+
+        subscription = EventSubscription()
+        assert [event for batch in subscription.batches(follow=False) for event in batch] == []
+        assert subscription.position == 0
+
+        release.set()
+        writer.join()
+        events = [event for batch in subscription.batches(follow=False) for event in batch]
+        assert [event.name for event in events if hasattr(event, 'name')] == ['Tea', 'Coffee']
+
+    def test_passes_rolled_back_gaps(self, transactional_db, test_users):
+        service = MenuItemService(use_cache=False)
+        try:
+            with transaction.atomic():
+                service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+                raise ValueError()
+        except ValueError:
+            pass
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+
+        subscription = EventSubscription()
+        events = [event for batch in subscription.batches(follow=False) for event in batch]
+        assert [event.event_stream_id for event in events] == [coffee.id, coffee.id]
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+from pytest import mark
+
+from restaurant.events.menu_item import MenuItemCreated, PriceChanged
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import MenuItemService
+from restaurant.services.events import EventPersistenceService
+
+
+def price_history(user_id: int, start: datetime) -> MenuItem:
+    menu_item = MenuItem()
+    menu_item.apply(MenuItemCreated('Coffee', MenuItem.CATEGORY_DRINK, user_id, 1, start))
+    menu_item.apply(PriceChanged(200, user_id, 2, start))
+    menu_item.apply(PriceChanged(50, user_id, 3, start + timedelta(days=1)))
+    menu_item.apply(PriceChanged(-25, user_id, 4, start + timedelta(days=2)))
+    return menu_item
+
+
+@mark.integration
+class TestTimeTravel:
+
+    def test_as_of_event_time(self, transactional_db, test_users):
+        start = datetime(2019, 1, 1, 12)
+        coffee = price_history(test_users[0].id, start)
+        EventPersistenceService().save(coffee)
+        service = MenuItemService()
+
+        assert service.get_as_of(coffee.id, start - timedelta(hours=1)) is None
+        assert service.get_as_of(coffee.id, start).price_in_cents == 200
+        assert service.get_as_of(coffee.id, start + timedelta(days=1, hours=1)).price_in_cents == 250
+        assert service.get_as_of(coffee.id).price_in_cents == 225
+        assert service.get_current(coffee.id).price_in_cents == 225
+
+    def test_as_of_recorded_time(self, transactional_db, test_users):
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        recorded = timezone.now()
+        # a back dated correction, recorded after the fact
+        coffee.apply(PriceChanged(-50, test_users[0].id, 3, datetime.utcnow() - timedelta(days=30)))
+        EventPersistenceService().save(coffee)
+
+        assert service.get_as_of(coffee.id, recorded_at=recorded).price_in_cents == 250
+        assert service.get_as_of(coffee.id).price_in_cents == 200
+
+    def test_many_streams_at_many_points_in_one_query(self, transactional_db, test_users, django_assert_num_queries):
+        start = datetime(2019, 1, 1, 12)
+        coffee, tea = price_history(test_users[0].id, start), price_history(test_users[0].id, start + timedelta(days=1))
+        EventPersistenceService().save_many([coffee, tea])
+        points = [
+            (coffee.id, start),
+            (tea.id, start),
+            (coffee.id, start + timedelta(days=1)),
+            (tea.id, start + timedelta(days=1)),
+            (coffee.id, start + timedelta(days=10)),
+            (MenuItem().id, start),
+        ]
+
+        with django_assert_num_queries(1):
+            items = MenuItemService().get_multiple_as_of(points)
+
+        assert [item.price_in_cents if item is not None else None for item in items] == [200, None, 250, 200, 225, None]
+        assert items[2].id == coffee.id
+        assert items[3].id == tea.id
+
+        recorded = MenuItemService().get_multiple_as_of([(coffee.id, timezone.now())], field='created_at')
+        assert recorded[0].price_in_cents == 225
@@ -0,0 +1,93 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+from restaurant.events.base import get_event_class
+from restaurant.events.batch import EventBatch
+from restaurant.events.codecs import get_codec
+from restaurant.events.menu_item import PriceChanged
+from restaurant.events.restaurant import RestaurantOpened, MenuItemAdded, MenuItemRemoved, EmployeeHired
+
+
+class TestEventCodecs:
+
+    def test_round_trip(self):
+        event = RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', 100, 1)
+        codec = get_codec(RestaurantOpened.get_event_type())
+        data = codec.encode(event)
+        assert data == {'name': 'Bob\'s Cafe', 'year': 2019, 'location': '123 Test Street'}
+
+        stream_id = uuid.uuid4()
+        time = datetime(2019, 1, 20, 18, 49)
+        restored = codec.decode(data, stream_id, 100, 1, time, 42)
+        assert isinstance(restored, RestaurantOpened)
+        assert restored.name == 'Bob\'s Cafe'
+        assert restored.year == 2019
+        assert restored.location == '123 Test Street'
+        assert restored.event_stream_id == stream_id
+        assert restored.user_id == 100
+        assert restored.revision == 1
+        assert restored.timestamp == time
+        assert restored.position == 42
+        assert restored.first_observation is False
+
+    def test_uuids_are_coerced_without_touching_the_event(self):
+        menu_item_id = uuid.uuid4()
+        event = MenuItemAdded(menu_item_id, 100, 3)
+        codec = get_codec(MenuItemAdded.get_event_type())
+        data = codec.encode(event)
+        assert data == {'menu_item_id': str(menu_item_id)}
+        assert event.menu_item_id == menu_item_id
+        assert codec.decode(data, uuid.uuid4(), 100, 3, datetime.utcnow(), None).menu_item_id == menu_item_id
+
+    def test_nested_subclasses_are_registered(self):
+        assert get_event_class('restaurant.menuitem.removed') is MenuItemRemoved
+        assert get_event_class(PriceChanged.get_event_type()) is PriceChanged
+        removed = get_codec('restaurant.menuitem.removed').decode(
+            {'menu_item_id': str(uuid.uuid4())}, uuid.uuid4(), 100, 2, datetime.utcnow(), None)
+        assert type(removed) is MenuItemRemoved
+
+    def test_events_are_slotted_and_strings_interned(self):
+        assert not hasattr(EmployeeHired('Sam', 100, 1), '__dict__')
+        assert not hasattr(MenuItemRemoved(uuid.uuid4(), 100, 1), '__dict__')
+
+        codec = get_codec(EmployeeHired.get_event_type())
+        first, second = (codec.decode(json.loads('{"employee_name": "Sam"}'), uuid.uuid4(), 100, 1, None, None)
+                         for _ in range(2))
+        assert first.employee_name is second.employee_name
+
+    def test_lazy_decoding(self):
+        menu_item_id = uuid.uuid4()
+        codec = get_codec(MenuItemRemoved.get_event_type())
+        event = codec.decode_lazy(json.dumps({'menu_item_id': str(menu_item_id)}), uuid.uuid4(), 100, 2, None, 7)
+        assert isinstance(event, MenuItemRemoved)
+        assert event.get_event_type() == MenuItemRemoved.get_event_type()
+        assert (event.revision, event.position) == (2, 7)
+        # nothing is parsed until a field is read, and each field is decoded once
+        assert event._data is None
+        assert event.menu_item_id == menu_item_id
+        assert event.menu_item_id is event.menu_item_id
+        assert not hasattr(event, '__dict__')
+        assert get_event_class(MenuItemRemoved.get_event_type()) is MenuItemRemoved
+
+
+class TestEventBatch:
+
+    def test_round_trip(self):
+        stream_id = uuid.uuid4()
+        menu_item_id = uuid.uuid4()
+        time = datetime(2019, 1, 20, 18, 49, 1, 123456, tzinfo=timezone.utc)
+        batch = EventBatch(stream_id)
+        batch.append(RestaurantOpened.get_event_type(), 1, 100, time, 7,
+                     {'name': 'Bob\'s Cafe', 'year': 2019, 'location': '123 Test Street'})
+        batch.append(MenuItemRemoved.get_event_type(), 2, 101, time, 9, {'menu_item_id': str(menu_item_id)})
+
+        assert len(batch) == 2
+        opened, removed = list(batch)
+        assert type(opened) is RestaurantOpened
+        assert (opened.name, opened.year, opened.location) == ('Bob\'s Cafe', 2019, '123 Test Street')
+        assert (opened.event_stream_id, opened.revision, opened.user_id, opened.position) == (stream_id, 1, 100, 7)
+        assert opened.timestamp == time
+        assert type(removed) is MenuItemRemoved
+        assert removed.menu_item_id == menu_item_id
+        assert (removed.revision, removed.user_id, removed.position) == (2, 101, 9)
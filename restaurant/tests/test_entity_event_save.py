@@ -1,4 +1,5 @@
-from pytest import mark
+from django.db import transaction
+from pytest import mark, raises
 
 from restaurant.events.restaurant import RestaurantOpened, EmployeeHired, EmployeeFired
 from restaurant.projections.entities import Restaurant
@@ -9,7 +10,7 @@ from restaurant.services.events import EventPersistenceService
 @mark.integration
 class TestEntityEventSave:
 
-    def test_basic_save_and_restore(self, transactional_db, test_users):
+    def test_basic_save_and_restore(self, backend, entity_store, test_users):
         restaurant = Restaurant()
         user_id = test_users[0].id
         # typically we don't operate with the events at this 'low' level, but rather have events be the outcome of some
@@ -20,16 +21,16 @@ class TestEntityEventSave:
         restaurant.apply(event)
         restaurant.apply(correction)
 
-        service = EventPersistenceService()
+        service = EventPersistenceService(backend=backend)
         service.save(restaurant)
 
-        restored_restaurant = RestaurantService().get_current(restaurant.id)
+        restored_restaurant = RestaurantService(**entity_store).get_current(restaurant.id)
 
         assert restored_restaurant.revision == 2
         assert restored_restaurant.name == 'Bob\'s Cafe'
         assert restored_restaurant.id == restaurant.id
 
-    def test_multiple_event_types(self, transactional_db, test_users):
+    def test_multiple_event_types(self, backend, entity_store, test_users):
         restaurant = Restaurant()
         user_id = test_users[0].id
         restaurant.apply(RestaurantOpened('Bobbie\'s super store', 2019, 'blah', user_id, 1))
@@ -38,10 +39,10 @@ class TestEntityEventSave:
         restaurant.apply(EmployeeHired('Carl', user_id, 4))
         restaurant.apply(EmployeeHired('Sally', user_id, 5))
         restaurant.apply(EmployeeFired('Carl', user_id, 6))
-        service = EventPersistenceService()
+        service = EventPersistenceService(backend=backend)
         service.save(restaurant)
 
-        restored_restaurant = RestaurantService().get_current(restaurant.id)
+        restored_restaurant = RestaurantService(**entity_store).get_current(restaurant.id)
         assert restored_restaurant.revision == 6
         assert restored_restaurant.name == 'Bob\'s Cafe'
         assert len(restored_restaurant.employees) == 2
@@ -49,7 +50,7 @@ class TestEntityEventSave:
         assert 'Jim Bob' in restored_restaurant.employees
         assert 'Sally' in restored_restaurant.employees
 
-    def test_multiple_entities(self, transactional_db, test_users):
+    def test_multiple_entities(self, backend, entity_store, test_users):
         restaurant_one = Restaurant()
         restaurant_two = Restaurant()
         user_id = test_users[0].id
@@ -61,10 +62,38 @@ class TestEntityEventSave:
         restaurant_two.apply(EmployeeHired('Carl', user_id, 2)) #oh no, same person at two restaurants!
         restaurant_two.apply(EmployeeHired('Sam', user_id, 3))
 
-        service = EventPersistenceService()
+        service = EventPersistenceService(backend=backend)
         service.save(restaurant_one)
         service.save(restaurant_two)
-        restaurants = RestaurantService().get_multiple_current([restaurant_one.id, restaurant_two.id])
+        restaurants = RestaurantService(**entity_store).get_multiple_current([restaurant_one.id, restaurant_two.id])
 
         assert len(restaurants) == 2
 
+
+    def test_save_many(self, backend, entity_store, test_users, assert_backend_queries):
+        restaurants = []
+        for i in range(50):
+            restaurant = Restaurant()
+            restaurant.apply(RestaurantOpened('Cafe {}'.format(i), 2019, 'Test Street', test_users[i % 2].id, 1))
+            restaurant.apply(EmployeeHired('Carl', test_users[0].id, 2))
+            restaurants.append(restaurant)
+
+        # the stream catalog upsert, one multi-row insert and the notification: no per-user or per-entity queries
+        with assert_backend_queries(3):
+            EventPersistenceService(backend=backend).save_many(restaurants)
+
+        assert all(len(restaurant.uncommitted_events) == 0 for restaurant in restaurants)
+        restored = RestaurantService(**entity_store).get_multiple_current([restaurant.id for restaurant in restaurants])
+        assert sorted(restaurant.name for restaurant in restored) == sorted(r.name for r in restaurants)
+
+    def test_save_many_keeps_events_until_commit(self, transactional_db, test_users):
+        restaurant = Restaurant()
+        restaurant.apply(RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', test_users[0].id, 1))
+
+        with raises(RuntimeError):
+            with transaction.atomic():
+                EventPersistenceService().save_many([restaurant])
+                raise RuntimeError('rolled back')
+
+        assert len(restaurant.uncommitted_events) == 1
+        assert RestaurantService().get_current(restaurant.id) is None
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management import call_command, CommandError
+from pytest import mark, raises
+
+from restaurant.models import Event, Stream
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
+
+
+def create_events(user):
+    restaurant_service = RestaurantService()
+    bobs = restaurant_service.open_restaurant(user, 'Bob\'s Cafe', '123 Test Street')
+    restaurant_service.hire_employees(user, bobs, ['Sam', 'Sally'])
+    coffee = MenuItemService().create_menu_item(user, 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+    restaurant_service.add_items_to_menu(user, bobs, [coffee])
+    return bobs, coffee
+
+
+@mark.integration
+class TestImportExport:
+
+    @mark.parametrize('file_name', ['events.ndjson', 'events.ndjson.gz', 'events.csv', 'events.csv.xz'])
+    def test_round_trip(self, transactional_db, test_users, tmp_path, file_name):
+        bobs, coffee = create_events(test_users[0])
+        path = str(tmp_path / file_name)
+        call_command('export_events', path)
+        Event.objects.all().delete()
+        Stream.objects.all().delete()
+
+        call_command('import_events', path)
+        assert Event.objects.count() == 6
+        assert sorted(Stream.objects.values_list('type', 'head_revision', 'event_count')) == \
+            [('menuitem', 2, 2), ('restaurant', 4, 4)]
+        restored = RestaurantService().get_current(bobs.id)
+        assert restored.employees == ['Sam', 'Sally']
+        assert restored.menu_item_ids == [coffee.id]
+        assert MenuItemService().get_current(coffee.id).price_in_cents == 250
+
+    def test_gaps_abort_the_import(self, transactional_db, test_users, tmp_path):
+        create_events(test_users[0])
+        path = tmp_path / 'events.ndjson'
+        call_command('export_events', str(path))
+        lines = path.read_text().splitlines()
+        Event.objects.all().delete()
+        Stream.objects.all().delete()
+
+        # drop the first hire of the restaurant, leaving a gap between revisions 1 and 3
+        documents = [json.loads(line) for line in lines]
+        path.write_text('\n'.join(json.dumps(document) for document in documents
+                                  if document['type'] != 'restaurant.employee.hired' or document['revision'] != 2))
+        with raises(CommandError):
+            call_command('import_events', str(path))
+        assert Event.objects.count() == 0
@@ -0,0 +1,88 @@
+from pytest import fixture, mark
+
+from restaurant import instrumentation
+from restaurant.instrumentation import PrometheusCollector
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import MenuItemService
+from restaurant.services.projections import ProjectionService
+from restaurant.projections.projectors import MenuItemProjector
+
+
+@fixture
+def collector():
+    collector = PrometheusCollector()
+    instrumentation.register_collector(collector)
+    yield collector
+    instrumentation.unregister_collector(collector)
+
+
+class TestPrometheusCollector:
+
+    def test_render(self):
+        collector = PrometheusCollector(prefix='test_')
+        collector.observe('query_seconds', 0.25)
+        collector.observe('query_seconds', 0.5)
+        collector.increment('cache_hits_total')
+        collector.increment('cache_hits_total', 2)
+        assert collector.summary('query_seconds') == (2, 0.75)
+        assert collector.render() == (
+            '# TYPE test_query_seconds summary\n'
+            'test_query_seconds_count 2\n'
+            'test_query_seconds_sum 0.75\n'
+            '# TYPE test_cache_hits_total counter\n'
+            'test_cache_hits_total 3\n'
+        )
+
+    def test_registration(self):
+        collector = PrometheusCollector()
+        assert not instrumentation.active
+        instrumentation.register_collector(collector)
+        instrumentation.register_collector(collector)
+        instrumentation.increment('rows_fetched_total')
+        instrumentation.unregister_collector(collector)
+        assert not instrumentation.active
+        instrumentation.increment('rows_fetched_total')
+        assert collector.total('rows_fetched_total') == 1
+
+
+@mark.integration
+class TestInstrumentedPaths:
+
+    def test_load_stages(self, transactional_db, test_users, collector):
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        service.set_price(test_users[0], coffee, 275)
+        assert collector.summary('save_seconds')[0] == 2
+        assert collector.total('events_saved_total') == 3
+
+        service._cache.invalidate(coffee.id)
+        service.get_current(coffee.id)
+        service.get_current(coffee.id)
+        assert collector.total('cache_misses_total') == 1
+        assert collector.total('cache_hits_total') == 1
+        assert collector.summary('load_seconds')[0] == 2
+        assert collector.summary('events_per_load') == (1, 3)
+        assert collector.total('rows_fetched_total') == 3
+        # the events of the miss, and none for the hit which was up to date
+        assert collector.summary('translate_seconds')[0] == 3
+        assert collector.summary('apply_seconds')[0] == 2
+        assert all(collector.summary(name)[1] > 0 for name in
+                   ('save_seconds', 'load_seconds', 'query_seconds', 'translate_seconds', 'apply_seconds'))
+
+    def test_batched_loads(self, transactional_db, test_users, collector):
+        service = MenuItemService(use_cache=False)
+        items = [service.create_menu_item(test_users[0], 'Item {}'.format(i), MenuItem.CATEGORY_DRINK, 100)
+                 for i in range(3)]
+        ids = [item.id for item in items]
+        queries = collector.summary('query_seconds')[0]
+
+        assert len(service.get_multiple_current(ids)) == 3
+        assert collector.total('rows_fetched_total') == 6
+        assert len(list(service.stream_multiple_current(ids))) == 3
+        assert collector.total('rows_fetched_total') == 12
+        assert collector.summary('query_seconds')[0] == queries + 2
+
+    def test_lazy_bytes_decoded(self, transactional_db, test_users, collector):
+        MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        ProjectionService(lazy=True).rebuild(MenuItemProjector())
+        assert collector.total('bytes_decoded_total') > len('{"name": "Coffee"}')
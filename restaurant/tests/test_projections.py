@@ -0,0 +1,145 @@
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
+from pytest import mark
+
+from restaurant.models import RestaurantView, MenuItemView, ProjectionCheckpoint
+from restaurant.projections.entities import MenuItem
+from restaurant.projections.projectors import RestaurantProjector, MenuItemProjector
+from restaurant.services.entities import RestaurantService, MenuItemService
+from restaurant.services.projections import ProjectionService
+from restaurant.services.rebuild import PartitionedRebuildService
+
+
+@mark.integration
+class TestProjections:
+
+    def test_catch_up_only_processes_new_events(self, transactional_db, test_users):
+        restaurant_service = RestaurantService()
+        projection_service = ProjectionService(batch_size=2)
+        projector = RestaurantProjector()
+
+        bobs = restaurant_service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        restaurant_service.hire_employees(test_users[0], bobs, ['Sam', 'Sally', 'Mark'])
+        assert projection_service.run(projector) == 4
+
+        view = RestaurantView.objects.get(id=bobs.id)
+        assert view.name == 'Bob\'s Cafe'
+        assert view.employees == ['Sam', 'Sally', 'Mark']
+        assert view.revision == 4
+
+        # menu item events are not of interest to the restaurant projector
+        menu_item = MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        restaurant_service.fire_employee(test_users[0], bobs, 'Sam')
+        restaurant_service.add_items_to_menu(test_users[0], bobs, [menu_item])
+        assert projection_service.run(projector) == 2
+        assert projection_service.run(projector) == 0
+
+        view = RestaurantView.objects.get(id=bobs.id)
+        assert view.employees == ['Sally', 'Mark']
+        assert view.menu_item_ids == [str(menu_item.id)]
+        assert view.revision == 6
+
+    def test_rebuild(self, transactional_db, test_users):
+        service = MenuItemService()
+        coffee = service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        tea = service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+        service.set_price(test_users[0], coffee, 275)
+
+        projection_service = ProjectionService()
+        projector = MenuItemProjector()
+        projection_service.run(projector)
+        MenuItemView.objects.filter(id=coffee.id).update(price_in_cents=0)
+
+        assert projection_service.rebuild(projector) == 5
+        assert MenuItemView.objects.get(id=coffee.id).price_in_cents == 275
+        assert MenuItemView.objects.get(id=tea.id).price_in_cents == 200
+        assert list(MenuItemView.objects.filter(category=MenuItem.CATEGORY_DRINK).order_by('name')
+                    .values_list('name', flat=True)) == ['Coffee', 'Tea']
+
+    def test_lazy_rebuild(self, transactional_db, test_users):
+        restaurant_service = RestaurantService()
+        bobs = restaurant_service.open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        restaurant_service.hire_employees(test_users[0], bobs, ['Sam', 'Sally'])
+        coffee = MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        restaurant_service.add_items_to_menu(test_users[0], bobs, [coffee])
+        restaurant_service.remove_items_from_menu(test_users[0], bobs, [coffee])
+
+        projection_service = ProjectionService(lazy=True)
+        assert projection_service.rebuild(RestaurantProjector()) == 5
+        assert projection_service.rebuild(MenuItemProjector()) == 2
+        view = RestaurantView.objects.get(id=bobs.id)
+        assert (view.name, view.employees, view.menu_item_ids) == ('Bob\'s Cafe', ['Sam', 'Sally'], [])
+        assert MenuItemView.objects.get(id=coffee.id).price_in_cents == 250
+
+    def test_partitioned_rebuild(self, transactional_db, test_users):
+        restaurant_service = RestaurantService()
+        restaurants = []
+        for i in range(12):
+            restaurant = restaurant_service.open_restaurant(test_users[0], 'Cafe {}'.format(i), '123 Test Street')
+            restaurant_service.hire_employees(test_users[0], restaurant, ['Employee {}'.format(i), 'Sam'])
+            restaurants.append(restaurant)
+        restaurant_service.fire_employee(test_users[0], restaurants[0], 'Sam')
+        MenuItemService().create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        projector = RestaurantProjector()
+        ProjectionService().run(projector)
+        expected = sorted(RestaurantView.objects.values_list('id', 'revision', 'name', 'employees'))
+        RestaurantView.objects.update(name='Stale')
+
+        progress = []
+        service = PartitionedRebuildService(partitions=3, batch_size=2, progress_interval=0.1)
+        assert service.rebuild(projector, lambda *update: progress.append(update)) == 37
+        assert sorted(RestaurantView.objects.values_list('id', 'revision', 'name', 'employees')) == expected
+        assert {partition for partition, _, _ in progress} == {0, 1, 2}
+        assert sum(max(count for partition, count, _ in progress if partition == k) for k in range(3)) == 37
+        position = ProjectionService().get_position(projector)
+        assert position == max(position for _, _, position in progress)
+        assert ProjectionCheckpoint.objects.filter(name__contains=':rebuild:').count() == 0
+
+        # interrupted after the first partition: only the others are replayed when resumed
+        restaurant_service.hire_employees(test_users[0], restaurants[1], ['Sally'])
+        assert service.prepare(projector) > position
+        first = service.rebuild_partition(projector, 0)
+        assert service.rebuild(projector) == 38 - first
+        assert RestaurantView.objects.get(id=restaurants[1].id).employees == ['Employee 1', 'Sam', 'Sally']
+        assert ProjectionService().run(projector) == 0
+
+    def test_rebuild_waits_for_open_writers(self, transactional_db, test_users):
+        menu_item_service = MenuItemService(use_cache=False)
+        inserted, release = threading.Event(), threading.Event()
+
+        def slow_save():
+            try:
+                with transaction.atomic():
+                    menu_item_service.create_menu_item(test_users[0], 'Tea', MenuItem.CATEGORY_DRINK, 200)
+                    inserted.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        writer = threading.Thread(target=slow_save)
+        writer.start()
+        inserted.wait(10)
+        # committed after the ids drawn by the open transaction
+        menu_item_service.create_menu_item(test_users[0], 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        projector = MenuItemProjector()
+
+        with pytest.raises(RuntimeError):
+            PartitionedRebuildService(partitions=2, settle_timeout=0.2).prepare(projector)
+        assert ProjectionCheckpoint.objects.filter(name__contains=':rebuild:').count() == 0
+
+        release.set()
+        writer.join()
+        assert PartitionedRebuildService(partitions=2).rebuild(projector) == 4
+        assert sorted(MenuItemView.objects.values_list('name', flat=True)) == ['Coffee', 'Tea']
+
+    def test_command(self, transactional_db, test_users):
+        RestaurantService().open_restaurant(test_users[0], 'Bob\'s Cafe', '123 Test Street')
+        call_command('run_projections')
+        assert RestaurantView.objects.count() == 1
+        call_command('run_projections', '--rebuild', 'restaurant_view')
+        assert RestaurantView.objects.count() == 1
+        call_command('run_projections', '--rebuild', '--partitions', '2', 'restaurant_view')
+        assert RestaurantView.objects.count() == 1
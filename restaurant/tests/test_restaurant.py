@@ -1,7 +1,13 @@
+import os
+import subprocess
+import sys
+import uuid
+
 from pytest import raises
 
-from restaurant.events.restaurant import RestaurantOpened
-from restaurant.projections.entities import Restaurant
+from restaurant.events.restaurant import RestaurantOpened, MenuItemAdded, MenuItemRemoved, EmployeeHired, \
+    EmployeeFired
+from restaurant.projections.entities import Restaurant, handles
 
 
 class TestRestaurantEvents:
@@ -57,3 +63,67 @@ class TestRestaurantEvents:
 
         with raises(ValueError):
             restaurant.apply(too_far)
+
+
+class TestEventDispatch:
+
+    def test_handlers_are_registered_per_class(self):
+        assert Restaurant.handler_for(MenuItemAdded) is Restaurant.apply_menu_item_added
+        # MenuItemRemoved extends MenuItemAdded, but has a handler of its own
+        assert Restaurant.handler_for(MenuItemRemoved) is Restaurant.apply_menu_item_removed
+        assert set(Restaurant().event_map().keys()) == {RestaurantOpened, EmployeeHired, EmployeeFired,
+                                                        MenuItemAdded, MenuItemRemoved}
+
+    def test_subclasses_inherit_and_override_handlers(self):
+        class RenamedRestaurant(Restaurant):
+            @handles(RestaurantOpened)
+            def apply_opened(self, event: RestaurantOpened) -> None:
+                super().apply_opened(event)
+                self.name = event.name.upper()
+
+        class MenuItemFeatured(MenuItemAdded):
+            @staticmethod
+            def get_event_type():
+                return None
+
+        restaurant = RenamedRestaurant()
+        restaurant.apply(RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', 100, 1))
+        menu_item_id = uuid.uuid4()
+        restaurant.apply(MenuItemFeatured(menu_item_id, 100, 2))
+        assert restaurant.name == 'BOB\'S CAFE'
+        assert restaurant.menu_item_ids == [menu_item_id]
+        assert RenamedRestaurant.snapshot_version() != Restaurant.snapshot_version()
+
+    def test_replay(self):
+        stream_id = uuid.uuid4()
+        events = [RestaurantOpened('Bob\'s Cafe', 2019, '123 Test Street', 100, 1)] + \
+            [EmployeeHired('Employee {}'.format(revision), 100, revision) for revision in range(2, 6)]
+        for event in events:
+            event.set_event_stream_id(stream_id)
+
+        restaurant = Restaurant(stream_id)
+        assert restaurant.replay(iter(events)) == 5
+        assert restaurant.revision == 5
+        assert len(restaurant.employees) == 4
+        assert restaurant.uncommitted_events == []
+
+        with raises(ValueError):
+            Restaurant(stream_id).replay(events[:2] + events[3:])
+
+    def test_snapshot_version_is_the_same_in_every_process(self):
+        # set constants, e.g. of `x in {...}`, iterate in an order which depends on the hash seed of the process
+        script = (
+            'from restaurant.events.restaurant import EmployeeHired\n'
+            'from restaurant.projections.entities import Restaurant, handles\n'
+            'class PickyRestaurant(Restaurant):\n'
+            '    @handles(EmployeeHired)\n'
+            '    def apply_hired(self, event):\n'
+            '        if event.employee_name not in {"Sam", "Sally", "Mark", "Alice", "Bob", "Carl", "Jim"}:\n'
+            '            super().apply_hired(event)\n'
+            'print(PickyRestaurant.snapshot_version(), Restaurant.snapshot_version())\n'
+        )
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        versions = {subprocess.run([sys.executable, '-c', script], cwd=root, check=True, stdout=subprocess.PIPE,
+                                   env=dict(os.environ, PYTHONHASHSEED=str(seed))).stdout
+                    for seed in range(1, 5)}
+        assert len(versions) == 1
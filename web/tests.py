@@ -1,4 +1,87 @@
-from django.test import TestCase
+from pytest import fixture, mark
 
-# Create your tests here.
+from restaurant import instrumentation
+from restaurant.models import User
+from restaurant.projections.entities import MenuItem
+from restaurant.services.entities import RestaurantService, MenuItemService
 
+
+@fixture
+def user(transactional_db) -> User:
+    return User.objects.create(first_name='Test', last_name='Testington', email='test@test.com')
+
+
+@mark.integration
+class TestReadApi:
+
+    def test_restaurant(self, client, user):
+        service = RestaurantService()
+        bobs = service.open_restaurant(user, 'Bob\'s Cafe', '123 Test Street', 2018)
+        service.hire_employees(user, bobs, ['Sam'])
+        coffee = MenuItemService().create_menu_item(user, 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        service.add_items_to_menu(user, bobs, [coffee])
+
+        response = client.get('/api/restaurants/{}'.format(bobs.id))
+        assert response.status_code == 200
+        assert response['ETag'] == '"{}-3"'.format(bobs.id.hex)
+        assert 'no-cache' in response['Cache-Control']
+        assert response.json() == {'id': str(bobs.id), 'revision': 3, 'name': 'Bob\'s Cafe', 'year_opened': 2018,
+                                   'address': '123 Test Street', 'employees': ['Sam'],
+                                   'menu_item_ids': [str(coffee.id)]}
+
+        response = client.get('/api/menu-items/{}'.format(coffee.id))
+        assert response.status_code == 200
+        assert response.json()['price_in_cents'] == 250
+
+    def test_conditional_get(self, client, user, django_assert_num_queries):
+        service = MenuItemService()
+        coffee = service.create_menu_item(user, 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+        url = '/api/menu-items/{}'.format(coffee.id)
+        etag = client.get(url)['ETag']
+
+        # a matching revision is answered from the stream catalog alone
+        with django_assert_num_queries(1):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+        # otherwise the catalog lookup, then the events after the cached revision: the catalog is not read twice
+        with django_assert_num_queries(2):
+            assert client.get(url).status_code == 200
+
+        service.set_price(user, coffee, 275)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert response.json()['price_in_cents'] == 275
+        assert client.head(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+        assert client.post(url).status_code == 405
+
+    def test_not_found(self, client, user):
+        bobs = RestaurantService().open_restaurant(user, 'Bob\'s Cafe', '123 Test Street')
+        assert client.get('/api/restaurants/{}'.format(MenuItem().id)).status_code == 404
+        assert client.get('/api/menu-items/{}'.format(bobs.id)).status_code == 404
+        assert client.get('/api/menu-items/{}'.format(bobs.id), HTTP_IF_NONE_MATCH='*').status_code == 404
+
+
+@mark.integration
+class TestMetrics:
+
+    def test_metrics(self, client, user, settings):
+        settings.METRICS_ENABLED = False
+        assert client.get('/metrics').status_code == 404
+
+        settings.METRICS_ENABLED = True
+        collector = instrumentation.get_prometheus_collector()
+        try:
+            coffee = MenuItemService().create_menu_item(user, 'Coffee', MenuItem.CATEGORY_DRINK, 250)
+            client.get('/api/menu-items/{}'.format(coffee.id))
+            response = client.get('/metrics')
+        finally:
+            instrumentation.unregister_collector(collector)
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        body = response.content.decode()
+        assert 'eventsource_save_seconds_count 1\n' in body
+        assert 'eventsource_events_saved_total 2\n' in body
+        assert 'eventsource_load_seconds_count' in body
@@ -4,4 +4,7 @@ import web.views as views
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('metrics', views.metrics, name='metrics'),
+    path('api/restaurants/<uuid:restaurant_id>', views.restaurant_detail, name='restaurant-detail'),
+    path('api/menu-items/<uuid:menu_item_id>', views.menu_item_detail, name='menu-item-detail'),
 ]
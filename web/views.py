@@ -1,5 +1,91 @@
-from django.http import HttpResponse, HttpRequest
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from django.conf import settings
+from django.http import HttpResponse, HttpRequest, JsonResponse, Http404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_safe
+
+from restaurant.instrumentation import get_prometheus_collector
+from restaurant.projections.entities import EventableEntity, Restaurant, MenuItem
+from restaurant.services.entities import BaseEntityService, RestaurantService, MenuItemService
 
 
 def index(request: HttpRequest) -> HttpResponse:
     return HttpResponse("Hello.. blah blah blah")
+
+
+@require_safe
+def metrics(request: HttpRequest) -> HttpResponse:
+    """The metrics of this process in the Prometheus text format, when METRICS_ENABLED"""
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        raise Http404('Metrics are disabled')
+    return HttpResponse(get_prometheus_collector().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def entity_etag(event_stream_id: UUID, revision: Optional[int]) -> Optional[str]:
+    """A stream only changes by appending events, so its id and head revision identify its state"""
+    if revision is None:
+        return None
+    return '"{}-{}"'.format(event_stream_id.hex, revision)
+
+
+def looked_up_etag(request: HttpRequest, event_stream_id: UUID, revision: Optional[int]) -> Optional[str]:
+    """The ETag of the revision looked up for the condition, which is kept on the request for the view"""
+    request.head_revision = revision
+    return entity_etag(event_stream_id, revision)
+
+
+def restaurant_etag(request: HttpRequest, restaurant_id: UUID) -> Optional[str]:
+    return looked_up_etag(request, restaurant_id, RestaurantService().get_revision(restaurant_id))
+
+
+def menu_item_etag(request: HttpRequest, menu_item_id: UUID) -> Optional[str]:
+    return looked_up_etag(request, menu_item_id, MenuItemService().get_revision(menu_item_id))
+
+
+def get_current_or_404(request: HttpRequest, service: BaseEntityService, id: UUID) -> EventableEntity:
+    # no stream of the service's aggregate type was found by the ETag lookup: streams of another type cannot be
+    # replayed by the service, they do not exist as far as it is concerned
+    entity = service.get_current(id) if request.head_revision is not None else None
+    if entity is None:
+        raise Http404('No {} {}'.format(service.__class__.__name__[:-len('Service')], id))
+    return entity
+
+
+def entity_response(entity: EventableEntity, data: Dict[str, Any]) -> JsonResponse:
+    response = JsonResponse(data)
+    # the ETag of the revision actually rendered, which may be newer than the one looked up for the condition
+    response['ETag'] = entity_etag(entity.id, entity.revision)
+    # caches may store the response, but have to revalidate it: a matching ETag costs a single catalog lookup
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_safe
+@condition(etag_func=restaurant_etag)
+def restaurant_detail(request: HttpRequest, restaurant_id: UUID) -> JsonResponse:
+    restaurant: Restaurant = get_current_or_404(request, RestaurantService(), restaurant_id)
+    return entity_response(restaurant, {
+        'id': str(restaurant.id),
+        'revision': restaurant.revision,
+        'name': restaurant.name,
+        'year_opened': restaurant.year_opened,
+        'address': restaurant.address,
+        'employees': restaurant.employees,
+        # ids only: the menu items are streams of their own, with their own revisions and ETags
+        'menu_item_ids': [str(menu_item_id) for menu_item_id in restaurant.menu_item_ids],
+    })
+
+
+@require_safe
+@condition(etag_func=menu_item_etag)
+def menu_item_detail(request: HttpRequest, menu_item_id: UUID) -> JsonResponse:
+    menu_item: MenuItem = get_current_or_404(request, MenuItemService(), menu_item_id)
+    return entity_response(menu_item, {
+        'id': str(menu_item.id),
+        'revision': menu_item.revision,
+        'name': menu_item.name,
+        'category': menu_item.category,
+        'price_in_cents': menu_item.price_in_cents,
+    })